@@ -0,0 +1,234 @@
+"""
+Сводки для администратора (Блок D)
+===================================
+Ответы завершённых интервью не отправляются администратору по одному из
+обработчика. ``AdminDigest.submit`` дописывает строку в локальный JSONL‑спул
+(без сети), а фоновая задача раз в ``interval`` секунд или при накоплении
+``max_entries`` записей отправляет всё накопленное одной сводкой: сообщением,
+если помещается, иначе — одним файлом.
+
+Доставка «хотя бы один раз»: позиция отправленного хранится рядом со спулом
+(``<spool>.offset``) и сдвигается только после успешной отправки, поэтому
+после рестарта неотправленное уйдёт снова. Строка, которую не удалось
+разобрать, откладывается в ``<spool>.bad`` и не задерживает остальные.
+
+Ответы записи (``answers``) — любой итерируемый объект, обычно
+``interview.SpooledAnswers``: они пишутся в спул по одному, прямо из файла
+интервью. Сводка тоже читается построчно, и текст сообщения собирается, только
+пока он помещается в лимит Telegram.
+"""
+
+from __future__ import annotations
+import asyncio, datetime as dt, json, logging, os
+from typing import Any, Dict, Iterable, List, Optional
+
+from telegram import Bot
+from telegram.error import BadRequest, TelegramError
+
+log = logging.getLogger("EtapBot.digest")
+
+MAX_MESSAGE = 4096
+
+
+class AdminDigest:
+    """Копит завершённые интервью в спуле и шлёт их администратору пачками."""
+
+    def __init__(self, chat_id: int, path: str, interval: float = 300, max_entries: int = 20):
+        self.chat_id = chat_id
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.interval = interval
+        self.max_entries = max_entries
+        self._spool = open(path, "ab")
+        self._drop_torn_tail()
+        self._sent = self._load_offset()
+        self.pending = self._count_pending()
+        self.delivered = 0
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()  # одна отправка за раз: позиция сдвигается по порядку
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self.bot: Optional[Bot] = None
+
+    # ── запись ────────────────────────────────────────────────────────────
+
+    def submit(self, record: Dict[str, Any]) -> None:
+        """Дописывает запись в спул. Сеть не трогает: возврат сразу."""
+        record = dict(record)
+        answers: Iterable[str] = record.pop("answers", ())
+        head = json.dumps(record, ensure_ascii=False)[:-1]
+        start = self._spool.tell()
+        try:
+            self._spool.write((head + (", " if record else "") + '"answers": [').encode())
+            for i, answer in enumerate(answers):
+                self._spool.write(((", " if i else "") + json.dumps(answer, ensure_ascii=False)).encode())
+            self._spool.write(b"]}\n")
+            self._spool.flush()
+        except BaseException:
+            self._spool.flush()
+            self._spool.truncate(start)
+            self._spool.seek(start)
+            raise
+        self.pending += 1
+        if self.pending >= self.max_entries:
+            self._wake.set()
+
+    # ── фоновая отправка ──────────────────────────────────────────────────
+
+    async def start(self, bot: Bot) -> None:
+        self.bot = bot
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Дожидается текущей отправки и пробует отправить остаток."""
+        self._closing = True
+        self._wake.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, 10)
+            except asyncio.TimeoutError:
+                pass
+            self._task = None
+        if self.pending:
+            log.warning("Admin digest: %d entries left in %s for next start", self.pending, self.path)
+
+    async def _run(self) -> None:
+        while True:
+            closing = self._closing
+            if not closing:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+            try:
+                await self.deliver()
+            except BadRequest:
+                log.error(f"Could not send message to CHAT_ID_ADMIN {self.chat_id}. "
+                          f"The chat was not found. Please ensure the admin has started the bot.")
+            except TelegramError as exc:
+                log.error("Admin digest delivery failed, will retry: %s", exc)
+            except Exception:
+                # Задача должна пережить любую ошибку: иначе сводки молча перестанут уходить
+                log.exception("Admin digest delivery failed, will retry")
+            if closing:
+                return
+
+    async def deliver(self) -> int:
+        """Отправляет всё неотправленное одной сводкой. Возвращает число записей."""
+        async with self._lock:
+            if not self.pending or self.bot is None:
+                return 0
+            return await self._deliver()
+
+    async def _deliver(self) -> int:
+        end = self._spool.tell()
+        count, parts, size = 0, [], 0
+        bad: List[bytes] = []
+        with open(self.path, "rb") as f:
+            f.seek(self._sent)
+            while f.tell() < end:
+                line = f.readline()
+                if not line.strip():
+                    continue
+                if size <= MAX_MESSAGE:  # дальше сообщение уже не поместится — только считаем
+                    try:
+                        part = format_entry(json.loads(line))
+                    except (ValueError, KeyError, TypeError) as exc:
+                        log.error("Admin digest: unreadable entry in %s: %r", self.path, exc)
+                        bad.append(line)
+                        continue
+                    parts.append(part)
+                    size += len(part) + 1
+                count += 1
+            if not count:
+                if bad:
+                    self._quarantine(bad)
+                    self._commit(end, 0, len(bad))
+                return 0
+            text = "\n".join([_title(count)] + parts)
+            if len(text) > MAX_MESSAGE:
+                f.seek(self._sent)
+                raw = f.read(end - self._sent)
+
+        if len(text) <= MAX_MESSAGE:
+            await self.bot.send_message(self.chat_id, text)
+        else:
+            stamp = dt.datetime.now().strftime("%Y%m%d-%H%M%S")
+            await self.bot.send_document(
+                self.chat_id, document=raw, filename=f"etap7d-D-{stamp}.jsonl",
+                caption=_title(count),
+            )
+        self._quarantine(bad)
+        self._commit(end, count, len(bad))
+        return count
+
+    def _quarantine(self, lines: List[bytes]) -> None:
+        """Откладывает неразобранные строки в ``<spool>.bad``, чтобы позиция прошла дальше."""
+        if not lines:
+            return
+        with open(self.path + ".bad", "ab") as f:
+            for line in lines:
+                f.write(line if line.endswith(b"\n") else line + b"\n")
+        log.warning("Admin digest: moved %d unreadable entries to %s.bad", len(lines), self.path)
+
+    # ── позиция отправленного ─────────────────────────────────────────────
+
+    def _commit(self, end: int, count: int, skipped: int = 0) -> None:
+        self._sent = end
+        self.pending -= count + skipped
+        self.delivered += count
+        if self._spool.tell() == end:
+            # всё отправлено и новых записей нет — спул можно обнулить
+            self._spool.truncate(0)
+            self._spool.seek(0)
+            self._sent = 0
+        tmp = self.offset_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(self._sent))
+        os.replace(tmp, self.offset_path)
+
+    def _drop_torn_tail(self) -> None:
+        """Обрезает недописанную последнюю строку (процесс упал посреди submit)."""
+        size = self._spool.tell()
+        if not size:
+            return
+        with open(self.path, "rb") as f:
+            pos = size
+            while pos > 0:
+                step = min(4096, pos)
+                f.seek(pos - step)
+                block = f.read(step)
+                cut = block.rfind(b"\n")
+                if cut >= 0:
+                    pos = pos - step + cut + 1
+                    break
+                pos -= step
+        if pos < size:
+            log.warning("Admin digest: dropped %d bytes of an unfinished entry in %s", size - pos, self.path)
+            self._spool.truncate(pos)
+            self._spool.seek(pos)
+
+    def _load_offset(self) -> int:
+        try:
+            with open(self.offset_path) as f:
+                return min(int(f.read().strip() or 0), self._spool.tell())
+        except FileNotFoundError:
+            return 0
+
+    def _count_pending(self) -> int:
+        with open(self.path, "rb") as f:
+            f.seek(self._sent)
+            return sum(1 for line in f if line.strip())
+
+    def close(self) -> None:
+        self._spool.close()
+
+
+def _title(count: int) -> str:
+    return f"#Etap7D ответы D: {count} интервью"
+
+
+def format_entry(e: Dict[str, Any]) -> str:
+    return f"\nот {e['user_id']} ({e['ts']}):\n" + json.dumps(e["answers"], ensure_ascii=False, indent=2)
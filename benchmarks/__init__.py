@@ -0,0 +1 @@
+"""Бенчмарки бота «Этап‑Тест 7D». Запуск из корня репозитория: ``python -m benchmarks.<имя>``."""
@@ -0,0 +1,85 @@
+"""
+Цена дублей и устаревших нажатий.
+
+    python -m benchmarks.bench_callbacks [--users 50]
+
+Каждое нажатие A/B/C доставляется вместе с дублем (двойной тап / повтор
+доставки) и с повтором предыдущего нажатия (пришло не по порядку). Сколько
+запросов к Bot API добавляют лишние нажатия и сколько стоит обработка
+отброшенного колбэка. Что ответы записываются ровно один раз, проверяет
+tests/test_callbacks.py.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, copy, logging, random, time
+
+from telegram import Update
+
+import etap_test_bot as bot
+from questions import parse_answer
+from benchmarks.fake_telegram import FakeBotAPI, UpdateTracker, update_ids, fake_builder, walk_user
+
+
+def replayed(data):
+    dup = copy.deepcopy(data)
+    dup["update_id"] = next(update_ids)
+    dup["callback_query"]["id"] = str(next(update_ids))
+    return dup
+
+
+async def run(users: int, replay: bool):
+    api = FakeBotAPI()
+    app = bot.build_app(fake_builder(api), concurrent_updates=64)
+    tracker = UpdateTracker(app)
+
+    async def deliver(data):
+        await app.update_queue.put(Update.de_json(data, app.bot))
+
+    feed_one = tracker.feed(deliver)
+    last_tap = {}
+
+    async def feed(data):
+        cq = data.get("callback_query")
+        if cq is None or parse_answer(cq["data"]) is None:
+            await feed_one(data)
+            return
+        uid = cq["from"]["id"]
+        extra = [replayed(data), replayed(last_tap[uid])] if replay and uid in last_tap else []
+        last_tap[uid] = data
+        await asyncio.gather(feed_one(data), *map(feed_one, extra))
+
+    async with app:
+        await app.start()
+        rng = random.Random(11)
+        uids = range(1000, 1000 + users)
+        await asyncio.gather(*(walk_user(app, api, uid, rng, feed=feed) for uid in uids))
+        calls = sum(api.calls.values()) - api.calls["answerCallbackQuery"]
+
+        stale_cost = None
+        if replay:
+            stale = Update.de_json(replayed(last_tap[uids[0]]), app.bot)
+            n = 20_000
+            t0 = time.perf_counter()
+            for _ in range(n):
+                await app.process_update(stale)
+            stale_cost = (time.perf_counter() - t0) / n
+        await app.stop()
+    return calls, stale_cost
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=50)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    clean_calls, _ = await run(args.users, replay=False)
+    replay_calls, stale_cost = await run(args.users, replay=True)
+    taps = len(bot.CONTENT.current.questions)
+    print(f"users={args.users}, {taps} answers each, +{2 * (taps - 1)} duplicate/out-of-order callbacks each")
+    print(f"Bot API calls besides answerCallbackQuery: clean run {clean_calls}, with replays {replay_calls}")
+    print(f"dropped callback cost: {stale_cost * 1e6:.1f} µs (full PTB dispatch, answer sent in the background)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,176 @@
+"""
+Версии вопросов и интерпретаций: поиск уровня, проверка и горячая замена.
+
+    python -m benchmarks.bench_content [--users 20]
+
+1. Поиск уровня по баллу: прежний линейный проход по ``levels`` против
+   индекса ``Content.level``.
+2. Проверка: испорченные копии файлов (дыра и пересечение диапазонов,
+   пропущенный этап, слишком короткий блок B, лишний блок) отклоняются.
+3. Горячая замена: ``--users`` проходят тест до середины, файлы на диске
+   меняются (новое описание уровней и лишний вопрос в B7), наблюдатель
+   подменяет версию. Начатые тесты доходят до результата со старыми
+   вопросами и текстами, новые получают новую версию; битый файл не
+   подменяет текущую версию.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, copy, json, logging, os, random, shutil, tempfile, time
+
+from telegram import Update
+
+import etap_test_bot as bot
+from content import Content, ContentError, ContentStore
+from benchmarks.fake_telegram import FakeBotAPI, callback_update, fake_builder, walk_user
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATES = (bot.A, bot.B, bot.C)
+
+
+def legacy_level(stage_data, score):
+    """Прежний get_level_key: перебор уровней при каждом результате."""
+    for level_key, level_info in stage_data["levels"].items():
+        min_score, max_score = level_info["range"]
+        if min_score <= score <= max_score:
+            return level_key
+    return None
+
+
+def lookups(content: Content, n: int = 200_000) -> None:
+    rng = random.Random(3)
+    sizes = {int(key[1:]): size for key, _, size in content.b_layout}
+    queries = [(s, rng.randint(0, sizes[s] * 4) if s else 0) for s in (rng.randint(0, 7) for _ in range(n))]
+    interp = content.interpretations
+    t0 = time.perf_counter()
+    old = [legacy_level(interp[str(s)], score) for s, score in queries]
+    t_old = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    new = [content.level(s, score)[1] for s, score in queries]
+    t_new = time.perf_counter() - t0
+    assert old == new
+    print(f"level lookup: linear scan {t_old / n * 1e9:.0f} ns, index {t_new / n * 1e9:.0f} ns "
+          f"(same level for all {n} queries)")
+
+
+def validation(block_b, interp) -> None:
+    def gap(b, i):
+        i["3"]["levels"]["medium"]["range"][0] += 2
+
+    def overlap(b, i):
+        i["5"]["levels"]["high"]["range"][0] -= 1
+
+    def uncovered_top(b, i):
+        i["7"]["levels"]["high"]["range"][1] = 50
+
+    def missing_stage(b, i):
+        del i["4"]
+
+    def short_block(b, i):
+        b["B2"] = b["B2"][:6]
+
+    def extra_block(b, i):
+        b["B8"] = ["?"]
+
+    def no_description(b, i):
+        del i["1"]["levels"]["low"]["description"]
+
+    check = bot.content_loader(bot.ENGINE.rules)  # правила — в хуке загрузки, как в боте
+    check(Content("ok", bot.BLOCK_A, block_b, bot.BLOCK_C, interp, STATES))
+    for case in (gap, overlap, uncovered_top, missing_stage, short_block, extra_block, no_description):
+        b, i = copy.deepcopy(block_b), copy.deepcopy(interp)
+        case(b, i)
+        try:
+            check(Content("bad", bot.BLOCK_A, b, bot.BLOCK_C, i, STATES))
+        except ContentError as exc:
+            print(f"  rejected {case.__name__:<15}: {exc}")
+        else:
+            raise AssertionError(f"{case.__name__} passed validation")
+
+
+async def finish(app, api: FakeBotAPI, uid: int, rng: random.Random) -> None:
+    """Продолжает начатый тест до экрана результата."""
+    while "startD" not in api.keyboards[uid]:
+        version = api.version[uid]
+        data = callback_update(uid, rng.choice(api.keyboards[uid]), api.last_message_id[uid])
+        await app.process_update(Update.de_json(data, app.bot))
+        await api.wait_reply(uid, version)
+
+
+async def hot_swap(args, tmp: str) -> None:
+    b_path, i_path = os.path.join(tmp, "questions_b.json"), os.path.join(tmp, "interpretations.json")
+    for path in (b_path, i_path):
+        shutil.copy(os.path.join(HERE, os.path.basename(path)), path)
+    store = bot.CONTENT = ContentStore(b_path, i_path, bot.BLOCK_A, bot.BLOCK_C, STATES, interval=0.05,
+                                       on_load=bot.content_loader(bot.ENGINE.rules))
+    v1 = store.current
+
+    api = FakeBotAPI()
+    app = bot.build_app(fake_builder(api), watch_content=True)
+    rng = random.Random(11)
+    old_users, new_users = range(1000, 1000 + args.users), range(2000, 2000 + args.users)
+    async with app:
+        await app.post_init(app)
+        await app.start()
+        await asyncio.gather(*(walk_user(app, api, uid, rng, max_taps=40) for uid in old_users))
+
+        with open(b_path, encoding="utf-8") as f:
+            block_b = json.load(f)
+        with open(i_path, encoding="utf-8") as f:
+            interp = json.load(f)
+        block_b["B7"].append("Новый вопрос блока B7.")
+        for stage in interp.values():
+            for level in stage["levels"].values():
+                level["description"] += " (v2)"
+        # Замена файла целиком: запись во временный и os.replace
+        for path, data in ((b_path, block_b), (i_path, interp)):
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+        t0 = time.perf_counter()
+        while store.current is v1:
+            await asyncio.sleep(0.01)
+        print(f"hot swap: version {v1.version} → {store.current.version} "
+              f"picked up in {(time.perf_counter() - t0) * 1e3:.0f} ms")
+        v2 = store.current
+
+        await asyncio.gather(*(finish(app, api, uid, rng) for uid in old_users),
+                             *(walk_user(app, api, uid, rng) for uid in new_users))
+        for uid in old_users:
+            sess = app.user_data[uid]["sess"]
+            assert sess.content is v1 and sess.n_scale == v1.n_scale, uid
+            assert "(v2)" not in api.last_text[uid] and "Детальные результаты" in api.last_text[uid]
+        for uid in new_users:
+            sess = app.user_data[uid]["sess"]
+            assert sess.content is v2 and sess.n_scale == v2.n_scale == v1.n_scale + 1, uid
+            assert bot.report_data(sess)["interpretation"]["description"].endswith("(v2)")
+        print(f"  {args.users} tests in progress finished on {v1.version} ({v1.n_scale} A/B answers), "
+              f"{args.users} new tests ran on {v2.version} ({v2.n_scale} A/B answers): OK")
+
+        with open(i_path, "w", encoding="utf-8") as f:
+            f.write('{"0": ')
+        await asyncio.sleep(0.2)
+        assert store.current is v2
+        print(f"  truncated interpretations.json rejected, still on {store.current.version}: OK")
+        await app.stop()
+        await app.post_stop(app)
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=20)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    lookups(bot.CONTENT.current)
+    print("validation:")
+    with open(os.path.join(HERE, "questions_b.json"), encoding="utf-8") as f:
+        block_b = json.load(f)
+    with open(os.path.join(HERE, "interpretations.json"), encoding="utf-8") as f:
+        interp = json.load(f)
+    validation(block_b, interp)
+    with tempfile.TemporaryDirectory() as tmp:
+        await hot_swap(args, tmp)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+"""
+Ответы D администратору: сообщение из обработчика против сводок из спула.
+
+    python -m benchmarks.bench_digest [--users 60] [--admin-latency 0.5]
+
+Пользователи проходят тест до конца вместе с Блоком D, а чат администратора
+отвечает медленно (``--admin-latency``). Сравниваются время последнего ответа
+D (от отправки до «Спасибо» и финального сообщения) и число запросов к чату
+администратора. Затем проверяется доставка «хотя бы один раз»: администратор
+недоступен, процесс перезапускается, и после восстановления доходят все записи.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, json, logging, os, random, statistics, tempfile
+
+import etap_test_bot as bot
+from admin_digest import AdminDigest
+from benchmarks.fake_telegram import FakeBotAPI, fake_builder, walk_user
+
+ADMIN = 999_999
+
+
+async def legacy_d_handler(update, ctx):
+    """Прежний путь: сообщение администратору отправляется прямо из обработчика."""
+    sess = ctx.user_data["sess"]
+    sess.d_answers.append(update.message.text.strip())
+    d_idx = len(sess.d_answers)
+    if d_idx >= len(bot.BLOCK_D):
+        await update.message.reply_text("Спасибо! Вы завершили интервью.")
+        await ctx.bot.send_message(ADMIN, f"#Etap7D ответы D от {update.effective_user.id}:\n"
+                                   + json.dumps(list(sess.d_answers), ensure_ascii=False, indent=2))
+        return await bot.end_conv(update, ctx)
+    await update.message.reply_text(f"D{d_idx+1}/{len(bot.BLOCK_D)}\n{bot.BLOCK_D[d_idx]}")
+    return bot.D
+
+
+async def run(users: int, admin_latency: float, spool: str = ""):
+    api = FakeBotAPI(slow_chats={ADMIN: admin_latency})
+    digest = AdminDigest(ADMIN, spool, interval=3600, max_entries=25) if spool else None
+    handler = bot.d_handler
+    if digest is None:
+        bot.d_handler = legacy_d_handler
+    try:
+        app = bot.build_app(fake_builder(api), concurrent_updates=64, admin_digest=digest)
+    finally:
+        bot.d_handler = handler
+
+    await app.initialize()
+    if digest is not None:
+        await app.post_init(app)
+    rng = random.Random(3)
+    finals = []
+
+    async def one(uid):
+        lat = []
+        await walk_user(app, api, uid, rng, latencies=lat)
+        finals.append(lat[-1])
+
+    await asyncio.gather(*(one(uid) for uid in range(1000, 1000 + users)))
+    if digest is not None:
+        await app.post_stop(app)
+        digest.close()
+    await app.shutdown()
+    return finals, api, digest
+
+
+async def restart_check(tmp: str, users: int) -> None:
+    spool = os.path.join(tmp, "restart.jsonl")
+    api = FakeBotAPI()
+    api.down_chats.add(ADMIN)
+    app = bot.build_app(fake_builder(api))
+    await app.initialize()
+    digest = AdminDigest(ADMIN, spool, interval=3600, max_entries=10 ** 6)
+    await digest.start(app.bot)
+    for uid in range(users):
+        digest.submit({"user_id": uid, "ts": "2026-01-01T00:00:00", "answers": [f"ответ {uid}"]})
+    await digest.stop()  # администратор недоступен — всё осталось в спуле
+    digest.close()
+    assert digest.pending == users and api.version[ADMIN] == 0
+
+    api.down_chats.clear()
+    digest = AdminDigest(ADMIN, spool, interval=3600, max_entries=10 ** 6)  # «перезапуск»
+    assert digest.pending == users
+    await digest.start(app.bot)
+    await digest.stop()
+    digest.close()
+    await app.shutdown()
+    assert digest.pending == 0 and digest.delivered == users
+    assert os.path.getsize(spool) == 0
+    print(f"restart  : admin down, {users} entries kept in spool across restart, "
+          f"delivered after recovery in {api.version[ADMIN]} request(s): OK")
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=60)
+    ap.add_argument("--admin-latency", type=float, default=0.5)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        finals, api, _ = await run(args.users, args.admin_latency)
+        print(f"inline   : last D answer p50={statistics.median(finals) * 1e3:7.1f} ms "
+              f"max={max(finals) * 1e3:7.1f} ms, {api.version[ADMIN]} admin requests")
+        finals, api, digest = await run(args.users, args.admin_latency, os.path.join(tmp, "spool.jsonl"))
+        assert digest.delivered == args.users and digest.pending == 0
+        print(f"digest   : last D answer p50={statistics.median(finals) * 1e3:7.1f} ms "
+              f"max={max(finals) * 1e3:7.1f} ms, {api.version[ADMIN]} admin requests "
+              f"for {digest.delivered} interviews")
+        await restart_check(tmp, args.users)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+"""
+CPU‑время обработчика на одно нажатие: прежняя сборка клавиатуры и текста на
+каждый вызов против готовой таблицы ``QUESTIONS``.
+
+    python -m benchmarks.bench_handlers [--runs 2000]
+
+Обработчик вызывается напрямую с заглушками Update/Context (без PTB и сети),
+так что измеряется только собственная работа хендлера.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, logging, random, time
+
+from telegram import InlineKeyboardButton as Btn, InlineKeyboardMarkup as Markup
+
+import etap_test_bot as bot
+from questions import SCALE
+
+
+class _Query:
+    __slots__ = ("data", "sent")
+
+    def __init__(self):
+        self.data = "start_A"
+        self.sent = None
+
+    async def edit_message_text(self, text, reply_markup=None, **kw):
+        self.sent = (text, reply_markup)
+
+    async def answer(self, *a, **kw):
+        pass
+
+
+class _Update:
+    def __init__(self):
+        self.callback_query = _Query()
+
+
+class _Bot:
+    rate_limiter = None
+
+
+class _Ctx:
+    def __init__(self):
+        self.user_data = {}
+        self.bot = _Bot()
+        self.bot_data = {}
+
+
+async def legacy_ask(update, ctx):
+    """Прежний путь: арифметика позиции, Btn/Markup и f‑строка на каждое нажатие."""
+    sess = ctx.user_data["sess"]
+    data = update.callback_query.data
+    if data.startswith("ans"):
+        _, v = data.split("|")
+        sess.record(1 if v == "True" else 0 if v == "False" else int(v))
+    pos = sess.pos
+    if pos < len(bot.BLOCK_A):
+        kb = [[Btn(s, callback_data=f"ansA|{s}") for s in SCALE]]
+        text, state = f"A{pos+1}/{len(bot.BLOCK_A)}\n{bot.BLOCK_A[pos]}", bot.A
+    elif pos < bot.CONTENT.current.n_scale:
+        rest = pos - len(bot.BLOCK_A)
+        for key, _, n in bot.CONTENT.current.b_layout:
+            if rest < n:
+                break
+            rest -= n
+        kb = [[Btn(s, callback_data=f"ansB|{s}") for s in SCALE]]
+        text, state = f"{key}-{rest+1}/{n}\n{bot.CONTENT.current.block_b[key][rest]}", bot.B
+    elif sess.c_idx < len(bot.BLOCK_C):
+        kb = [[Btn("True", callback_data="ansC|True"), Btn("False", callback_data="ansC|False")]]
+        text, state = f"C{sess.c_idx+1}/{len(bot.BLOCK_C)}\n{bot.BLOCK_C[sess.c_idx]}", bot.C
+    else:
+        return bot.RESULT
+    await update.callback_query.edit_message_text(text, reply_markup=Markup(kb))
+    return state
+
+
+async def new_ask(update, ctx):
+    # show_result в замер не входит — он одинаков для обоих путей
+    if ctx.user_data["sess"].pos == len(bot.CONTENT.current.questions) - 1 and update.callback_query.data.startswith("q|"):
+        ctx.user_data["sess"].record(0)
+        return bot.RESULT
+    return await bot.ask(update, ctx)
+
+
+async def run(handler, runs: int) -> float:
+    rng = random.Random(5)
+    update, ctx = _Update(), _Ctx()
+    taps = 0
+    t0 = time.process_time()
+    for _ in range(runs):
+        ctx.user_data["sess"] = bot.Session()
+        update.callback_query.data = "start_A"
+        while await handler(update, ctx) != bot.RESULT:
+            markup = update.callback_query.sent[1]
+            update.callback_query.data = rng.choice(markup.inline_keyboard[0]).callback_data
+            taps += 1
+    return (time.process_time() - t0) / taps
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=2000)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    before = await run(legacy_ask, args.runs)
+    after = await run(new_ask, args.runs)
+    print(f"per-tap handler CPU: before {before * 1e6:6.2f} µs, after {after * 1e6:6.2f} µs "
+          f"({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,249 @@
+"""
+Ответы Блока D: файл интервью вместо списка в памяти сессии.
+
+    python -m benchmarks.bench_interview [--users 200] [--answer-chars 1500]
+
+1. Память: ``--users`` сессий посреди интервью с длинными ответами — список
+   строк в сессии против ``SpooledAnswers`` (только смещения); сколько байт
+   ответы занимают на диске.
+2. Лимиты: длинный ответ сокращается до ``D_ANSWER_MAX_CHARS``, интервью —
+   до ``D_SESSION_MAX_CHARS``; пользователь получает пометку, счётчик растёт.
+3. Итог: сводка администратору пишется из файла интервью по одному ответу
+   (пик памяти записи — против прежней записи списка), большая сводка уходит
+   файлом; PDF рисуется в пуле из того же файла, после чего файл удаляется.
+4. Восстановление: сессия сохранена посреди интервью, процесс «упал» после
+   записи ещё одного кадра; восстановленная сессия видит сохранённые ответы,
+   лишний кадр не учитывается, интервью доходит до конца.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, gc, json, logging, os, pickle, random, tempfile, tracemalloc
+
+from telegram import Update
+
+import etap_test_bot as bot
+from admin_digest import AdminDigest
+from interview import InterviewSpool
+from report import ReportRenderer
+from benchmarks.fake_telegram import FakeBotAPI, callback_update, fake_builder, text_update
+
+ADMIN = 999_999
+
+
+def answer_text(rng: random.Random, chars: int) -> str:
+    words = ["энергия", "тело", "практика", "сон", "спокойствие", "благодарность", "работа", "дыхание"]
+    text = ""
+    while len(text) < chars:
+        text += rng.choice(words) + " "
+    return text[:chars]
+
+
+def memory(args, spool: InterviewSpool) -> None:
+    rng = random.Random(1)
+    answers = [[answer_text(rng, args.answer_chars) for _ in range(7)] for _ in range(args.users)]
+
+    def measure(build) -> int:
+        gc.collect()
+        tracemalloc.start()
+        held = build()
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del held
+        return size
+
+    def as_lists():
+        out = []
+        for texts in answers:
+            sess = bot.Session()
+            sess.d_answers = [t.encode().decode() for t in texts]  # как из апдейта: свои строки
+            out.append(sess)
+        return out
+
+    def as_spool():
+        out = []
+        for uid, texts in enumerate(answers):
+            sess = bot.Session()
+            sess.d_answers = spool.new(uid)
+            for t in texts:
+                spool.add(sess.d_answers, t)
+            out.append(sess)
+        return out
+
+    lists, spooled = measure(as_lists), measure(as_spool)
+    disk = sum(e.stat().st_size for e in os.scandir(spool.directory))
+    raw = sum(len(t.encode()) for texts in answers for t in texts)
+    print(f"memory: {args.users} sessions × 7 answers × {args.answer_chars} chars — "
+          f"list {lists / args.users:.0f} B/session, spooled {spooled / args.users:.0f} B/session "
+          f"({lists / spooled:.0f}x less); on disk {disk / args.users:.0f} B/session "
+          f"({raw / disk:.1f}x compressed)")
+    assert spooled * 5 < lists
+    for entry in os.scandir(spool.directory):
+        os.remove(entry.path)
+
+
+async def to_interview(app, api: FakeBotAPI, uid: int) -> None:
+    """Проходит A/B/C и открывает Блок D."""
+    rng = random.Random(uid)
+    await app.process_update(Update.de_json(text_update(uid, "/start"), app.bot))
+    while "startD" not in api.keyboards[uid]:
+        data = callback_update(uid, rng.choice(api.keyboards[uid]), api.last_message_id[uid])
+        await app.process_update(Update.de_json(data, app.bot))
+    await app.process_update(Update.de_json(callback_update(uid, "startD", api.last_message_id[uid]), app.bot))
+
+
+async def say(app, api: FakeBotAPI, uid: int, text: str) -> str:
+    await app.process_update(Update.de_json(text_update(uid, text), app.bot))
+    return api.last_text[uid]
+
+
+async def limits_and_final(args, tmp: str) -> None:
+    spool = bot.ANSWERS = InterviewSpool(os.path.join(tmp, "limits"), answer_limit=1000, session_limit=5000)
+    digest = AdminDigest(ADMIN, os.path.join(tmp, "admin.jsonl"), interval=3600, max_entries=1000)
+    renderer = ReportRenderer(bot.BLOCK_D, workers=1)
+    api = FakeBotAPI()
+    sent = []
+    handle = api.handle
+
+    def record(method, params):
+        if method == "sendDocument":
+            sent.append(params)
+        return handle(method, params)
+
+    api.handle = record
+    app = bot.build_app(fake_builder(api), admin_digest=digest, report_renderer=renderer)
+    rng = random.Random(2)
+    uid = 1000
+    async with app:
+        await app.post_init(app)
+        await app.start()
+        await to_interview(app, api, uid)
+        truncated = spool.truncated.value
+        reply = await say(app, api, uid, answer_text(rng, 1500))
+        assert reply.startswith("(Ответ сохранён не полностью: первые 999 символов.)") and "D2/" in reply
+        for _ in range(4):
+            await say(app, api, uid, answer_text(rng, 900))
+        reply = await say(app, api, uid, answer_text(rng, 900))
+        assert "первые 399 символов" in reply, reply
+        reply = await say(app, api, uid, "ещё ответ")
+        assert reply.startswith("(Достигнут предел длины интервью"), reply
+        sess = app.user_data[uid]["sess"]
+        stored = list(sess.d_answers)
+        assert sess.d_answers.chars <= 5000 + 1 and [len(a) for a in stored] == [1000, 900, 900, 900, 900, 400, 1]
+        assert spool.truncated.value - truncated == 3
+        print(f"limits: answer cut to 1000 chars, interview to 5000 "
+              f"({[len(a) for a in stored]}), user notified each time, counter +3: OK")
+
+        path = sess.d_answers.path
+        for i in range(len(stored), len(bot.BLOCK_D) - 1):
+            await say(app, api, uid, f"короткий ответ {i}")
+        await say(app, api, uid, "последний ответ")
+        for _ in range(100):  # PDF рисуется в пуле
+            if not os.path.exists(path) and api.calls["sendDocument"]:
+                break
+            await asyncio.sleep(0.05)
+        assert not os.path.exists(path), "interview file left after the report"
+        assert sent and int(sent[0]["chat_id"]) == uid
+
+        # сводка: запись из файла интервью, большая сводка — документом
+        with open(digest.path, encoding="utf-8") as f:
+            entry = json.loads(f.readline())
+        assert entry["user_id"] == uid and entry["answers"][:len(stored)] == stored and len(entry["answers"]) == len(bot.BLOCK_D)
+        total = sum(len(a.encode()) for a in entry["answers"])
+        delivered = await digest.deliver()
+        assert delivered == 1 and int(sent[-1]["chat_id"]) == ADMIN
+        assert sent[-1]["caption"] == "#Etap7D ответы D: 1 интервью"
+        print(f"final: digest entry streamed from the interview file ({total} B of answers), "
+              f"sent to admin as a file; PDF rendered from the file in the pool, file removed: OK")
+        await app.stop()
+        await app.post_stop(app)
+    digest.close()
+
+
+def submit_peak(tmp: str) -> None:
+    """Пик памяти записи в спул: одной строкой JSON из списка против потока из файла интервью."""
+    spool = InterviewSpool(os.path.join(tmp, "peak"), answer_limit=4000, session_limit=40_000)
+    answers = spool.new(1)
+    rng = random.Random(3)
+    for _ in range(len(bot.BLOCK_D)):
+        spool.add(answers, answer_text(rng, 4000))
+    digest = AdminDigest(ADMIN, os.path.join(tmp, "peak.jsonl"))
+    peaks = []
+    for build in (lambda: {"user_id": 1, "ts": "x", "answers": list(answers)},
+                  lambda: {"user_id": 1, "ts": "x", "answers": answers}):
+        gc.collect()
+        tracemalloc.start()
+        digest.submit(build())
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    digest.close()
+    with open(digest.path, encoding="utf-8") as f:
+        first, second = map(json.loads, f)
+    assert first == second
+    size = sum(len(a.encode()) for a in first["answers"])
+    print(f"digest submit: {size // 1024} KiB of answers — from a list peak {peaks[0] // 1024} KiB, "
+          f"streamed from the file peak {peaks[1] // 1024} KiB, same JSONL line")
+    assert peaks[1] * 2 < peaks[0]
+
+
+async def recovery(tmp: str) -> None:
+    spool = bot.ANSWERS = InterviewSpool(os.path.join(tmp, "recovery"))
+    digest = AdminDigest(ADMIN, os.path.join(tmp, "admin2.jsonl"), interval=3600, max_entries=1000)
+    api = FakeBotAPI()
+    app = bot.build_app(fake_builder(api), admin_digest=digest)
+    uid = 2000
+    async with app:
+        await app.post_init(app)
+        await app.start()
+        await to_interview(app, api, uid)
+        for i in range(4):
+            await say(app, api, uid, f"ответ {i}")
+        saved = pickle.dumps(app.user_data[uid]["sess"])  # как в хранилище сессий
+        await say(app, api, uid, "ответ 4, не сохранённый до падения")
+        await app.stop()
+        await app.post_stop(app)
+
+    sess = pickle.loads(saved)
+    assert list(sess.d_answers) == [f"ответ {i}" for i in range(4)]
+    size = os.path.getsize(sess.d_answers.path)
+    print(f"recovery: session saved with 4 answers, a 5th frame written before the crash; "
+          f"restored session reads 4 answers from {size} B on disk: OK")
+
+    api = FakeBotAPI()
+    app = bot.build_app(fake_builder(api), admin_digest=digest)
+    async with app:
+        await app.post_init(app)
+        await app.start()
+        app.user_data[uid]["sess"] = sess
+        conv = app.handlers[0][0]
+        conv._conversations[(uid, uid)] = bot.D
+        for i in range(4, len(bot.BLOCK_D)):
+            await say(app, api, uid, f"ответ {i} после рестарта")
+        with open(digest.path, encoding="utf-8") as f:
+            entry = json.loads(f.readlines()[-1])
+        assert entry["answers"] == [f"ответ {i}" for i in range(4)] + [
+            f"ответ {i} после рестарта" for i in range(4, len(bot.BLOCK_D))]
+        assert not os.path.exists(sess.d_answers.path)
+        print(f"  interview finished after restart: admin got {len(entry['answers'])} answers, "
+              f"the unsaved frame skipped: OK")
+        await app.stop()
+        await app.post_stop(app)
+    digest.close()
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--answer-chars", type=int, default=1500)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        memory(args, InterviewSpool(os.path.join(tmp, "memory")))
+        await limits_and_final(args, tmp)
+        submit_peak(tmp)
+        await recovery(tmp)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
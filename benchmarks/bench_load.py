@@ -0,0 +1,148 @@
+"""
+Нагрузочный тест бота против локального fake Bot API.
+
+    python -m benchmarks.bench_load [--users 500] [--arrival 100] [--think 0.05]
+                                    [--mode direct|polling|webhook] [--latency 0.005]
+                                    [--concurrency 64] [--scheduler]
+
+Виртуальные пользователи приходят с частотой ``--arrival`` в секунду (0 — все
+сразу) и проходят /start → A → B1..B7 → C → результат → D, делая паузу
+``--think`` секунд (в среднем) между нажатиями. Апдейты доставляются напрямую
+(``direct``), через fake ``getUpdates`` (``polling``) или HTTP POST на
+встроенный webhook (``webhook``); каждый вызов Bot API отвечает через
+``--latency`` секунд.
+
+Отчёт: нажатий/сек, задержка нажатие → ответ бота (p50/p95/p99/max), ошибки
+(исключения в обработчиках, ответы 429/5xx, таймауты, незавершённые тесты) и
+память Python на одного пользователя посреди теста (tracemalloc; данные
+самого fake API не учитываются). Это базовая точка для сравнения остальных
+оптимизаций.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, contextlib, gc, logging, random, time, tracemalloc
+from collections import Counter
+from typing import List
+
+import etap_test_bot as bot
+from outbox import SendScheduler
+from webhook import webhook_listener
+from benchmarks.fake_telegram import FakeBotAPI, UpdateTracker, WebhookClient, fake_builder, walk_user
+
+
+@contextlib.asynccontextmanager
+async def running(mode: str, api: FakeBotAPI, concurrency: int, scheduler: bool):
+    """Запущенное приложение и функция доставки апдейта для ``walk_user``."""
+    app = bot.build_app(fake_builder(api), concurrent_updates=concurrency,
+                        rate_limiter=SendScheduler(global_rate=10 ** 6, chat_rate=10 ** 6) if scheduler else None)
+    errors: Counter = Counter()
+
+    async def on_error(update, ctx):
+        errors[type(ctx.error).__name__] += 1
+
+    app.add_error_handler(on_error)
+    tracker = UpdateTracker(app)
+    async with app:
+        if mode == "polling":
+            await app.updater.start_polling(poll_interval=0, timeout=10)
+        await app.start()
+        listener = client = None
+        if mode == "direct":
+            feed = None
+        elif mode == "polling":
+            async def deliver(data):
+                api.push_update(data)
+            feed = tracker.feed(deliver)
+        else:
+            listener = webhook_listener(app, "/hook", "127.0.0.1", 0)
+            await listener.start()
+            client = WebhookClient("127.0.0.1", listener.port, "/hook")
+
+            async def deliver(data):
+                status = await client.post(data)
+                if status != 200:
+                    errors[f"HTTP {status}"] += 1
+            feed = tracker.feed(deliver)
+        try:
+            yield app, feed, errors
+        finally:
+            if client is not None:
+                await client.close()
+                await listener.stop()
+            if mode == "polling":
+                await app.updater.stop()
+            await app.stop()
+
+
+async def load(args) -> None:
+    api = FakeBotAPI(args.latency)
+    latencies: List[float] = []
+    rng = random.Random(args.seed)
+    uids = range(1000, 1000 + args.users)
+    async with running(args.mode, api, args.concurrency, args.scheduler) as (app, feed, errors):
+
+        async def one(i, uid):
+            if args.arrival:
+                await asyncio.sleep(i / args.arrival)
+            try:
+                return await walk_user(app, api, uid, rng, feed=feed, latencies=latencies, think=args.think)
+            except asyncio.TimeoutError:
+                errors["timeout"] += 1
+                return 0
+
+        t0 = time.perf_counter()
+        taps = sum(await asyncio.gather(*(one(i, uid) for i, uid in enumerate(uids))))
+        elapsed = time.perf_counter() - t0
+        done = sum(1 for uid in uids if "restart" in api.keyboards.get(uid, ()))
+    errors["incomplete"] = args.users - done
+    for code in ("429", "502"):
+        errors[f"API {code}"] = api.calls[code]
+
+    latencies.sort()
+    pct = lambda q: latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1e3
+    arrival = f"{args.arrival:g}/s" if args.arrival else "all"
+    print(f"mode={args.mode} users={args.users} arrival={arrival} think={args.think}s "
+          f"api_latency={args.latency * 1e3:.0f}ms concurrency={args.concurrency} "
+          f"scheduler={'on' if args.scheduler else 'off'}")
+    print(f"taps        : {taps} in {elapsed:.2f}s = {taps / elapsed:.0f} taps/s")
+    print(f"latency, ms : p50={pct(0.5):.2f} p95={pct(0.95):.2f} p99={pct(0.99):.2f} max={latencies[-1] * 1e3:.2f}")
+    print("errors      : " + (", ".join(f"{k}={v}" for k, v in sorted(errors.items()) if v) or "none"))
+
+
+async def memory(args) -> None:
+    """Память на пользователя, пока все ``--users`` находятся в середине блока B."""
+    api = FakeBotAPI()
+    rng = random.Random(args.seed)
+    async with running("direct", api, args.concurrency, args.scheduler) as (app, _, _errors):
+        gc.collect()
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        await asyncio.gather(*(walk_user(app, api, uid, rng, max_taps=bot.CONTENT.current.n_scale // 2)
+                               for uid in range(1000, 1000 + args.users)))
+        for table in (api.keyboards, api.last_text, api.last_message_id, api.version, api._changed):
+            table.clear()
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - base
+        tracemalloc.stop()
+    print(f"memory      : {used / args.users:.0f} B per active user (mid-test, {args.users} users)")
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=500)
+    ap.add_argument("--arrival", type=float, default=100, help="новых пользователей в секунду, 0 — все сразу")
+    ap.add_argument("--think", type=float, default=0.05, help="средняя пауза между нажатиями, сек")
+    ap.add_argument("--mode", choices=("direct", "polling", "webhook"), default="webhook")
+    ap.add_argument("--latency", type=float, default=0.005, help="задержка Bot API, сек")
+    ap.add_argument("--concurrency", type=int, default=64)
+    ap.add_argument("--scheduler", action="store_true", help="через SendScheduler (без лимитов)")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    await load(args)
+    await memory(args)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,184 @@
+"""
+Задержка цикла asyncio при интенсивном логировании.
+
+    python -m benchmarks.bench_logging [--tasks 50] [--records 20000] [--fsync]
+
+``--tasks`` корутин‑«обработчиков» пишут в лог по пять INFO‑строк на апдейт
+(как httpx и telegram.ext) и изредка ERROR с traceback; тикер раз в 5 мс
+меряет, насколько опаздывает цикл. Сравниваются:
+
+* sync — обработчик файла прямо в потоке цикла (как было: FileHandler);
+* queue — ``logpipe``: очередь + фоновый поток, тот же файл с ротацией.
+
+``--fsync`` делает fsync после каждой записи — так ведёт себя медленный
+или сетевой диск. Затем проверяется всплеск в маленькую очередь (ошибки не
+теряются, INFO отбрасывается) и ротация со сжатием и JSON‑записями.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, glob, gzip, json, logging, os, queue, tempfile, time
+from logging.handlers import QueueListener
+
+from logpipe import BurstQueueHandler, JsonFormatter, RotatingLogFile, with_log_context
+
+TICK = 0.005
+
+
+class FsyncLogFile(RotatingLogFile):
+    """Файл журнала, который дожидается диска после каждой записи."""
+
+    def emit(self, record):
+        super().emit(record)
+        if self.stream is not None:
+            os.fsync(self.stream.fileno())
+
+
+class _User:
+    def __init__(self, uid):
+        self.id = uid
+
+
+class _Update:
+    def __init__(self, uid):
+        self.effective_user = _User(uid)
+
+
+def sink(path: str, fsync: bool, **kw) -> RotatingLogFile:
+    handler = (FsyncLogFile if fsync else RotatingLogFile)(path, **kw)
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def pipeline(target: logging.Handler, capacity: int = 10_000):
+    q = queue.SimpleQueue()
+    listener = QueueListener(q, target, respect_handler_level=True)
+    listener.start()
+    return BurstQueueHandler(q, capacity), listener
+
+
+def bench_logger(handler: logging.Handler) -> logging.Logger:
+    logger = logging.getLogger("bench.load")
+    logger.handlers[:] = [handler]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+async def workload(logger: logging.Logger, tasks: int, records: int) -> tuple:
+    """Возвращает (время, p99 и max задержки цикла)."""
+    per_task = max(records // (tasks * 6), 1)
+
+    async def handler(update, ctx):
+        for i in range(per_task):
+            for _ in range(5):
+                logger.info('HTTP Request: POST https://api.telegram.org/bot***/editMessageText "HTTP/1.1 200 OK"')
+            if i % 50 == 49:
+                try:
+                    raise ValueError("bad answer")
+                except ValueError:
+                    logger.exception("Handler failed")
+            else:
+                logger.info("answer recorded: q=%d", i)
+            await asyncio.sleep(0)
+
+    wrapped = with_log_context(handler, "B")
+    lags, done = [], asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - t0 - TICK)
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK * 2)
+    t0 = time.perf_counter()
+    await asyncio.gather(*(wrapped(_Update(1000 + i), None) for i in range(tasks)))
+    elapsed = time.perf_counter() - t0
+    done.set()
+    await tick
+    lags.sort()
+    return elapsed, per_task * tasks * 6, lags[int(len(lags) * 0.99)], lags[-1]
+
+
+async def compare(args, tmp: str) -> None:
+    for mode in ("sync", "queue"):
+        target = sink(os.path.join(tmp, f"{mode}.log"), args.fsync)
+        listener = None
+        if mode == "queue":
+            handler, listener = pipeline(target)
+        else:
+            handler = target
+        logger = bench_logger(handler)
+        elapsed, n, p99, worst = await workload(logger, args.tasks, args.records)
+        on_loop = elapsed
+        if listener is not None:
+            listener.stop()
+        target.close()
+        lines = sum(1 for _ in open(os.path.join(tmp, f"{mode}.log"), encoding="utf-8"))
+        dropped = sum(handler.dropped.values()) if mode == "queue" else 0
+        print(f"{mode:5}: {n / on_loop:8.0f} records/s on the loop ({on_loop / n * 1e6:5.1f} µs each), "
+              f"loop lag p99={p99 * 1e3:6.2f} ms max={worst * 1e3:6.2f} ms, "
+              f"{lines} written, {dropped} dropped")
+
+
+async def burst(args, tmp: str) -> None:
+    """Маленькая очередь и медленный диск: INFO отбрасывается, ERROR — нет."""
+    path = os.path.join(tmp, "burst.log")
+    target = sink(path, fsync=True)
+    handler, listener = pipeline(target, capacity=500)
+    logger = bench_logger(handler)
+    t0 = time.perf_counter()
+    for i in range(args.records):
+        logger.info("noise %d", i)
+        if i % 100 == 0:
+            logger.error("error %d", i)
+    on_loop = time.perf_counter() - t0
+    await asyncio.sleep(0.1)
+    logger.warning("after the burst")
+    listener.stop()
+    target.close()
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    errors = sum(1 for r in records if r["level"] == "ERROR")
+    assert errors == len(range(0, args.records, 100)), errors
+    assert any(r["msg"].startswith("Log queue overflow") for r in records)
+    print(f"burst: {args.records} INFO + {errors} ERROR in {on_loop * 1e3:.0f} ms on the loop; "
+          f"all errors kept, dropped {dict(handler.dropped)}, {len(records)} written")
+
+
+async def rotation(tmp: str) -> None:
+    path = os.path.join(tmp, "rot.log")
+    target = sink(path, fsync=False, max_bytes=64 * 1024, backups=3, compress=True)
+    handler, listener = pipeline(target)
+    logger = bench_logger(handler)
+    await with_log_context(lambda u, c: asyncio.sleep(0, [logger.info("line %05d %s", i, "x" * 100)
+                                                         for i in range(3000)]), "D")(_Update(42), None)
+    listener.stop()
+    target.close()
+    parts = sorted(glob.glob(path + ".*"))
+    assert [os.path.basename(p) for p in parts] == ["rot.log.1.gz", "rot.log.2.gz", "rot.log.3.gz"], parts
+    with gzip.open(parts[0], "rt", encoding="utf-8") as f:
+        first = json.loads(f.readline())
+    assert first["user_id"] == 42 and first["state"] == "D" and first["level"] == "INFO"
+    sizes = ", ".join(f"{os.path.basename(p)} {os.path.getsize(p) / 1024:.0f} KiB" for p in parts)
+    print(f"rotation: {os.path.basename(path)} {os.path.getsize(path) / 1024:.0f} KiB, {sizes}; "
+          f"records carry user_id/state: OK")
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tasks", type=int, default=50)
+    ap.add_argument("--records", type=int, default=20_000)
+    ap.add_argument("--fsync", action="store_true", help="fsync после каждой записи (медленный диск)")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"tasks={args.tasks} records≈{args.records} fsync={'on' if args.fsync else 'off'}")
+        await compare(args, tmp)
+        await burst(args, tmp)
+        await rotation(tmp)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
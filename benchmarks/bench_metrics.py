@@ -0,0 +1,99 @@
+"""
+Цена инструментирования и что оно показывает.
+
+    python -m benchmarks.bench_metrics [--users 100] [--latency 0.002]
+
+1. Накладные расходы обёртки на один вызов и нажатий/сек с метриками и без.
+2. ``GET /metrics`` со встроенного HTTP‑сервера: формат и время ответа.
+3. Сводка ``/perf`` после прогона и отчёт сэмплирующего профайлера.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, logging, random, re, time
+
+import etap_test_bot as bot
+from metrics import MetricsServer, Registry, SamplingProfiler, instrument, perf_report
+from outbox import SendScheduler
+from benchmarks.fake_telegram import FakeBotAPI, fake_builder, walk_user
+
+
+async def wrapper_cost(n: int = 200_000) -> float:
+    async def noop(update, ctx):
+        return None
+
+    wrapped = instrument(noop, "bench", registry=Registry())
+    out = []
+    for fn in (noop, wrapped):
+        t0 = time.perf_counter()
+        for _ in range(n):
+            await fn(None, None)
+        out.append((time.perf_counter() - t0) / n)
+    return out[1] - out[0]
+
+
+async def run(users: int, latency: float, metrics: bool, server=None, profiler=None) -> float:
+    api = FakeBotAPI(latency)
+    app = bot.build_app(fake_builder(api), concurrent_updates=64, metrics=metrics, metrics_server=server,
+                        rate_limiter=SendScheduler(global_rate=10 ** 6, chat_rate=10 ** 6))
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    if profiler:
+        profiler.start()
+    rng = random.Random(5)
+    t0 = time.perf_counter()
+    taps = sum(await asyncio.gather(*(walk_user(app, api, uid, rng, max_taps=80)
+                                      for uid in range(1000, 1000 + users))))
+    rate = taps / (time.perf_counter() - t0)
+    if profiler:
+        profiler.stop()
+    scrape = await fetch(server.listener.port) if server else None
+    await app.stop()
+    await app.post_stop(app)
+    await app.shutdown()
+    return rate, scrape
+
+
+async def fetch(port: int):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    t0 = time.perf_counter()
+    writer.write(b"GET /metrics HTTP/1.1\r\nHost: x\r\n\r\n")
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while (line := await reader.readline()) != b"\r\n":
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":")[1])
+    body = (await reader.readexactly(length)).decode()
+    elapsed = time.perf_counter() - t0
+    writer.close()
+    return status, body, elapsed
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--latency", type=float, default=0.002)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    print(f"wrapper overhead: {await wrapper_cost() * 1e6:.2f} µs per handler call")
+    off, _ = await run(args.users, args.latency, metrics=False)
+    on, _ = await run(args.users, args.latency, metrics=True)
+    print(f"taps/s: metrics off {off:.0f}, on {on:.0f} ({on / off - 1:+.1%})")
+
+    profiler = SamplingProfiler()
+    _, (status, body, elapsed) = await run(args.users, args.latency, metrics=True,
+                                           server=MetricsServer(port=0), profiler=profiler)
+    assert status == 200
+    assert re.search(r'etap_handler_seconds_bucket\{handler="ask",state="B",le="\+Inf"\} \d+', body)
+    assert re.search(r'etap_api_seconds_count\{endpoint="editMessageText"\} \d+', body)
+    assert "etap_active_sessions{" in body
+    print(f"GET /metrics: {status}, {len(body.splitlines())} lines, {elapsed * 1e3:.1f} ms")
+    print()
+    print(re.sub(r"</?\w+>", "", perf_report()))
+    print()
+    print("\n".join(profiler.report(top=6).splitlines()[:8]))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
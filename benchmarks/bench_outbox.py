@@ -0,0 +1,103 @@
+"""
+Планировщик исходящих запросов против fake Bot API, который отвечает 429.
+
+    python -m benchmarks.bench_outbox [--chats 200]
+
+Сценарии:
+  burst     — по сообщению в каждый из ``--chats`` чатов одновременно; сервер
+              терпит 30 запросов/с. Без планировщика часть запросов падает с
+              RetryAfter, с ним — все доходят.
+  coalesce  — 50 правок одного сообщения подряд при бюджете 1 правка/с на чат.
+  priority  — служебная рассылка (bulk) и ответы пользователям одновременно.
+  retry     — сервер строже планировщика: 429 и повторы с backoff.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, logging, time
+
+from telegram.error import RetryAfter
+
+import etap_test_bot as bot
+from outbox import SendScheduler
+from benchmarks.fake_telegram import FakeBotAPI, fake_builder
+
+BULK_CHATS = range(100_001, 200_000)
+
+
+async def session(api: FakeBotAPI, scheduler=None):
+    app = bot.build_app(fake_builder(api), rate_limiter=scheduler)
+    await app.initialize()
+    return app
+
+
+async def burst(chats: int, scheduled: bool):
+    api = FakeBotAPI(flood_global=30)
+    app = await session(api, SendScheduler(global_rate=30) if scheduled else None)
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(app.bot.send_message(c, "hi") for c in range(1, chats + 1)),
+                                   return_exceptions=True)
+    elapsed = time.perf_counter() - t0
+    errors = sum(isinstance(r, RetryAfter) for r in results)
+    stats = app.bot.rate_limiter.stats() if scheduled else {}
+    await app.shutdown()
+    return errors, elapsed, api.calls["429"], stats
+
+
+async def coalesce():
+    api = FakeBotAPI()
+    sched = SendScheduler(chat_rate=1, chat_burst=1)
+    app = await session(api, sched)
+    await app.bot.send_message(1, "q0")
+    msg_id = api.last_message_id[1]
+    await asyncio.gather(*(app.bot.edit_message_text(f"q{i}", chat_id=1, message_id=msg_id)
+                           for i in range(1, 51)))
+    await app.shutdown()
+    return api.calls["editMessageText"], sched.coalesced, api.last_text[1]
+
+
+async def priority(chats: int):
+    api = FakeBotAPI(flood_global=30)
+    sched = SendScheduler(global_rate=30, bulk_chats=BULK_CHATS)
+    app = await session(api, sched)
+    bulk = [app.bot.send_message(BULK_CHATS[i], f"digest {i}") for i in range(chats)]
+    users = [app.bot.send_message(c, "next question") for c in range(1, chats + 1)]
+    await asyncio.gather(*bulk, *users)
+    stats = sched.stats()
+    await app.shutdown()
+    return stats
+
+
+async def retry():
+    api = FakeBotAPI(flood_chat=2, retry_after=1)
+    sched = SendScheduler(chat_rate=10, chat_burst=10, backoff=0.5)
+    app = await session(api, sched)
+    await asyncio.gather(*(app.bot.send_message(1, f"m{i}") for i in range(10)))
+    await app.shutdown()
+    return api.calls["sendMessage"], api.calls["429"], sched.retries
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=200)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    errors, elapsed, flood, _ = await burst(args.chats, scheduled=False)
+    print(f"burst    without scheduler: {errors}/{args.chats} failed with RetryAfter in {elapsed:.2f}s")
+    errors, elapsed, flood, st = await burst(args.chats, scheduled=True)
+    print(f"burst    with scheduler   : {errors}/{args.chats} failed, {flood} x 429 from server, "
+          f"{elapsed:.2f}s, wait p50={st['wait_p50_interactive']:.2f}s p95={st['wait_p95_interactive']:.2f}s")
+
+    sent, coalesced, last = await coalesce()
+    print(f"coalesce : 50 edits -> {sent} sent, {coalesced} coalesced, final text {last!r}")
+
+    st = await priority(args.chats // 2)
+    print(f"priority : interactive wait p95={st['wait_p95_interactive']:.2f}s, "
+          f"bulk wait p95={st['wait_p95_bulk']:.2f}s")
+
+    sent, flood, retries = await retry()
+    print(f"retry    : 10 messages, {flood} x 429, {retries} retries, {sent - flood} delivered")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+"""
+Нажатий/сек с сохранением сессий в SQLite и без него.
+
+    python -m benchmarks.bench_persistence [--users 200] [--interval 1]
+
+Пользователи проходят тест параллельно; в конце приложение перезапускается
+на той же базе и проверяется, что сессии и состояния диалога восстановились.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, logging, os, random, tempfile, time
+
+import etap_test_bot as bot
+from persistence import SQLitePersistence
+from benchmarks.fake_telegram import FakeBotAPI, fake_builder, walk_user
+
+
+async def run(users: int, persistence=None, max_taps=None) -> float:
+    api = FakeBotAPI()
+    app = bot.build_app(fake_builder(api), persistence=persistence)
+    rng = random.Random(7)
+    await app.initialize()
+    await app.start()
+    t0 = time.perf_counter()
+    taps = sum(await asyncio.gather(*(walk_user(app, api, uid, rng, max_taps=max_taps) for uid in range(1000, 1000 + users))))
+    elapsed = time.perf_counter() - t0
+    await app.stop()
+    await app.shutdown()
+    return taps / elapsed
+
+
+async def restored(path: str) -> tuple:
+    app = bot.build_app(fake_builder(FakeBotAPI()), persistence=SQLitePersistence(path))
+    await app.initialize()
+    convs = app.handlers[0][0]._conversations
+    n = len(app.user_data), len(convs)
+    await app.shutdown()
+    return n
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--interval", type=float, default=1.0, help="PERSISTENCE_INTERVAL, сек")
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    off = await run(args.users)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.db")
+        on = await run(args.users, SQLitePersistence(path, update_interval=args.interval))
+        # все бросают тест в середине блока B — их сессии и состояния должны пережить рестарт
+        path = os.path.join(tmp, "partial.db")
+        await run(args.users, SQLitePersistence(path, update_interval=args.interval), max_taps=60)
+        users, convs = await restored(path)
+    print(f"users={args.users}")
+    print(f"persistence off: {off:10.0f} taps/s")
+    print(f"persistence on : {on:10.0f} taps/s  ({on / off:.0%})")
+    print(f"restored after restart mid-test: {users} user_data, {convs} conversations")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,238 @@
+"""
+Экран результата: готовые шаблоны против сборки текста на каждый результат.
+
+    python -m benchmarks.bench_render [--results 20000] [--users 5]
+
+1. Для каждой тройки (этап, уровень, предупреждение) текст из шаблона
+   совпадает с прежней сборкой в ``show_result``; время на результат —
+   прежняя сборка против подстановки в шаблон.
+2. ``split_html`` на описании длиннее лимита: части ≤ 4096 символов, теги в
+   каждой части сбалансированы, текст без разметки не потерян.
+3. Интерпретации с описанием в ~9000 символов: прежний текст сервер
+   отклоняет (400), новый доходит несколькими сообщениями, кнопки — под
+   последним.
+4. Второй язык: шаблоны строятся и кэшируются так же, язык выбирается по
+   ``language_code`` клиента.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, json, logging, os, random, re, shutil, tempfile, time
+from collections import defaultdict
+
+from telegram import Update
+
+import etap_test_bot as bot
+from content import MAX_ANSWER, ContentStore
+from result_text import (LOCALES, MESSAGE_LIMIT, RU, Locale, build_templates, pick_locale, register_locale,
+                         result_templates, split_html)
+from benchmarks.fake_telegram import FakeBotAPI, callback_update, fake_builder, walk_user
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STATES = (bot.A, bot.B, bot.C)
+TAG = re.compile(r"<(/?)([a-z]+)[^>]*>")
+
+
+def legacy(content, stage, stage_score, sums, distortion, warning):
+    """Прежний show_result: текст собирается заново для каждого результата."""
+    stage_data, _, level_data = content.level(stage, stage_score)
+    msg = []
+    msg.append(f"<b>Ваш основной этап: {stage_data['title']}</b>")
+    if level_data.get('title'):
+        msg.append(f"<b>Уровень освоения: {level_data['title']}</b>")
+    msg.append("")
+    msg.append(f"<i>{level_data['description']}</i>")
+    if level_data.get('recommendations'):
+        msg.append("")
+        msg.append("<b>Рекомендации для практики:</b>")
+        for rec in level_data['recommendations']:
+            msg.append(f"• {rec}")
+    msg.append("\n" + ("─" * 20))
+    msg.append("\n<b>Детальные результаты:</b>")
+    sums_text = []
+    for k, v in sums.items():
+        sums_text.append(f"{k}: {v}")
+    msg.append("Суммы баллов по блокам: " + f"<code>{', '.join(sums_text)}</code>")
+    msg.append(f"Коэффициент искажения: {distortion}")
+    if warning:
+        msg.append("\n⚠️ <i>Вы отметили много «идеальных» ответов. Для точности результата рекомендуется повторить тест позже, отвечая более искренне.</i>")
+    msg.append("\n\nЧтобы помочь в исследовании, вы можете пройти короткое анонимное интервью из 10 вопросов.")
+    return "\n".join(msg)
+
+
+def cases(content, n: int, rng: random.Random):
+    """Случайные результаты: (этап, балл его блока, суммы, искажение, предупреждение)."""
+    out = []
+    for _ in range(n):
+        sums = {key: rng.randint(0, 4 * size) for key, _, size in content.b_layout}
+        stage = rng.randint(0, 7)
+        distortion = rng.randint(0, 9)
+        out.append((stage, sums[f"B{stage}"] if stage else 0, sums, distortion, distortion >= 4))
+    return out
+
+
+def equivalence_and_speed(content, n: int) -> None:
+    templates = result_templates(content, RU)
+    covered = set()
+    for stage_key, stage_data in content.interpretations.items():
+        for level_key, level in stage_data["levels"].items():
+            score = level["range"][0] if int(stage_key) else 0
+            sums = {key: min(score, MAX_ANSWER * size) for key, _, size in content.b_layout}
+            for warning in (False, True):
+                old = legacy(content, int(stage_key), score, sums, 4 if warning else 1, warning)
+                new = templates.render(int(stage_key), level_key, sums, 4 if warning else 1, warning)
+                assert new == [old], (stage_key, level_key, warning)
+                covered.add((stage_key, level_key, warning))
+
+    rows = cases(content, n, random.Random(4))
+    t_old = t_new = float("inf")
+    for _ in range(5):  # лучший из пяти проходов
+        t0 = time.perf_counter()
+        old = [legacy(content, *row) for row in rows]
+        t_old = min(t_old, (time.perf_counter() - t0) / n)
+        t0 = time.perf_counter()
+        new = []
+        for stage, score, sums, distortion, warning in rows:
+            _, level, _ = content.level(stage, score)
+            new.append(templates.render(stage, level, sums, distortion, warning))
+        t_new = min(t_new, (time.perf_counter() - t0) / n)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        result_templates(content, pick_locale("ru-RU"))
+    t_lookup = (time.perf_counter() - t0) / n
+    assert new == [[text] for text in old]
+    size = sum(map(len, old)) / n
+    print(f"templates: {len(covered)} (stage, level, warning) texts equal to the old show_result")
+    print(f"render: string building {t_old * 1e6:.1f} µs/result, template fill {t_new * 1e6:.1f} µs/result "
+          f"({t_old / t_new:.1f}x) + {t_lookup * 1e6:.1f} µs locale/template lookup, ~{size:.0f} chars per result")
+
+
+def balanced(part: str) -> bool:
+    stack = []
+    for closing, name in TAG.findall(part):
+        if not closing:
+            stack.append(name)
+        elif not stack or stack.pop() != name:
+            return False
+    return not stack
+
+
+def plain(text: str) -> str:
+    return " ".join(TAG.sub("", text).split())
+
+
+def splitting() -> None:
+    word = "длинноеслово" * 400  # одно «слово» без пробелов длиннее лимита
+    text = ("<b>Заголовок</b>\n\n<i>" + " ".join(["Описание уровня, <b>важное</b> место."] * 400)
+            + "</i>\n" + word + "\n• 😀 " * 300 + "\nконец")
+    parts = split_html(text)
+    assert all(len(p.encode("utf-16-le")) // 2 <= MESSAGE_LIMIT for p in parts)
+    assert all(balanced(p) for p in parts), [p for p in parts if not balanced(p)][:1]
+    assert plain("".join(parts)).replace(" ", "") == plain(text).replace(" ", "")
+    assert split_html("короткий <b>текст</b>") == ["короткий <b>текст</b>"]
+    print(f"split_html: {len(text)} chars → {len(parts)} parts, "
+          f"max {max(len(p) for p in parts)} chars, tags balanced, text kept: OK")
+
+
+async def oversized(args, tmp: str) -> None:
+    b_path, i_path = os.path.join(tmp, "questions_b.json"), os.path.join(tmp, "interpretations.json")
+    shutil.copy(os.path.join(HERE, "questions_b.json"), b_path)
+    with open(os.path.join(HERE, "interpretations.json"), encoding="utf-8") as f:
+        interp = json.load(f)
+    for stage in interp.values():
+        for level in stage["levels"].values():
+            level["description"] = (level["description"] + "\n\n") * 12 + " ".join(["развёрнутый текст"] * 500)
+    with open(i_path, "w", encoding="utf-8") as f:
+        json.dump(interp, f, ensure_ascii=False)
+    store = bot.CONTENT = ContentStore(b_path, i_path, bot.BLOCK_A, bot.BLOCK_C, STATES, on_load=build_templates)
+    content = store.current
+
+    api = FakeBotAPI()
+    sent = defaultdict(list)  # chat_id → (метод, текст, кнопки) по порядку
+    handle = api.handle
+
+    def record(method, params):
+        if method in ("sendMessage", "editMessageText"):
+            sent[int(params["chat_id"])].append((method, params.get("text", ""), params.get("reply_markup")))
+        return handle(method, params)
+
+    api.handle = record
+    code, _ = await api.call("sendMessage", {"chat_id": 1, "text": legacy(content, 7, 40, {"B7": 40}, 0, False)})
+    assert code == 400 and api.calls["400"] == 1
+    print("oversized result: old single message rejected by the server (400 message is too long)")
+
+    app = bot.build_app(fake_builder(api))
+    rng = random.Random(8)
+    uids = range(1000, 1000 + args.users)
+    async with app:
+        await app.post_init(app)
+        await app.start()
+        for uid in uids:
+            await walk_user(app, api, uid, rng, max_taps=2)
+            while "startD" not in api.keyboards[uid]:
+                version = api.version[uid]
+                data = callback_update(uid, rng.choice(api.keyboards[uid]), api.last_message_id[uid])
+                await app.process_update(Update.de_json(data, app.bot))
+                await api.wait_reply(uid, version)
+        await app.stop()
+        await app.post_stop(app)
+
+    counts = []
+    for uid in uids:
+        start = next(i for i, m in enumerate(sent[uid]) if "Ваш основной этап" in m[1])
+        result = sent[uid][start:]
+        assert result[0][0] == "editMessageText" and all(m[0] == "sendMessage" for m in result[1:])
+        assert all(m[2] is None for m in result[:-1]) and result[-1][2] is not None
+        assert all(len(m[1]) <= MESSAGE_LIMIT and balanced(m[1]) for m in result)
+        assert "Детальные результаты" in result[-1][1]
+        counts.append(len(result))
+    assert api.calls["400"] == 1
+    print(f"  {args.users} users got the result in {min(counts)}–{max(counts)} messages "
+          f"(edit + replies, buttons under the last one), no 400s: OK")
+
+
+def second_locale(content) -> None:
+    en = Locale(
+        code="en",
+        stage="<b>Your main stage: {}</b>",
+        level="<b>Level: {}</b>",
+        recommendations="<b>Practice recommendations:</b>",
+        details="\n<b>Detailed results:</b>",
+        sums="Block scores: ",
+        distortion="Distortion index: ",
+        warning="\n⚠️ <i>Many “ideal” answers. Consider retaking the test later.</i>",
+        invite="\n\nYou can help the research by taking a short anonymous 10‑question interview.",
+        texts={"0": {"title": "Stage 0"}, "1": {"levels": {"low": {"description": "Translated description."}}}},
+    )
+    register_locale(en)
+    try:
+        build_templates(content)
+        assert pick_locale("en-US") is en and pick_locale("de") is RU and pick_locale(None, "en") is en
+        templates = result_templates(content, en)
+        assert templates is result_templates(content, pick_locale("en"))
+        _, level, _ = content.level(1, 0)
+        text = templates.render(1, level, {"B1": 0}, 5, True)[0]
+        assert "Detailed results" in text and "Translated description." in text and "Many “ideal”" in text
+        assert "Stage 0" in templates.render(0, content.level(0, 0)[1], {"B1": 0}, 0, False)[0]
+        print(f"locales: {', '.join(LOCALES)} — 'en-US' → en, 'de' → ru, translated texts overlay "
+              f"interpretations.json, templates built once per version and locale: OK")
+    finally:
+        del LOCALES["en"]
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--results", type=int, default=20_000)
+    ap.add_argument("--users", type=int, default=5)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    content = bot.CONTENT.current
+    equivalence_and_speed(content, args.results)
+    splitting()
+    second_locale(content)
+    with tempfile.TemporaryDirectory() as tmp:
+        await oversized(args, tmp)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
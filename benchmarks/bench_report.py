@@ -0,0 +1,106 @@
+"""
+PDF‑сводка: скорость вёрстки и задержка цикла asyncio во время рендеринга.
+
+    python -m benchmarks.bench_report [--reports 40] [--workers 2]
+
+1. PDF/с в одном процессе: «холодный» отчёт (шрифт, стили и текст
+   интерпретации готовятся заново) против кэшированных.
+2. PDF/с через ``ReportRenderer`` (пул процессов).
+3. Задержка цикла: тикер каждые 10 мс, пока ``--reports`` отчётов рисуются
+   прямо в цикле и через пул. На одноядерной машине пул не ускоряет
+   рендеринг, но цикл остаётся отзывчивым.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, logging, os, random, time
+
+import etap_test_bot as bot
+import report
+from report import ReportRenderer, find_font, init_worker, render_report
+
+TICK = 0.01
+
+
+def sample(rng: random.Random) -> dict:
+    sess = bot.Session()
+    for _ in range(bot.CONTENT.current.n_scale):
+        sess.record(rng.randint(0, 4))
+    for _ in bot.BLOCK_C:
+        sess.record(rng.randint(0, 1))
+    sess.d_answers = [f"Ответ номер {i}: " + "развёрнутый текст " * rng.randint(3, 30) for i in range(len(bot.BLOCK_D))]
+    return bot.report_data(sess)
+
+
+def per_second(fn, items) -> float:
+    t0 = time.perf_counter()
+    for item in items:
+        fn(item)
+    return len(items) / (time.perf_counter() - t0)
+
+
+async def loop_lag(work) -> tuple:
+    """Запускает ``work`` и меряет, насколько опаздывают тики цикла."""
+    lags, done = [], asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            t0 = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - t0 - TICK)
+
+    tick = asyncio.create_task(ticker())
+    t0 = time.perf_counter()
+    await work()
+    elapsed = time.perf_counter() - t0
+    done.set()
+    await tick
+    lags.sort()
+    return elapsed, lags[int(len(lags) * 0.99)], lags[-1]
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--reports", type=int, default=40)
+    ap.add_argument("--workers", type=int, default=2)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    rng = random.Random(7)
+    items = [sample(rng) for _ in range(args.reports)]
+    font = find_font(bot.REPORT_FONT)
+    initargs = (font, bot.BLOCK_D)
+
+    def cold(data):
+        init_worker(*initargs)
+        return render_report(data)
+
+    init_worker(*initargs)
+    first = render_report(items[0])
+    assert first.startswith(b"%PDF") and render_report(items[0]) == first  # кэш не меняет результат
+    print(f"font: {os.path.basename(font)}, report size {len(first) / 1024:.0f} KiB, cpus={os.cpu_count()}")
+    print(f"in-process  cold : {per_second(cold, items):6.1f} PDF/s")
+    init_worker(*initargs)
+    print(f"in-process cached: {per_second(render_report, items):6.1f} PDF/s "
+          f"({len(report._static_blocks)} cached (version, stage, level) blocks)")
+
+    renderer = ReportRenderer(bot.BLOCK_D, font, workers=args.workers)
+    await renderer.start()
+
+    async def inline():
+        for data in items:
+            render_report(data)
+            await asyncio.sleep(0)
+
+    async def pooled():
+        pdfs = await asyncio.gather(*(renderer.render(data) for data in items))
+        assert all(p.startswith(b"%PDF") for p in pdfs)
+
+    for name, work in (("on the loop", inline), (f"pool x{args.workers}", pooled)):
+        elapsed, p99, worst = await loop_lag(work)
+        print(f"{name:12}: {args.reports / elapsed:6.1f} PDF/s, loop lag p99={p99 * 1e3:7.1f} ms "
+              f"max={worst * 1e3:7.1f} ms")
+    await renderer.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,165 @@
+"""
+Движок подсчёта: совпадение с прежней формулой и пересчёт архива.
+
+    python -m benchmarks.bench_scoring [--records 1000000]
+
+1. Случайные сессии (в том числе с неотвеченным блоком C): этап, искажение и
+   уровень от ``ScoringEngine`` совпадают с прежним ``Session.compute`` и
+   ``Content.level``; ``score_one`` живого пути — с массивом.
+2. ``--records`` записей в файле результатов: пересчёт по записи в цикле
+   Python против векторного.
+3. CLI ``python scoring.py`` на том же файле с изменёнными правилами и
+   интерпретациями: таблица переходов этапов совпадает с подсчётом «в лоб».
+"""
+
+from __future__ import annotations
+import argparse, contextlib, copy, io, json, logging, os, tempfile, time
+
+import numpy as np
+
+import etap_test_bot as bot
+import scoring
+from results import RECORD, ResultStore, read_rows
+from scoring import IDEAL_FALSE, IDEAL_TRUE, LevelTable, Ruleset, ScoringEngine
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def legacy(sums, c_bits: int, c_idx: int, threshold: int = 27, ideal_true=IDEAL_TRUE, ideal_false=IDEAL_FALSE):
+    """Прежний Session.compute: этап и искажение."""
+    stage = 0
+    for num in range(1, 8):
+        if sums[num - 1] >= threshold:
+            stage = num
+        else:
+            break
+    answered = (1 << c_idx) - 1
+    true_mask, false_mask = sum(1 << i for i in ideal_true), sum(1 << i for i in ideal_false)
+    return stage, bin(c_bits & true_mask).count("1") + bin(~c_bits & answered & false_mask).count("1")
+
+
+def sessions(content, n: int, rng: np.random.Generator):
+    """Сырые ответы: у части пользователей баллы высокие, чтобы встречались все этапы."""
+    bias = rng.integers(0, 5, (n, 1))
+    scale = np.clip(rng.integers(0, 5, (n, content.n_scale)) + bias - 1, 0, 4).astype(np.uint8)
+    c_bits = rng.integers(0, 1 << len(bot.BLOCK_C), n)
+    c_idx = rng.integers(0, len(bot.BLOCK_C) + 1, n)
+    return scale, c_bits & ((1 << c_idx) - 1), c_idx
+
+
+def equivalence(content, engine: ScoringEngine, n: int = 50_000) -> None:
+    scale, c_bits, c_idx = sessions(content, n, np.random.default_rng(1))
+    sums = engine.b_sums(scale, content)
+    table = engine.levels(content)
+    res = engine.score(sums, c_bits, c_idx, levels=table)
+    names = table.names(res["stage"], res["level"])
+    for i in range(n):
+        s, c, k = sums[i].tolist(), int(c_bits[i]), int(c_idx[i])
+        stage, dist = legacy(s, c, k)
+        assert (stage, dist) == (res["stage"][i], res["distortion"][i]) == engine.score_one(s, c, k)[:2], i
+        assert content.level(stage, s[stage - 1] if stage else 0)[1] == names[i], i
+    stages = np.bincount(res["stage"], minlength=8).tolist()
+    t0 = time.perf_counter()
+    for i in range(1000):
+        engine.score_one(sums[i].tolist(), int(c_bits[i]), int(c_idx[i]))
+    one = (time.perf_counter() - t0) / 1000
+    print(f"equivalence: {n} sessions, stage/distortion/level equal to the old formula (stages {stages}); "
+          f"live score_one {one * 1e6:.1f} µs")
+
+
+def write_archive(path: str, content, engine: ScoringEngine, n: int) -> np.ndarray:
+    """n записей в формате ResultStore, этап и искажение — по прежним правилам."""
+    rng = np.random.default_rng(2)
+    rows = np.zeros(n, RECORD)
+    for start in range(0, n, 1 << 18):
+        k = min(1 << 18, n - start)
+        scale, c_bits, _ = sessions(content, k, rng)
+        chunk = rows[start:start + k]
+        chunk["ts"] = 1_700_000_000 + np.arange(start, start + k)
+        chunk["a"] = scale[:, :len(bot.BLOCK_A)]
+        chunk["b"] = engine.b_sums(scale, content)
+        chunk["c"] = c_bits
+        res = engine.score(chunk["b"], chunk["c"])
+        chunk["stage"], chunk["distortion"] = res["stage"], res["distortion"]
+    ResultStore(path).close()
+    with open(path, "ab") as f:
+        rows.tofile(f)
+    return rows
+
+
+def speed(rows: np.ndarray, engine: ScoringEngine, table: LevelTable, sample: int = 100_000) -> None:
+    part = rows[:sample]
+    b, c = part["b"].tolist(), part["c"].tolist()
+    t0 = time.perf_counter()
+    loop = [legacy(b[i], c[i], len(bot.BLOCK_C)) for i in range(sample)]
+    t_loop = (time.perf_counter() - t0) / sample
+    t0 = time.perf_counter()
+    res = engine.score(rows["b"], rows["c"], levels=table)
+    t_vec = (time.perf_counter() - t0) / len(rows)
+    assert loop == list(zip(res["stage"][:sample].tolist(), res["distortion"][:sample].tolist()))
+    print(f"rescoring: Python loop {t_loop * 1e9:.0f} ns/record, vectorized {t_vec * 1e9:.0f} ns/record "
+          f"({t_loop / t_vec:.0f}x) — {len(rows)} records in {t_vec * len(rows) * 1e3:.0f} ms")
+
+
+def cli(path: str, tmp: str, rows: np.ndarray) -> None:
+    new_rules = {"stage_thresholds": [27, 27, 30, 30, 32, 32, 32], "ideal_true": [0, 1, 2, 5, 6],
+                 "ideal_false": [3, 4, 7, 8], "distortion_warning": 3}
+    rules_path = os.path.join(tmp, "new_ruleset.json")
+    with open(rules_path, "w") as f:
+        json.dump(new_rules, f)
+    with open(os.path.join(HERE, "interpretations.json"), encoding="utf-8") as f:
+        interp = json.load(f)
+    interp = copy.deepcopy(interp)
+    interp["3"]["levels"]["medium"]["range"] = [28, 37]
+    interp["3"]["levels"]["high"]["range"] = [38, 100]
+    interp_path = os.path.join(tmp, "new_interpretations.json")
+    with open(interp_path, "w", encoding="utf-8") as f:
+        json.dump(interp, f, ensure_ascii=False)
+
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        code = scoring.main([path, "--rules", rules_path, "--interpretations", interp_path])
+    assert code == 0
+    text = out.getvalue()
+
+    # Та же таблица переходов «в лоб» по 200 000 записям
+    sample = read_rows(path)[:200_000]
+    moves = np.zeros((8, 8), np.int64)
+    for b, c in zip(sample["b"].tolist(), sample["c"].tolist()):
+        old, _ = legacy(b, c, 16)
+        new, _ = legacy([x - t + 27 for x, t in zip(b, new_rules["stage_thresholds"])], c, 16)
+        moves[old, new] += 1
+    report = scoring.rescore(sample, ScoringEngine(Ruleset()), ScoringEngine(Ruleset.load(rules_path)),
+                             *(LevelTable(bot.CONTENT.current.levels),) * 2)
+    assert (report["moves"] == moves).all() and report["stored_mismatch"] == 0
+    assert "stored stage differs from the old ruleset: 0" in text and f"{len(rows)} records" in text
+    print("CLI (python scoring.py) with new thresholds, C positions and level ranges:")
+    print("    " + text.strip().replace("\n", "\n    "))
+
+    for bad in ({"stage_thresholds": [27] * 6}, {"ideal_true": [1], "ideal_false": [1]}, {"treshold": 27}):
+        with open(rules_path, "w") as f:
+            json.dump(bad, f)
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            assert scoring.main([path, "--rules", rules_path]) == 2
+        print(f"  rejected {json.dumps(bad)}: {err.getvalue().strip()}")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--records", type=int, default=1_000_000)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    content = bot.CONTENT.current
+    engine = bot.ENGINE
+    equivalence(content, engine)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "results.bin")
+        rows = write_archive(path, content, engine, args.records)
+        speed(rows, engine, engine.levels(content))
+        cli(path, tmp, rows)
+
+
+if __name__ == "__main__":
+    main()
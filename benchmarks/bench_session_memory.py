@@ -0,0 +1,102 @@
+"""
+Память на одну сессию: прежний ``Session`` (defaultdict списков) против
+компактного (bytearray + битовая маска).
+
+    python -m benchmarks.bench_session_memory [--counts 10000 100000]
+
+Каждая сессия заполнена полностью (A, B1..B7, C); попутно проверяется, что
+``compute()`` у обеих реализаций совпадает.
+"""
+
+from __future__ import annotations
+import argparse, gc, logging, random, tracemalloc
+from collections import defaultdict
+from typing import Dict, Any, List
+
+import etap_test_bot as bot
+from scoring import IDEAL_FALSE, IDEAL_TRUE
+
+
+class LegacySession:
+    """Копия ``Session`` до перехода на компактное представление."""
+    def __init__(self):
+        self.answers: Dict[str, List[int]] = defaultdict(list)
+        self.d_answers: List[str] = []
+        self.b_stage_keys = [f"B{i}" for i in range(1, 8)]
+        self.curr_b_stage = 0
+        self.curr_b_idx = 0
+        self.c_idx = 0
+        self.d_idx = 0
+
+    def compute(self) -> Dict[str, Any]:
+        sums = {key: sum(self.answers[key]) for key in self.b_stage_keys}
+        stage_num = 0
+        for num in range(1, 8):
+            if sums[f"B{num}"] >= 27:
+                stage_num = num
+            else:
+                break
+        c_answers = self.answers["C"]
+        ideal_true = sum(1 for i, v in enumerate(c_answers) if i in IDEAL_TRUE and v == 1)
+        ideal_false = sum(1 for i, v in enumerate(c_answers) if i in IDEAL_FALSE and v == 0)
+        return dict(stage=stage_num, sums=sums, distortion=ideal_true + ideal_false)
+
+
+def answers(rng: random.Random):
+    scale = [rng.randrange(5) for _ in range(bot.CONTENT.current.n_scale)]
+    c = [rng.random() < 0.5 for _ in bot.BLOCK_C]
+    return scale, c
+
+
+def fill_legacy(scale, c) -> LegacySession:
+    s = LegacySession()
+    s.answers["A"].extend(scale[:len(bot.BLOCK_A)])
+    for key, off, n in bot.CONTENT.current.b_layout:
+        s.answers[key].extend(scale[off:off + n])
+    s.answers["C"].extend(1 if v else 0 for v in c)
+    return s
+
+
+def fill_compact(scale, c) -> bot.Session:
+    s = bot.Session()
+    for v in scale:
+        s.add_scale(v)
+    for v in c:
+        s.add_c(v)
+    return s
+
+
+def measure(factory, count: int, rng: random.Random) -> float:
+    data = [answers(rng) for _ in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    sessions = [factory(*d) for d in data]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    per = (after - before - sessions.__sizeof__()) / count
+    del sessions
+    return per
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--counts", type=int, nargs="+", default=[10_000, 100_000])
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rng = random.Random(1)
+    for _ in range(1000):
+        d = answers(rng)
+        new = fill_compact(*d).compute()
+        assert fill_legacy(*d).compute() == {k: new[k] for k in ("stage", "sums", "distortion")}
+
+    for count in args.counts:
+        legacy = measure(fill_legacy, count, random.Random(count))
+        compact = measure(fill_compact, count, random.Random(count))
+        print(f"{count:>7} sessions: before {legacy:7.0f} B/session, after {compact:5.0f} B/session "
+              f"({legacy / compact:.1f}x less)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Выгрузка брошенных сессий на диск и возвращение по следующему нажатию.
+
+    python -m benchmarks.bench_sessions [--users 500] [--max-resident 50]
+
+``--users`` пользователей бросают тест в случайном месте (от первых
+вопросов A до середины интервью D). Затем:
+
+1. LRU: в памяти остаётся ``--max-resident`` сессий, остальные уходят в
+   SQLite; сколько памяти освободилось на сессию и сколько она весит на диске.
+2. Холодное возвращение: выгруженные пользователи нажимают кнопки своих
+   старых сообщений и доходят до конца теста; ответы, данные до выгрузки,
+   на месте.
+3. TTL: после простоя выгружаются все.
+4. Выгрузка просрочена: старая кнопка получает «начните заново», без
+   ошибок в обработчиках.
+
+Для сравнения — нажатий/сек без ``SessionKeeper`` и с ним.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, gc, logging, os, random, tempfile, time, tracemalloc
+
+from telegram import Update
+
+import etap_test_bot as bot
+from sessions import SessionKeeper
+from benchmarks.fake_telegram import FakeBotAPI, callback_update, fake_builder, text_update, walk_user
+
+FULL_TEST = 1 + 1 + 119 + 1 + 10  # /start, «Поехали», A+B+C, «интервью», D
+
+
+async def resume(app, api: FakeBotAPI, uid: int, rng: random.Random) -> None:
+    """Продолжает тест с последнего сообщения бота до финального экрана."""
+    while "restart" not in api.keyboards.get(uid, []):
+        version = api.version[uid]
+        buttons = api.keyboards.get(uid, [])
+        if "startD" in buttons:
+            data = callback_update(uid, "startD", api.last_message_id[uid])
+        elif buttons:
+            data = callback_update(uid, rng.choice(buttons), api.last_message_id[uid])
+        else:
+            data = text_update(uid, "ответ после возвращения")
+        await app.process_update(Update.de_json(data, app.bot))
+        await api.wait_reply(uid, version)
+
+
+def answered(app, uid: int) -> tuple:
+    """Ответы сессии; для блока D — смещения кадров в файле интервью (после конца теста файла уже нет)."""
+    sess = app.user_data[uid]["sess"]
+    d = sess.d_answers
+    return bytes(sess.scale[:sess.n_scale]), sess.c_bits, sess.c_idx, (d.path, d.offsets.tolist()) if d else None
+
+
+async def throughput(users: int, keeper) -> float:
+    api = FakeBotAPI()
+    app = bot.build_app(fake_builder(api), sessions=keeper)
+    rng = random.Random(5)
+    async with app:
+        await app.post_init(app)
+        await app.start()
+        t0 = time.perf_counter()
+        taps = sum(await asyncio.gather(*(walk_user(app, api, uid, rng) for uid in range(1000, 1000 + users))))
+        elapsed = time.perf_counter() - t0
+        await app.stop()
+        await app.post_stop(app)
+    return taps / elapsed
+
+
+async def lifecycle(args, tmp: str) -> None:
+    path = os.path.join(tmp, "spill.db")
+    keeper = SessionKeeper(path, ttl=3600, max_resident=args.max_resident, interval=3600, grace=0,
+                           expired=bot.expired)
+    api = FakeBotAPI()
+    app = bot.build_app(fake_builder(api), sessions=keeper)
+    errors = []
+    app.add_error_handler(lambda update, ctx: asyncio.sleep(0, errors.append(ctx.error)))
+    conv = app.handlers[0][0]
+    rng = random.Random(9)
+    uids = range(1000, 1000 + args.users)
+
+    async with app:
+        await app.post_init(app)
+        await app.start()
+        tracemalloc.start()
+        await asyncio.gather(*(walk_user(app, api, uid, rng, max_taps=rng.randint(3, FULL_TEST - 3))
+                               for uid in uids))
+        before = {uid: answered(app, uid) for uid in uids}
+        gc.collect()
+        mem0 = tracemalloc.get_traced_memory()[0]
+
+        # 1. LRU
+        t0 = time.perf_counter()
+        by_ttl, by_lru = await keeper.sweep()
+        sweep = time.perf_counter() - t0
+        gc.collect()
+        freed = mem0 - tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        assert (by_ttl, by_lru) == (0, args.users - args.max_resident), (by_ttl, by_lru)
+        assert keeper.resident == len(app.user_data) == len(conv._conversations) == args.max_resident
+        assert keeper.spilled == by_lru
+        evicted = [uid for uid in uids if uid not in app.user_data]
+        size = os.path.getsize(path) + os.path.getsize(path + "-wal")
+        print(f"LRU: {by_lru} of {args.users} sessions spilled in {sweep * 1e3:.0f} ms, "
+              f"{keeper.resident} resident; freed {freed / by_lru:.0f} B of memory per session, "
+              f"{size / by_lru:.0f} B per session on disk")
+
+        # 2. Холодное возвращение
+        rng2 = random.Random(10)
+        await asyncio.gather(*(resume(app, api, uid, rng2) for uid in evicted))
+        for uid in evicted:
+            scale, c_bits, c_idx, d_answers = answered(app, uid)
+            old = before[uid]
+            assert scale.startswith(old[0]) and c_bits & ((1 << old[2]) - 1) == old[1], uid
+            if old[3] is not None:
+                assert d_answers[0] == old[3][0] and d_answers[1][:len(old[3][1])] == old[3][1], uid
+        assert keeper.rehydrated.value == len(evicted) and not errors, errors
+        print(f"cold resume: {len(evicted)} users tapped their old buttons and finished the test, "
+              f"answers given before the spill kept: OK")
+
+        # 3. TTL
+        keeper.ttl = 0.05
+        await asyncio.sleep(0.1)
+        by_ttl, by_lru = await keeper.sweep()
+        assert by_ttl == args.users and keeper.resident == len(app.user_data) == 0
+        print(f"TTL: {by_ttl} idle sessions spilled, resident {keeper.resident}, spilled {keeper.spilled}")
+
+        # 4. Выгрузка просрочена
+        keeper.spill_ttl = 0
+        await keeper.sweep()
+        spilled = set(evicted)
+        uid = next(u for u in uids if u not in spilled and "restart" not in api.keyboards.get(u, ["restart"]))
+        await app.process_update(Update.de_json(
+            callback_update(uid, api.keyboards[uid][0], api.last_message_id[uid]), app.bot))
+        assert "начните тест заново" in api.last_text[uid] and api.keyboards[uid] == ["restart"]
+        assert keeper.spilled == 0 and not errors, errors
+        print("expired spill: stale button got a restart prompt, no handler errors: OK")
+        await app.stop()
+        await app.post_stop(app)
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=500)
+    ap.add_argument("--max-resident", type=int, default=50)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"users={args.users} max_resident={args.max_resident}")
+        off = await throughput(200, None)
+        on = await throughput(200, SessionKeeper(os.path.join(tmp, "tp.db"), interval=3600))
+        print(f"without SessionKeeper: {off:6.0f} taps/s, with it: {on:6.0f} taps/s ({on / off:.0%})")
+        await lifecycle(args, tmp)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,164 @@
+"""
+Шардирование: пропускная способность от 1 до N процессов‑воркеров.
+
+    python -m benchmarks.bench_shard [--users 200] [--workers 1,2,4] [--latency 0.005]
+
+Fake Bot API отвечает по HTTP из процесса бенчмарка; боты‑воркеры ходят к
+нему через обычный HTTPXRequest PTB. Апдейты идут POST‑запросами на webhook
+диспетчера (shard.py), который раскладывает их по воркерам. Для сравнения —
+один процесс без диспетчера (``webhook_listener``) с тем же HTTP‑API.
+
+Проверяется, что все пользователи прошли тест до конца, ответы D и
+результаты дошли до общих служб диспетчера, ``/stats`` администратора
+отвечает из файла диспетчера, а убитый воркер перезапускается: пока он
+поднимается, его апдейты получают 503.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, functools, logging, os, random, tempfile, time
+
+from telegram.ext import Application
+
+import etap_test_bot as bot
+from results import ResultStore
+from shard import ShardDispatcher, user_of
+from webhook import webhook_listener
+from benchmarks.fake_telegram import FakeBotAPI, WebhookClient, text_update, walk_user
+
+ADMIN = 999
+
+
+class Inbox:
+    """Сводка администратору в диспетчере: только считает записи."""
+
+    def __init__(self):
+        self.records = []
+
+    def submit(self, record):
+        self.records.append(record)
+
+    async def start(self, bot):
+        pass
+
+    async def stop(self):
+        pass
+
+
+def bench_app(api_port: int, index: int, shards: int, digest, results) -> Application:
+    """Фабрика Application воркера (выполняется в дочернем процессе)."""
+    logging.getLogger().setLevel(logging.ERROR)
+    bot.CHAT_ID_ADMIN = ADMIN  # чтобы был /stats
+    builder = Application.builder().token("1:FAKE").base_url(f"http://127.0.0.1:{api_port}/bot")
+    return bot.build_app(builder, concurrent_updates=64, admin_digest=digest, results=results)
+
+
+async def walk_all(api: FakeBotAPI, client: WebhookClient, uids, seed: int) -> int:
+    rng = random.Random(seed)
+
+    async def feed(data):
+        status = await client.post(data)
+        assert status == 200, status
+
+    taps = sum(await asyncio.gather(*(walk_user(None, api, uid, rng, feed=feed) for uid in uids)))
+    assert all("restart" in api.keyboards[uid] for uid in uids)
+    return taps
+
+
+async def ask_stats(api: FakeBotAPI, client: WebhookClient) -> str:
+    version = api.version[ADMIN]
+    await client.post(text_update(ADMIN, "/stats"))
+    await api.wait_reply(ADMIN, version)
+    return api.last_text[ADMIN]
+
+
+async def run(args, workers: int, tmp: str) -> float:
+    """``workers`` = 0 — один процесс без диспетчера."""
+    api = FakeBotAPI(args.latency)
+    api_http = api.http_listener()
+    await api_http.start()
+    inbox, results = Inbox(), ResultStore(os.path.join(tmp, f"results{workers}.bin"))
+    uids = range(1000, 1000 + args.users)
+    if workers:
+        dispatcher = ShardDispatcher(functools.partial(bench_app, api_http.port), workers,
+                                     digest=inbox, results=results)
+        before = [c.value for c in dispatcher.routed]  # счётчики в общем REGISTRY
+        t0 = time.perf_counter()
+        await dispatcher.start()
+        startup = time.perf_counter() - t0
+        hook = dispatcher.listener("/hook", "127.0.0.1", 0)
+    else:
+        app = bench_app(api_http.port, 0, 1, inbox, results)
+        await app.initialize()
+        await app.post_init(app)
+        await app.start()
+        hook = webhook_listener(app, "/hook", "127.0.0.1", 0)
+    await hook.start()
+    client = WebhookClient("127.0.0.1", hook.port, "/hook")
+
+    t0 = time.perf_counter()
+    taps = await walk_all(api, client, uids, args.seed)
+    rate = taps / (time.perf_counter() - t0)
+    stats_text = await ask_stats(api, client)
+    assert f"{args.users} тестов" in stats_text, stats_text
+
+    label = f"{workers} worker{'s' if workers > 1 else ''}" if workers else "single process"
+    users = args.users
+    if workers:
+        spread = "/".join(str(c.value - b) for c, b in zip(dispatcher.routed, before))
+        print(f"{label:15}: {rate:7.0f} taps/s (startup {startup:.1f} s, updates per worker {spread})")
+        if workers > 1 and args.kill:
+            await kill_one(api, client, dispatcher, workers)
+            users += 1
+    else:
+        print(f"{label:15}: {rate:7.0f} taps/s")
+
+    await client.close()
+    await hook.stop()
+    if workers:
+        await dispatcher.stop()
+    else:
+        await app.stop()
+        await app.post_stop(app)
+        await app.shutdown()
+        results.close()
+    await api_http.stop()
+    assert results.rows == users and len(inbox.records) == users, (results.rows, len(inbox.records))
+    return rate
+
+
+async def kill_one(api: FakeBotAPI, client: WebhookClient, dispatcher: ShardDispatcher, workers: int) -> None:
+    uid = next(u for u in range(5000, 6000) if u % workers == 0)
+    dispatcher._procs[0].kill()
+    while dispatcher._links[0] is not None:
+        await asyncio.sleep(0.01)
+    status = await client.post(text_update(uid, "/start"))
+    t0 = time.perf_counter()
+    await asyncio.wait_for(dispatcher._ready[0].wait(), 120)
+    restart = time.perf_counter() - t0
+    await walk_all(api, client, [uid], 1)
+    assert status == 503 and user_of(text_update(uid, "/start")) == uid
+    print(f"{'':15}  worker 0 killed: its updates got {status} until restart ({restart:.1f} s), "
+          f"then a new user finished the test")
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--workers", default="1,2,4", help="через запятую")
+    ap.add_argument("--latency", type=float, default=0.005, help="задержка Bot API, сек")
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--no-kill", dest="kill", action="store_false", help="не проверять перезапуск воркера")
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    print(f"users={args.users} api_latency={args.latency * 1e3:.0f}ms cpus={os.cpu_count()}")
+    with tempfile.TemporaryDirectory() as tmp:
+        base = await run(args, 0, tmp)
+        for workers in map(int, args.workers.split(",")):
+            rate = await run(args, workers, tmp)
+            print(f"{'':15}  {rate / base:.2f}x single process")
+    print("all tests completed, D answers and results reached the dispatcher, /stats answered: OK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""
+Хранилище результатов и /stats на миллионах записей.
+
+    python -m benchmarks.bench_stats [--rows 2000000]
+
+Генерирует файл результатов за последний год, затем меряет: полный
+проход при первом открытии, открытие с сохранёнными агрегатами, цену одной
+записи из ``show_result``, ответ ``/stats`` по всем данным и за 7 дней.
+Агрегаты сверяются с прямым расчётом NumPy по всему файлу.
+"""
+
+from __future__ import annotations
+import argparse, logging, os, tempfile, time
+
+import numpy as np
+
+from results import HEADER, MAGIC, RECORD, ResultStore, format_stats
+from scoring import DISTORTION_WARNING
+
+
+def synth(path: str, rows: int, rng: np.random.Generator) -> None:
+    now = int(time.time())
+    rec = np.zeros(rows, RECORD)
+    rec["ts"] = np.sort(rng.integers(now - 365 * 86400, now, rows))
+    rec["a"] = rng.integers(0, 5, (rows, 8))
+    sizes = np.array([12, 12, 15, 15, 15, 15, 18])
+    rec["b"] = rng.binomial(sizes * 4, 0.55, (rows, 7))
+    rec["c"] = rng.integers(0, 1 << 9, rows)
+    passed = rec["b"] >= 27
+    rec["stage"] = np.cumprod(passed, axis=1).sum(axis=1)
+    rec["distortion"] = rng.binomial(9, 0.3, rows)
+    with open(path, "wb") as f:
+        f.write(MAGIC + np.array([RECORD.itemsize, 0], "<u4").tobytes())
+        rec.tofile(f)
+
+
+def timed(fn, *args):
+    t0 = time.perf_counter()
+    out = fn(*args)
+    return out, time.perf_counter() - t0
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=2_000_000)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "results.bin")
+        synth(path, args.rows, np.random.default_rng(1))
+        print(f"rows={args.rows}, record={RECORD.itemsize} B, file={os.path.getsize(path) / 2 ** 20:.1f} MiB")
+
+        store, t = timed(ResultStore, path)
+        print(f"open, full scan      : {t * 1e3:8.1f} ms")
+        store.close()
+        store, t = timed(ResultStore, path)
+        print(f"open with checkpoint : {t * 1e3:8.1f} ms")
+
+        n = 10_000
+        t0 = time.perf_counter()
+        for i in range(n):
+            store.append([i % 5] * 8, [30, 30, 30, 20, 10, 5, 0], 0b101, 3, 2)
+        print(f"append from handler  : {(time.perf_counter() - t0) / n * 1e6:8.1f} µs/result")
+
+        (summary, t) = timed(store.agg.summary, DISTORTION_WARNING)
+        text = format_stats(summary, "Все результаты", t)
+        print(f"/stats all time      : {t * 1e3:8.2f} ms ({store.rows} rows)")
+        week_ago = int(time.time() - 7 * 86400)
+        agg, t = timed(store.since, week_ago)
+        print(f"/stats last 7 days   : {t * 1e3:8.2f} ms ({agg.count} rows)")
+
+        rows = np.fromfile(path, RECORD, offset=HEADER)
+        assert summary["count"] == len(rows)
+        assert summary["stage"] == np.bincount(rows["stage"], minlength=8).tolist()
+        for i in range(7):
+            col = rows["b"][:, i]
+            assert abs(summary["b_mean"][i] - col.mean()) < 1e-9
+            for q, vals in summary["b_pct"].items():
+                assert vals[i] == int(np.percentile(col, q * 100, method="inverted_cdf"))
+        week = rows[rows["ts"] >= week_ago]
+        assert agg.count == len(week) and agg.summary(DISTORTION_WARNING)["stage"] == np.bincount(week["stage"], minlength=8).tolist()
+        _, t = timed(lambda: np.percentile(rows["b"], [50, 90, 99], axis=0))
+        print(f"aggregates match a full NumPy recomputation: OK (full-scan percentiles alone take {t * 1e3:.0f} ms)")
+        store.close()
+        print()
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+"""
+Несколько ботов в одном процессе против процесса на каждого бота.
+
+    python -m benchmarks.bench_tenants [--tenants 4] [--users 8] [--flood 300]
+
+1. Общие данные: боты с копиями одних и тех же файлов получают один Content
+   (таблица вопросов, шаблоны результата, таблица уровней), боты с другими
+   вопросами B — свой Content, но общие клавиатуры; сколько памяти добавляет
+   ещё один бот каждого вида против полностью отдельной загрузки.
+2. Процессы: ``--tenants`` дочерних процессов с одним ботом в каждом (свой
+   интерпретатор и свой HTTP‑клиент, как сейчас) против одного процесса со
+   всеми ботами (``SharedRequest``, ``FairShare``). Боты ходят по HTTP к
+   локальному Bot API и получают апдейты long polling'ом; ``--users``
+   пользователей каждого бота проходят A/B/C. RSS, открытые сокеты и
+   процессорное время на бота и на нажатие.
+3. Честность: один бот получает наплыв из ``--flood`` /start, второй в это
+   время — одного пользователя; задержка ответа второму при общей очереди
+   FIFO против ``FairShare`` с тем же числом мест (8 на оба бота, ответ
+   Bot API — 100 мс).
+4. Рестарт: у двух ботов анкеты разные, но одной длины; после рестарта
+   каждый восстанавливает сессии из своего хранилища со своей версией
+   вопросов, и тест продолжается.
+
+Дочерний процесс (режим 2): ``--child '<JSON записей TENANTS>' --mode single|shared``.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, gc, json, logging, os, random, shutil, signal, subprocess, sys, tempfile, time
+import tracemalloc
+from typing import Any, Dict, List
+
+from telegram.ext import Application
+from telegram.request import HTTPXRequest
+
+import etap_test_bot as bot
+import questions
+from result_text import RU, result_templates
+from tenants import FairShare, SharedRequest, serve_tenants
+from benchmarks.fake_telegram import FakeBotAPI, bots_listener, callback_update, fake_builder, text_update
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def variant(tmp: str, name: str) -> str:
+    """questions_b.json с другими формулировками той же длины."""
+    with open(os.path.join(HERE, "questions_b.json"), encoding="utf-8") as f:
+        block_b = json.load(f)
+    block_b = {key: [f"{q} ({name})" for q in items] for key, items in block_b.items()}
+    path = os.path.join(tmp, f"questions_b.{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(block_b, f, ensure_ascii=False)
+    return path
+
+
+def specs(tmp: str, n: int) -> List[Dict[str, Any]]:
+    """Половина ботов — копии одних файлов, половина — свои вопросы B."""
+    out = []
+    for i in range(n):
+        spec = {"NAME": f"t{i}", "BOT_TOKEN": f"{1000 + i}:TENANT{i}"}
+        if i % 2:
+            spec["QUESTIONS_B"] = variant(tmp, f"t{i}")
+        else:
+            copy = os.path.join(tmp, f"questions_b.copy{i}.json")
+            shutil.copy(os.path.join(HERE, "questions_b.json"), copy)
+            spec["QUESTIONS_B"] = copy
+        out.append(spec)
+    return out
+
+
+def quiet() -> None:
+    """Без файлов на диске и без лимитов отправки: меряется обработка, а не ожидание бюджета."""
+    logging.getLogger().setLevel(logging.CRITICAL)
+    bot.PERSISTENCE_DB = bot.SESSION_SPILL_DB = bot.RESULTS_DB = ""
+    bot.CHAT_ID_ADMIN = None
+    bot.RATE_LIMIT_GLOBAL = bot.RATE_LIMIT_CHAT = bot.RATE_LIMIT_CHAT_BURST = 1e6
+
+
+# ── 1. общие данные ───────────────────────────────────────────────────────
+
+def sharing(tmp: str) -> None:
+    bot.TENANTS_DIR = os.path.join(tmp, "sharing")
+    tenants = [bot.load_tenant(spec) for spec in specs(tmp, 4)]
+    base = bot.CONTENT.current
+    same, other = tenants[0::2], tenants[1::2]
+    assert all(t.content.current is base for t in same)
+    assert all(result_templates(t.content.current, RU) is result_templates(base, RU) for t in same)
+    assert all(t.content.current is not base for t in other) and other[0].content.current is not other[1].content.current
+    for t in other:
+        assert all(q.markups is b.markups for q, b in zip(t.content.current.questions, base.questions))
+    assert len({id(t.engine) for t in tenants}) == 1
+    assert bot.ENGINE.levels(same[0].content.current) is bot.ENGINE.levels(base)
+
+    def cost(spec) -> int:
+        gc.collect()
+        tracemalloc.start()
+        held = bot.load_tenant(spec)
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del held
+        return size
+
+    copy = os.path.join(tmp, "questions_b.more.json")
+    shutil.copy(os.path.join(HERE, "questions_b.json"), copy)
+    t_same = cost({"NAME": "m1", "BOT_TOKEN": "1:M", "QUESTIONS_B": copy})
+    t_other = cost({"NAME": "m2", "BOT_TOKEN": "1:M", "QUESTIONS_B": variant(tmp, "m2")})
+    questions._markups.cache_clear()  # как в отдельном процессе: ничего общего
+    t_alone = cost({"NAME": "m3", "BOT_TOKEN": "1:M", "QUESTIONS_B": variant(tmp, "m3")})
+    print(f"sharing: identical files → one Content, templates and level table; "
+          f"other B questions → own Content, shared keyboards: OK")
+    print(f"  memory per extra tenant: same questionnaire {t_same / 1024:.0f} KiB, "
+          f"other B questions {t_other / 1024:.0f} KiB, nothing shared {t_alone / 1024:.0f} KiB")
+    assert t_same * 4 < t_other < t_alone
+
+
+# ── 2. процесс на бота против общего процесса ─────────────────────────────
+
+async def child(args) -> None:
+    """Дочерний процесс: ``--mode single`` — один бот как сейчас, ``shared`` — все боты вместе."""
+    quiet()
+    bot.TENANTS_DIR = args.dir
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    base = f"http://127.0.0.1:{args.port}/bot"
+    tenants = [bot.load_tenant(spec) for spec in json.loads(args.child)]
+    if args.mode == "single":
+        apps = [(t, bot.build_app(Application.builder().token(t.token).base_url(base),
+                                  concurrent_updates=bot.CONCURRENT_UPDATES, rate_limiter=bot.make_scheduler(tenant=t),
+                                  metrics=True, watch_content=True, tenant=t))
+                for t in tenants]
+    else:
+        request = SharedRequest(HTTPXRequest(connection_pool_size=256))
+        updates = SharedRequest(HTTPXRequest(connection_pool_size=len(tenants)))
+        share = FairShare(bot.CONCURRENT_UPDATES)
+        apps = [(t, bot.make_tenant_app(t, Application.builder().token(t.token).base_url(base)
+                                        .request(request).get_updates_request(updates), share))
+                for t in tenants]
+    await serve_tenants(apps, stop=stop)
+
+
+def proc_stats(pid: int) -> Dict[str, float]:
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    with open(f"/proc/{pid}/status") as f:
+        rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:")) * 1024
+    sockets = sum(1 for fd in os.listdir(f"/proc/{pid}/fd")
+                  if os.readlink(f"/proc/{pid}/fd/{fd}").startswith("socket:"))
+    return {"cpu": cpu, "rss": rss, "sockets": sockets}
+
+
+def total(pids: List[int]) -> Dict[str, float]:
+    stats = [proc_stats(pid) for pid in pids]
+    return {key: sum(s[key] for s in stats) for key in stats[0]}
+
+
+async def drive(api: FakeBotAPI, uid: int, rng: random.Random) -> int:
+    """Пользователь через long polling: /start и A/B/C до экрана результата. Возвращает число апдейтов."""
+    async def send(data: Dict[str, Any]) -> None:
+        version = api.version[uid]
+        api.push_update(data)
+        await api.wait_reply(uid, version, timeout=120)
+
+    await send(text_update(uid, "/start"))
+    taps = 1
+    while "startD" not in api.keyboards[uid]:
+        await send(callback_update(uid, rng.choice(api.keyboards[uid]), api.last_message_id[uid]))
+        taps += 1
+    return taps
+
+
+async def processes(args, tmp: str) -> None:
+    tenant_specs = specs(tmp, args.tenants)
+    apis: Dict[str, FakeBotAPI] = {}
+    listener = bots_listener(apis)
+    await listener.start()
+    report = {}
+    try:
+        for mode in ("single", "shared"):
+            apis.clear()
+            apis.update({spec["BOT_TOKEN"]: FakeBotAPI() for spec in tenant_specs})
+            groups = [[spec] for spec in tenant_specs] if mode == "single" else [tenant_specs]
+            with open(os.path.join(tmp, f"child-{mode}.log"), "w") as errors:
+                procs = [subprocess.Popen([sys.executable, "-m", "benchmarks.bench_tenants", "--child", json.dumps(group),
+                                           "--mode", mode, "--port", str(listener.port),
+                                           "--dir", os.path.join(tmp, mode)],
+                                          cwd=HERE, stdout=subprocess.DEVNULL, stderr=errors)
+                         for group in groups]
+            pids = [p.pid for p in procs]
+            try:
+                deadline = time.monotonic() + 120
+                while not all(api.calls["getUpdates"] for api in apis.values()):  # все боты опрашивают API
+                    assert time.monotonic() < deadline and all(p.poll() is None for p in procs), \
+                        open(os.path.join(tmp, f"child-{mode}.log")).read()[-2000:]
+                    await asyncio.sleep(0.1)
+                await asyncio.sleep(1)
+                idle = total(pids)
+                t0 = time.perf_counter()
+                taps = await asyncio.gather(*(drive(api, uid, random.Random(uid))
+                                              for api in apis.values()
+                                              for uid in range(1000, 1000 + args.users)))
+                wall = time.perf_counter() - t0
+                busy = total(pids)
+            finally:
+                for p in procs:
+                    p.send_signal(signal.SIGTERM)
+                for p in procs:
+                    await asyncio.to_thread(p.wait, 60)
+            assert all(p.returncode == 0 for p in procs), open(os.path.join(tmp, f"child-{mode}.log")).read()[-2000:]
+            n = args.tenants
+            report[mode] = r = {"rss": busy["rss"] / n, "idle_rss": idle["rss"] / n, "start_cpu": idle["cpu"] / n,
+                                "tap_cpu": (busy["cpu"] - idle["cpu"]) / sum(taps), "sockets": busy["sockets"],
+                                "procs": len(procs), "rate": sum(taps) / wall}
+            print(f"{mode:6}: {r['procs']} process(es), {n} tenants — RSS {r['rss'] / 2**20:.1f} MiB/tenant "
+                  f"(idle {r['idle_rss'] / 2**20:.1f}), startup CPU {r['start_cpu']:.2f} s/tenant, "
+                  f"{r['tap_cpu'] * 1e3:.2f} ms CPU/update, {r['sockets']} sockets, "
+                  f"{sum(taps)} updates at {r['rate']:.0f}/s")
+    finally:
+        await listener.stop()
+    single, shared = report["single"], report["shared"]
+    print(f"  shared mode per tenant: RSS {single['rss'] / shared['rss']:.1f}x less, "
+          f"startup CPU {single['start_cpu'] / shared['start_cpu']:.1f}x less, "
+          f"CPU per update {shared['tap_cpu'] / single['tap_cpu']:.2f}x of one-process-per-bot")
+    assert shared["rss"] * 2 < single["rss"] and shared["sockets"] < single["sockets"]
+
+
+# ── 3. честность ──────────────────────────────────────────────────────────
+
+class FifoShare(FairShare):
+    """Те же места, но одна общая очередь — кто раньше пришёл, тот раньше обработан."""
+
+    async def acquire(self, tenant: str) -> None:
+        await super().acquire("")
+
+
+async def fairness(args, tmp: str) -> None:
+    out = {}
+    for label, share in (("FIFO", FifoShare(8)), ("FairShare", FairShare(8))):
+        bot.TENANTS_DIR = os.path.join(tmp, f"fair-{label}")
+        tenants = [bot.load_tenant({"NAME": f"f{i}", "BOT_TOKEN": f"{i + 1}:FAIR"}) for i in range(2)]
+        apis = [FakeBotAPI(latency=0.1) for _ in tenants]
+        apps = [(t, bot.make_tenant_app(t, fake_builder(api, t.token), share)) for t, api in zip(tenants, apis)]
+        stop = asyncio.Event()
+        server = asyncio.create_task(serve_tenants(apps, stop=stop))
+        while not all(api.calls["getUpdates"] for api in apis):
+            await asyncio.sleep(0.01)
+        flood, probe = apis
+        t0 = time.perf_counter()
+        for uid in range(10_000, 10_000 + args.flood):
+            flood.push_update(text_update(uid, "/start"))
+        waits = []
+        for uid in range(1, 6):
+            t1 = time.perf_counter()
+            version = probe.version[uid]
+            probe.push_update(text_update(uid, "/start"))
+            await probe.wait_reply(uid, version)
+            waits.append(time.perf_counter() - t1)
+        while flood.calls["sendMessage"] < args.flood:
+            await asyncio.sleep(0.01)
+        drained = time.perf_counter() - t0
+        stop.set()
+        await server
+        out[label] = max(waits)
+        print(f"{label:9}: {args.flood} /start flood on one tenant drained in {drained:.2f} s; "
+              f"other tenant's reply within {max(waits) * 1e3:.0f} ms (worst of {len(waits)})")
+    assert out["FairShare"] * 2 < out["FIFO"]
+
+
+# ── 4. рестарт ────────────────────────────────────────────────────────────
+
+async def restart(tmp: str) -> None:
+    bot.PERSISTENCE_DB = "sessions.db"
+    bot.TENANTS_DIR = os.path.join(tmp, "restart")
+    tenant_specs = [{"NAME": "main", "BOT_TOKEN": "1:MAIN"},
+                    {"NAME": "alt", "BOT_TOKEN": "2:ALT", "QUESTIONS_B": variant(tmp, "alt")}]
+    apis = [FakeBotAPI(), FakeBotAPI()]
+    uid = 500
+    rng = random.Random(5)
+
+    async def run(steps: int):
+        tenants = [bot.load_tenant(spec) for spec in tenant_specs]
+        apps = [(t, bot.make_tenant_app(t, fake_builder(api, t.token), FairShare(8))) for t, api in zip(tenants, apis)]
+        stop = asyncio.Event()
+        server = asyncio.create_task(serve_tenants(apps, stop=stop))
+        while not all(api.calls["getUpdates"] > calls for api, calls in zip(apis, before)):
+            await asyncio.sleep(0.01)
+        sessions = [app.user_data.get(uid, {}).get("sess") for _, app in apps]
+        for api in apis:
+            updates = [] if uid in api.keyboards else [lambda: text_update(uid, "/start")]
+            updates += [lambda: callback_update(uid, rng.choice(api.keyboards[uid]), api.last_message_id[uid])] * steps
+            for make in updates:
+                version = api.version[uid]
+                api.push_update(make())
+                await api.wait_reply(uid, version)
+        stop.set()
+        await server
+        return tenants, sessions
+
+    before = [0, 0]
+    await run(12)  # /start и 12 ответов у каждого бота: A и начало B
+    before = [api.calls["getUpdates"] for api in apis]
+    tenants, sessions = await run(1)
+    main_sess, alt_sess = sessions
+    assert main_sess.content is tenants[0].content.current and alt_sess.content is tenants[1].content.current
+    assert main_sess.content.n_scale == alt_sess.content.n_scale and main_sess.content is not alt_sess.content
+    assert "(alt)" in apis[1].last_text[uid] and "(alt)" not in apis[0].last_text[uid]
+    assert all(os.path.exists(os.path.join(t.root, "sessions.db")) for t in tenants)
+    print(f"restart: sessions of both tenants restored from their own stores with their own questions "
+          f"(same layout, different text), test continues: OK")
+    bot.PERSISTENCE_DB = ""
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tenants", type=int, default=4)
+    ap.add_argument("--users", type=int, default=8)
+    ap.add_argument("--flood", type=int, default=300)
+    ap.add_argument("--child")
+    ap.add_argument("--mode", default="shared")
+    ap.add_argument("--port", type=int)
+    ap.add_argument("--dir")
+    args = ap.parse_args()
+    if args.child:
+        await child(args)
+        return
+    quiet()
+    with tempfile.TemporaryDirectory() as tmp:
+        sharing(tmp)
+        await processes(args, tmp)
+        await fairness(args, tmp)
+        await restart(tmp)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
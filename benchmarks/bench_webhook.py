@@ -0,0 +1,87 @@
+"""
+Пропускная способность: long polling + последовательная обработка против
+webhook + параллельной обработки с упорядочиванием по пользователю.
+
+    python -m benchmarks.bench_webhook [--users 50] [--latency 0.005] [--concurrency 64]
+
+``--latency`` — задержка каждого вызова Bot API (сеть до Telegram). Апдейты
+в режиме polling отдаются через fake ``getUpdates``, в режиме webhook —
+настоящими HTTP POST на встроенный сервер. В конце проверяется, что ни у
+одного пользователя не сбилась позиция в тесте.
+"""
+
+from __future__ import annotations
+import argparse, asyncio, logging, random, time
+
+import etap_test_bot as bot
+from benchmarks.fake_telegram import FakeBotAPI, UpdateTracker, WebhookClient, fake_builder, walk_user
+from webhook import webhook_listener
+
+
+async def walk_all(app, api, feed, users: int) -> float:
+    rng = random.Random(3)
+    t0 = time.perf_counter()
+    taps = sum(await asyncio.gather(*(walk_user(app, api, uid, rng, feed=feed)
+                                      for uid in range(1000, 1000 + users))))
+    rate = taps / (time.perf_counter() - t0)
+    for uid in range(1000, 1000 + users):
+        sess = app.user_data[uid]["sess"]
+        assert sess.n_scale == bot.CONTENT.current.n_scale and sess.c_idx == len(bot.BLOCK_C), uid
+        assert len(sess.d_answers) == len(bot.BLOCK_D), uid
+    return rate
+
+
+async def polling(users: int, latency: float) -> float:
+    api = FakeBotAPI(latency)
+    app = bot.build_app(fake_builder(api))
+    tracker = UpdateTracker(app)
+
+    async def deliver(data):
+        api.push_update(data)
+
+    async with app:
+        await app.updater.start_polling(poll_interval=0, timeout=10)
+        await app.start()
+        rate = await walk_all(app, api, tracker.feed(deliver), users)
+        await app.updater.stop()
+        await app.stop()
+    return rate
+
+
+async def webhook(users: int, latency: float, concurrency: int) -> float:
+    api = FakeBotAPI(latency)
+    app = bot.build_app(fake_builder(api), concurrent_updates=concurrency)
+    tracker = UpdateTracker(app)
+    listener = webhook_listener(app, "/hook", "127.0.0.1", 0, secret_token="s3cret")
+    async with app:
+        await app.start()
+        await listener.start()
+        client = WebhookClient("127.0.0.1", listener.port, "/hook", secret_token="s3cret")
+
+        async def deliver(data):
+            assert await client.post(data) == 200
+
+        rate = await walk_all(app, api, tracker.feed(deliver), users)
+        await client.close()
+        await listener.stop()
+        await app.stop()
+    return rate
+
+
+async def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=50)
+    ap.add_argument("--latency", type=float, default=0.005, help="задержка Bot API, сек")
+    ap.add_argument("--concurrency", type=int, default=64)
+    args = ap.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    seq = await polling(args.users, args.latency)
+    con = await webhook(args.users, args.latency, args.concurrency)
+    print(f"users={args.users} api_latency={args.latency * 1000:.0f}ms")
+    print(f"polling / sequential         : {seq:8.0f} taps/s")
+    print(f"webhook / concurrent({args.concurrency:>3})    : {con:8.0f} taps/s  ({con / seq:.1f}x)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
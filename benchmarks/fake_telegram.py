@@ -0,0 +1,325 @@
+"""
+Локальная подмена Telegram Bot API для бенчмарков
+==================================================
+``FakeBotAPI`` подключается к PTB как ``BaseRequest`` и отвечает на вызовы
+бота прямо в процессе, без сети. Он запоминает последнюю клавиатуру в каждом
+чате, поэтому «виртуальный пользователь» (``walk_user``) проходит тест так же,
+как живой: нажимает одну из показанных кнопок.
+
+Апдейты можно доставлять тремя путями: прямым ``app.process_update``,
+через ``getUpdates`` (``FakeBotAPI.push_update`` — как long polling) или
+POST‑запросами на webhook (``WebhookClient`` — как сервер Telegram).
+Ботам в других процессах тот же API доступен по HTTP (``http_listener``;
+несколько ботов с разными токенами — ``bots_listener``).
+"""
+
+from __future__ import annotations
+import asyncio, itertools, json, random, time
+from collections import Counter, defaultdict, deque
+from typing import Dict, Any, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+from telegram import Update
+from telegram.ext import Application, ApplicationBuilder, TypeHandler
+from telegram.request import BaseRequest, RequestData
+
+from httplistener import HTTPListener
+
+MESSAGE_LIMIT = 4096
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "EtapBot", "username": "etap_bot"}
+
+
+class FakeBotAPI(BaseRequest):
+    """Отвечает на методы Bot API, которые использует бот, и ведёт счётчики вызовов.
+
+    ``flood_global``/``flood_chat`` — сколько отправок в секунду сервер терпит
+    на весь бот и на один чат; сверх этого отвечает 429 с ``retry_after``.
+    ``slow_chats`` — добавочная задержка ответа для отдельных чатов;
+    чатам из ``down_chats`` сервер отвечает 502. Текст длиннее 4096 символов
+    (UTF‑16) отклоняется с 400, как настоящим API.
+    """
+
+    def __init__(self, latency: float = 0.0, flood_global: Optional[int] = None,
+                 flood_chat: Optional[int] = None, retry_after: int = 1,
+                 slow_chats: Optional[Dict[int, float]] = None):
+        self.latency = latency
+        self.slow_chats = slow_chats or {}
+        self.down_chats: set = set()
+        self.flood_global = flood_global
+        self.flood_chat = flood_chat
+        self.retry_after = retry_after
+        self._sent_at: Dict[Any, deque] = defaultdict(deque)  # ключ → времена отправок за 1 с
+        self.calls: Counter = Counter()
+        self.version: Counter = Counter()  # chat_id → сколько раз менялось последнее сообщение
+        self._changed: Dict[int, asyncio.Event] = {}
+        self.keyboards: Dict[int, List[str]] = {}  # chat_id → callback_data последней клавиатуры
+        self.last_text: Dict[int, str] = {}
+        self.last_message_id: Dict[int, int] = {}
+        self._msg_ids = itertools.count(1)
+        self._pending: List[Dict[str, Any]] = []  # очередь для getUpdates
+        self._has_pending = asyncio.Event()
+
+    def push_update(self, data: Dict[str, Any]) -> None:
+        self._pending.append(data)
+        self._has_pending.set()
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get("offset") or 0)
+        self._pending = [u for u in self._pending if u["update_id"] >= offset]
+        if not self._pending:
+            self._has_pending.clear()
+            try:
+                await asyncio.wait_for(self._has_pending.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._pending[:int(params.get("limit") or 100)]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, request_data: Optional[RequestData] = None,
+                         *args: Any, **kwargs: Any) -> Tuple[int, bytes]:
+        return await self.call(url.rsplit("/", 1)[-1], request_data.parameters if request_data else {})
+
+    def http_listener(self, host: str = "127.0.0.1", port: int = 0) -> HTTPListener:
+        """Этот же API по HTTP: бот в другом процессе ходит на ``base_url=http://host:port/bot``."""
+
+        return bots_listener({"*": self}, host, port)
+
+    async def call(self, api_method: str, params: Dict[str, Any]) -> Tuple[int, bytes]:
+        self.calls[api_method] += 1
+        if api_method == "getUpdates":
+            result = await self._get_updates(params)
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+        chat_id = int(params["chat_id"]) if "chat_id" in params else None
+        delay = self.latency + self.slow_chats.get(chat_id, 0.0)
+        if delay:
+            await asyncio.sleep(delay)
+        if chat_id in self.down_chats:
+            self.calls["502"] += 1
+            return 502, json.dumps({"ok": False, "error_code": 502, "description": "Bad Gateway"}).encode()
+        if "chat_id" in params and api_method != "answerCallbackQuery" and self._flooded(params["chat_id"]):
+            self.calls["429"] += 1
+            return 429, json.dumps({
+                "ok": False, "error_code": 429, "description": "Too Many Requests",
+                "parameters": {"retry_after": self.retry_after},
+            }).encode()
+        if len(params.get("text", "").encode("utf-16-le")) > 2 * MESSAGE_LIMIT:
+            self.calls["400"] += 1
+            return 400, json.dumps({"ok": False, "error_code": 400,
+                                    "description": "Bad Request: message is too long"}).encode()
+        result = self.handle(api_method, params)
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    def _flooded(self, chat_id: Any) -> bool:
+        now = time.monotonic()
+        for key, limit in (("*", self.flood_global), (chat_id, self.flood_chat)):
+            if limit is None:
+                continue
+            window = self._sent_at[key]
+            while window and now - window[0] > 1:
+                window.popleft()
+            if len(window) >= limit:
+                return True
+        for key, limit in (("*", self.flood_global), (chat_id, self.flood_chat)):
+            if limit is not None:
+                self._sent_at[key].append(now)
+        return False
+
+    async def wait_reply(self, chat_id: int, version: int, timeout: float = 30) -> None:
+        """Ждёт, пока бот отправит/изменит сообщение в чате после версии ``version``."""
+        while self.version[chat_id] <= version:
+            event = self._changed.setdefault(chat_id, asyncio.Event())
+            event.clear()
+            await asyncio.wait_for(event.wait(), timeout)
+
+    def handle(self, api_method: str, params: Dict[str, Any]) -> Any:
+        if api_method == "getMe":
+            return BOT_USER
+        if api_method in ("sendMessage", "editMessageText", "editMessageReplyMarkup", "sendDocument"):
+            chat_id = int(params["chat_id"])
+            if api_method != "editMessageReplyMarkup":
+                self.keyboards[chat_id] = _buttons(params.get("reply_markup"))
+                self.last_text[chat_id] = params.get("text", "")
+            message_id = int(params.get("message_id") or next(self._msg_ids))
+            self.last_message_id[chat_id] = message_id
+            self.version[chat_id] += 1
+            if chat_id in self._changed:
+                self._changed[chat_id].set()
+            return message(chat_id, message_id, params.get("text", ""), from_bot=True)
+        return True  # answerCallbackQuery, setWebhook, deleteWebhook, …
+
+
+def bots_listener(apis: Dict[str, FakeBotAPI], host: str = "127.0.0.1", port: int = 0) -> HTTPListener:
+    """Bot API для нескольких ботов: ``/bot<токен>/<метод>`` уходит в ``apis[токен]`` (``"*"`` — любой токен)."""
+
+    async def handle(method: str, target: str, headers: Dict[str, str], body: bytes):
+        token, _, api_method = target.split("?", 1)[0].rpartition("/")
+        api = apis.get(token.rpartition("/bot")[2]) or apis.get("*")
+        if api is None:
+            return 404, "application/json", b'{"ok": false, "error_code": 404, "description": "Not Found"}'
+        if headers.get("content-type", "").startswith("application/json"):
+            params = json.loads(body or b"{}")
+        else:
+            params = dict(parse_qsl(body.decode()))  # так шлёт HTTPXRequest из PTB
+        status, payload = await api.call(api_method, params)
+        return status, "application/json", payload
+
+    return HTTPListener(handle, host, port)
+
+
+def _buttons(markup: Any) -> List[str]:
+    if not markup:
+        return []
+    if isinstance(markup, str):
+        markup = json.loads(markup)
+    return [b["callback_data"] for row in markup.get("inline_keyboard", []) for b in row if "callback_data" in b]
+
+
+# ── фабрики апдейтов ──────────────────────────────────────────────────────
+
+update_ids = itertools.count(1)
+
+
+def user(uid: int) -> Dict[str, Any]:
+    return {"id": uid, "is_bot": False, "first_name": f"u{uid}"}
+
+
+def message(chat_id: int, message_id: int, text: str, from_bot: bool = False) -> Dict[str, Any]:
+    return {
+        "message_id": message_id, "date": int(time.time()), "text": text,
+        "chat": {"id": chat_id, "type": "private"},
+        "from": BOT_USER if from_bot else user(chat_id),
+    }
+
+
+def text_update(uid: int, text: str) -> Dict[str, Any]:
+    msg = message(uid, next(update_ids), text)
+    if text.startswith("/"):
+        msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": next(update_ids), "message": msg}
+
+
+def callback_update(uid: int, data: str, message_id: int) -> Dict[str, Any]:
+    return {
+        "update_id": next(update_ids),
+        "callback_query": {
+            "id": str(next(update_ids)), "from": user(uid), "chat_instance": str(uid), "data": data,
+            "message": message(uid, message_id, "", from_bot=True),
+        },
+    }
+
+
+# ── доставка апдейтов ─────────────────────────────────────────────────────
+
+class WebhookClient:
+    """Шлёт апдейты на webhook по пулу keep‑alive соединений, как это делает Telegram."""
+
+    def __init__(self, host: str, port: int, path: str, secret_token: Optional[str] = None,
+                 connections: int = 40):
+        self.host, self.port, self.path = host, port, path
+        self.secret_token = secret_token
+        self.connections = connections
+        self._pool: asyncio.Queue = asyncio.Queue()
+        self._opened = 0
+
+    async def post(self, data: Dict[str, Any]) -> int:
+        if self._pool.empty() and self._opened < self.connections:
+            self._opened += 1
+            self._pool.put_nowait(await asyncio.open_connection(self.host, self.port))
+        reader, writer = await self._pool.get()
+        body = json.dumps(data).encode()
+        secret = f"X-Telegram-Bot-Api-Secret-Token: {self.secret_token}\r\n" if self.secret_token else ""
+        writer.write((f"POST {self.path} HTTP/1.1\r\nHost: {self.host}\r\n"
+                      f"Content-Type: application/json\r\n{secret}"
+                      f"Content-Length: {len(body)}\r\n\r\n").encode() + body)
+        status = int((await reader.readline()).split()[1])
+        length = 0
+        while (line := await reader.readline()) not in (b"\r\n", b""):
+            if line.lower().startswith(b"content-length:"):
+                length = int(line.split(b":")[1])
+        await reader.readexactly(length)
+        self._pool.put_nowait((reader, writer))
+        return status
+
+    async def close(self) -> None:
+        while not self._pool.empty():
+            _, writer = self._pool.get_nowait()
+            writer.close()
+
+
+class UpdateTracker:
+    """Позволяет дождаться, пока приложение обработает конкретный апдейт.
+
+    Ставит ``TypeHandler`` в группу после диалога: он срабатывает, когда
+    ConversationHandler уже закончил с апдейтом.
+    """
+
+    def __init__(self, app: Application):
+        self._done: Dict[int, asyncio.Future] = {}
+        app.add_handler(TypeHandler(Update, self._on_update), group=1)
+
+    async def _on_update(self, update: Update, ctx: Any) -> None:
+        fut = self._done.pop(update.update_id, None)
+        if fut is not None and not fut.done():
+            fut.set_result(None)
+
+    def feed(self, deliver):
+        """Обёртка для ``walk_user``: доставить апдейт через ``deliver`` и дождаться обработки."""
+        async def _feed(data: Dict[str, Any]) -> None:
+            fut = self._done[data["update_id"]] = asyncio.get_running_loop().create_future()
+            await deliver(data)
+            await fut
+        return _feed
+
+
+# ── сборка приложения и виртуальный пользователь ─────────────────────────
+
+def fake_builder(api: FakeBotAPI, token: str = "1:FAKE") -> ApplicationBuilder:
+    return Application.builder().token(token).request(api).get_updates_request(api)
+
+
+async def walk_user(app: Application, api: FakeBotAPI, uid: int, rng: random.Random,
+                    feed=None, latencies: Optional[List[float]] = None,
+                    max_taps: Optional[int] = None, think: float = 0.0) -> int:
+    """Проходит /start → A → B1..B7 → C → результат → D. Возвращает число апдейтов.
+
+    ``feed`` — корутина, которая доставляет dict‑апдейт и ждёт его обработки
+    (по умолчанию ``app.process_update``); ``max_taps`` — бросить тест на полпути;
+    ``think`` — средняя пауза между нажатиями, сек (экспоненциальное распределение).
+    """
+    async def process(data: Dict[str, Any]) -> None:
+        await app.process_update(Update.de_json(data, app.bot))
+
+    feed = feed or process
+    taps = 0
+
+    async def send(data: Dict[str, Any]) -> None:
+        nonlocal taps
+        if think and taps:
+            await asyncio.sleep(rng.expovariate(1 / think))
+        version = api.version[uid]
+        t0 = time.perf_counter()
+        await feed(data)
+        # правки вопросов могут уходить после возврата из обработчика (SendScheduler)
+        await api.wait_reply(uid, version)
+        if latencies is not None:
+            latencies.append(time.perf_counter() - t0)
+        taps += 1
+
+    await send(text_update(uid, "/start"))
+    while True:
+        buttons = api.keyboards.get(uid, [])
+        if "restart" in buttons or taps == max_taps:
+            return taps  # финальное сообщение — тест пройден
+        if "startD" in buttons:
+            data = "startD"
+        elif buttons:
+            data = rng.choice(buttons)
+        else:
+            await send(text_update(uid, f"ответ {taps}"))
+            continue
+        await send(callback_update(uid, data, api.last_message_id[uid]))
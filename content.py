@@ -0,0 +1,260 @@
+"""
+Вопросы блока B и интерпретации: проверка, индекс уровней, горячая замена
+==========================================================================
+``questions_b.json`` и ``interpretations.json`` собираются в неизменяемый
+``Content``: таблица вопросов (см. questions.py), раскладка ответов B1..B7
+и индекс «балл → уровень» для каждого этапа — поиск уровня одним обращением
+к кортежу. При сборке проверяется, что блоков ровно B1..B7, а диапазоны
+уровней покрывают все возможные баллы без дыр и пересечений; иначе
+``ContentError`` и прежняя версия остаётся в работе. Достижимость порогов
+этапов зависит от правил и проверяется ``Ruleset.check`` (scoring.py) в хуке
+``on_load``.
+
+``ContentStore`` следит за файлами и подменяет текущую версию целиком;
+``on_load`` готовит производные данные версии (шаблоны результата) ещё в
+потоке загрузки, до подмены.
+Сессия держит ссылку на ту версию, с которой начала тест, и сохраняется
+(pickle) вместе с её идентификатором — хэшем содержимого файлов — и раскладкой
+блоков B. Пока сессия выгружена на диск (sessions.py), ссылку на версию
+держит ``SessionKeeper``. Другая версия подставляется только при той же
+раскладке блоков.
+
+Одинаковые файлы дают один и тот же ``Content``: если несколько ботов
+процесса (см. tenants.py) читают одинаковые вопросы, таблица вопросов,
+индекс уровней и шаблоны результата существуют в одном экземпляре.
+``ACTIVE_STORE`` — хранилище бота, чьи апдейты обрабатываются в текущем
+контексте asyncio; по нему восстановленная сессия находит свою версию.
+"""
+
+from __future__ import annotations
+import asyncio, hashlib, json, logging, os, weakref
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from questions import SCALE, Question, compile_table
+
+log = logging.getLogger("EtapBot.content")
+
+B_KEYS = tuple(f"B{i}" for i in range(1, 8))
+STAGE_THRESHOLD = 27           # порог этапа по умолчанию (правила — в scoring.Ruleset)
+MAX_ANSWER = len(SCALE) - 1    # ответ 0‑4
+MAX_BLOCK = 255 // MAX_ANSWER  # вопросов в блоке B: сумма хранится в одном байте (results.RECORD)
+
+
+class ContentError(ValueError):
+    """Файлы вопросов или интерпретаций не прошли проверку."""
+
+
+class Content:
+    """Одна версия вопросов и интерпретаций; после сборки не меняется."""
+    __slots__ = ("version", "block_b", "b_layout", "n_scale", "questions", "interpretations",
+                 "_levels", "__weakref__")
+
+    def __init__(self, version: str, block_a: Sequence[str], block_b: Dict[str, List[str]],
+                 block_c: Sequence[str], interpretations: Dict[str, Any], states: Tuple[int, int, int]):
+        _check_block_b(block_b)
+        self.version = version
+        self.block_b = block_b
+        # Ответы 0‑4 блоков A и B лежат подряд в Session.scale: сначала A, затем B1..B7
+        layout, off = [], len(block_a)
+        for key in B_KEYS:
+            layout.append((key, off, len(block_b[key])))
+            off += len(block_b[key])
+        self.b_layout: Tuple[Tuple[str, int, int], ...] = tuple(layout)
+        self.n_scale = off
+        self.questions: Tuple[Question, ...] = compile_table(block_a, block_b, block_c, states)
+        self.interpretations = interpretations
+        self._levels = _level_index(interpretations, {key: n for key, _, n in layout})
+
+    @property
+    def b_sizes(self) -> Tuple[int, ...]:
+        """Число вопросов в B1..B7."""
+        return tuple(n for _, _, n in self.b_layout)
+
+    @property
+    def levels(self) -> tuple:
+        """Индекс уровней: для этапа n — (данные этапа, ключ уровня, данные уровня) по баллу."""
+        return self._levels
+
+    def level(self, stage: int, score: int) -> Tuple[Dict[str, Any], str, Dict[str, Any]]:
+        """(данные этапа, ключ уровня, данные уровня) для этапа и балла его блока B."""
+        index = self._levels[stage]
+        return index[score if score < len(index) else -1]
+
+
+def _check_block_b(block_b: Dict[str, List[str]]) -> None:
+    if set(block_b) != set(B_KEYS):
+        raise ContentError(f"questions_b: expected blocks {', '.join(B_KEYS)}, got {', '.join(sorted(block_b))}")
+    for key in B_KEYS:
+        items = block_b[key]
+        if not isinstance(items, list) or not all(isinstance(q, str) and q.strip() for q in items):
+            raise ContentError(f"questions_b: {key} must be a list of non-empty strings")
+        if len(items) > MAX_BLOCK:
+            raise ContentError(f"questions_b: {key} has {len(items)} questions, "
+                               f"at most {MAX_BLOCK} fit the results file")
+
+
+def _level_index(interpretations: Dict[str, Any], sizes: Dict[str, int]) -> tuple:
+    """Для этапа n — кортеж (данные этапа, ключ уровня, данные уровня) по каждому баллу 0..max блока Bn."""
+    expected = {str(n) for n in range(len(B_KEYS) + 1)}
+    if set(interpretations) != expected:
+        raise ContentError(f"interpretations: expected stages 0..{len(B_KEYS)}, got {sorted(interpretations)}")
+    index = []
+    for stage in range(len(B_KEYS) + 1):
+        data = interpretations[str(stage)]
+        where = f"interpretations[{stage}]"
+        if not isinstance(data, dict):
+            raise ContentError(f"{where}: must be an object")
+        if not isinstance(data.get("title"), str) or not isinstance(data.get("levels"), dict) or not data["levels"]:
+            raise ContentError(f"{where}: title and levels (an object) are required")
+        # Для этапа 0 уровень не зависит от баллов — балл всегда 0
+        top = sizes[f"B{stage}"] * MAX_ANSWER if stage else 0
+        ranges = []
+        for key, level in data["levels"].items():
+            if not isinstance(level, dict):
+                raise ContentError(f"{where}.{key}: must be an object")
+            rng = level.get("range")
+            if not (isinstance(rng, list) and len(rng) == 2 and all(isinstance(x, int) for x in rng)
+                    and rng[0] <= rng[1]):
+                raise ContentError(f"{where}.{key}: range must be [min, max]")
+            if not isinstance(level.get("description"), str):
+                raise ContentError(f"{where}.{key}: description is required")
+            recs = level.get("recommendations", [])
+            if not (isinstance(recs, list) and all(isinstance(r, str) for r in recs)):
+                raise ContentError(f"{where}.{key}: recommendations must be a list of strings")
+            ranges.append((rng[0], rng[1], key))
+        ranges.sort()
+        covered = -1
+        for lo, hi, key in ranges:
+            if lo <= covered:
+                raise ContentError(f"{where}.{key}: range {lo}..{hi} overlaps previous level (up to {covered})")
+            if lo > covered + 1 and lo <= top:
+                raise ContentError(f"{where}: scores {covered + 1}..{lo - 1} have no level")
+            covered = hi
+        if covered < top:
+            raise ContentError(f"{where}: scores {covered + 1}..{top} have no level")
+        levels = [None] * (top + 1)
+        for lo, hi, key in ranges:
+            entry = (data, key, data["levels"][key])
+            for score in range(max(lo, 0), min(hi, top) + 1):
+                levels[score] = entry
+        index.append(tuple(levels))
+    return tuple(index)
+
+
+def level_index(block_b: Dict[str, List[str]], interpretations: Dict[str, Any]) -> tuple:
+    """Проверенный индекс уровней, как ``Content.levels``, без сборки таблицы вопросов."""
+    _check_block_b(block_b)
+    return _level_index(interpretations, {key: len(block_b[key]) for key in B_KEYS})
+
+
+def load_content(b_path: str, interp_path: str, block_a: Sequence[str], block_c: Sequence[str],
+                 states: Tuple[int, int, int]) -> Content:
+    """Читает и проверяет оба файла. Версия — хэш их содержимого."""
+    with open(b_path, "rb") as f:
+        raw_b = f.read()
+    with open(interp_path, "rb") as f:
+        raw_i = f.read()
+    try:
+        block_b, interpretations = json.loads(raw_b), json.loads(raw_i)
+    except json.JSONDecodeError as exc:
+        raise ContentError(f"invalid JSON: {exc}") from exc
+    if not isinstance(block_b, dict) or not isinstance(interpretations, dict):
+        raise ContentError("both files must contain a JSON object")
+    version = hashlib.sha1(raw_b + b"\0" + raw_i).hexdigest()[:10]
+    key = (version, tuple(block_a), tuple(block_c), states)
+    content = _LOADED.get(key)
+    if content is None:
+        content = _LOADED[key] = Content(version, block_a, block_b, block_c, interpretations, states)
+    return content
+
+
+# Загруженные версии: одинаковые файлы (и блоки A, C) — один экземпляр на процесс
+_LOADED: "weakref.WeakValueDictionary[tuple, Content]" = weakref.WeakValueDictionary()
+
+
+class ContentStore:
+    """Текущая версия контента, старые версии (пока на них ссылаются сессии) и слежение за файлами."""
+
+    def __init__(self, b_path: str, interp_path: str, block_a: Sequence[str], block_c: Sequence[str],
+                 states: Tuple[int, int, int], interval: float = 5.0,
+                 on_load: Optional[Callable[[Content], None]] = None):
+        self._args = (b_path, interp_path, block_a, block_c, states)
+        self.paths = (b_path, interp_path)
+        self.interval = interval
+        self._on_load = on_load
+        self._mtimes = self._stat()
+        self.current = self._load()
+        self._versions: "weakref.WeakValueDictionary[str, Content]" = weakref.WeakValueDictionary()
+        self._versions[self.current.version] = self.current
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, version: str) -> Optional[Content]:
+        return self._versions.get(version)
+
+    def resolve(self, version: Optional[str], n_scale: int,
+                b_sizes: Optional[Tuple[int, ...]] = None) -> Optional[Content]:
+        """Версия для восстановленной сессии. После рестарта старых версий нет —
+        подойдёт текущая, если раскладка ответов та же (блоки B1..B7 тех же размеров,
+        а не только то же общее число ответов); иначе None. ``b_sizes`` нет только
+        у сессий, сохранённых до того, как их стали записывать."""
+        content = self._versions.get(version) if version else None
+        current = self.current
+        if content is None and current.n_scale == n_scale and b_sizes in (None, current.b_sizes):
+            content = current
+        return content
+
+    def _load(self) -> Content:
+        content = load_content(*self._args)
+        if self._on_load is not None:
+            self._on_load(content)
+        return content
+
+    def _stat(self) -> Tuple[float, ...]:
+        return tuple(os.stat(p).st_mtime_ns for p in self.paths)
+
+    def install(self, content: Content) -> None:
+        self._versions[content.version] = content
+        self.current = content  # одно присваивание: новые сессии сразу получают новую версию
+
+    async def reload(self) -> bool:
+        """Перечитывает файлы (в потоке) и подменяет версию. False — если проверка не прошла."""
+        try:
+            content = await asyncio.to_thread(self._load)
+        except (OSError, ContentError) as exc:
+            log.error("Content reload rejected, keeping version %s: %s", self.current.version, exc)
+            return False
+        except Exception:  # например, сбой on_load — версия не подменяется
+            log.exception("Content reload failed, keeping version %s", self.current.version)
+            return False
+        if content.version != self.current.version:
+            self.install(content)
+            log.info("Content reloaded: version %s", content.version)
+        return True
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                mtimes = self._stat()
+            except OSError:
+                continue  # файл заменяют прямо сейчас
+            if mtimes != self._mtimes:
+                self._mtimes = mtimes
+                try:
+                    await self.reload()
+                except Exception:  # слежение не должно останавливаться ни при какой ошибке
+                    log.exception("Content watcher error")
+
+    def start(self) -> None:
+        if self.interval and self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+# Хранилище бота, чьи апдейты обрабатываются в этом контексте; None — единственный бот процесса
+ACTIVE_STORE: "ContextVar[Optional[ContentStore]]" = ContextVar("etap_content_store", default=None)
@@ -7,7 +7,7 @@ Telegram‑бот «Этап‑Тест 7D»  v1.1
 • Автоматический расчёт баллов, проверка искажения, определение текущего этапа.
 • Блок D: после вывода результата бот задаёт 10 вопросов по одному, собирает текстовые ответы и отправляет их:
     – пользователю в виде PDF‑сводки (если установлен *reportlab*);
-    – администратору (CHAT_ID_ADMIN) отдельным сообщением/JSON.
+    – администратору (CHAT_ID_ADMIN) периодической сводкой (см. admin_digest.py).
 
 Запуск
 ------
@@ -21,19 +21,39 @@ Docker‑пример и деплой на Fly.io/Render смотрите в REA
 """
 
 from __future__ import annotations
-import os, json, logging, asyncio, datetime as dt
-from typing import Dict, Any, List
-from collections import defaultdict
+import os, json, logging, asyncio, time, datetime as dt
+from collections import Counter
+from html import escape
+from typing import Callable, Dict, Any, List, Optional
 
 from telegram import (
     Update, InlineKeyboardButton as Btn, InlineKeyboardMarkup as Markup,
     ReplyKeyboardRemove,
 )
-from telegram.error import BadRequest
 from telegram.ext import (
-    Application, ContextTypes, CommandHandler, CallbackQueryHandler,
-    ConversationHandler, MessageHandler, filters,
+    Application, ApplicationBuilder, BasePersistence, BaseRateLimiter, ContextTypes,
+    CommandHandler, CallbackQueryHandler, ConversationHandler, MessageHandler, TypeHandler, filters,
 )
+from telegram.request import HTTPXRequest
+
+from admin_digest import AdminDigest
+from content import ACTIVE_STORE, Content, ContentError, ContentStore
+from interview import InterviewSpool, SpooledAnswers
+from logpipe import setup_logging, with_log_context
+from metrics import (
+    REGISTRY, LoopMonitor, MetricsServer, SamplingProfiler, instrument, perf_report, timed,
+)
+from outbox import SendScheduler
+from persistence import SQLitePersistence
+from questions import Question, parse_answer
+from report import ReportError, ReportRenderer
+from result_text import LOCALES, build_templates, pick_locale, result_templates
+from results import ResultStore, format_stats
+from scoring import Ruleset, RulesetError, ScoringEngine
+from sessions import SessionKeeper
+from shard import RemoteResults, ShardDispatcher, run_sharded
+from tenants import FairShare, SharedRequest, Tenant, TenantUpdateProcessor, run_tenants
+from webhook import PerUserUpdateProcessor, run_webhook
 # from dotenv import load_dotenv
 # load_dotenv()
 # TOKEN = os.getenv("BOT_TOKEN")
@@ -43,8 +63,67 @@ from telegram.ext import (
 try:
     with open(os.path.join(os.path.dirname(__file__), "config.json"), "r") as f:
         config = json.load(f)
-    TOKEN = config["BOT_TOKEN"]
+    # Несколько ботов в одном процессе (см. tenants.py): список {"NAME", "BOT_TOKEN", …};
+    # незаданные в записи ключи берутся отсюда, файлы бота лежат в TENANTS_DIR/<NAME>/
+    TENANTS = config.get("TENANTS") or []
+    TENANTS_DIR = config.get("TENANTS_DIR", "tenants")
+    TOKEN = config.get("BOT_TOKEN", "") if TENANTS else config["BOT_TOKEN"]
     CHAT_ID_ADMIN = int(config.get("CHAT_ID_ADMIN", 0)) or None
+    # Пустая строка отключает сохранение сессий между перезапусками
+    PERSISTENCE_DB = config.get("PERSISTENCE_DB", "sessions.db")
+    PERSISTENCE_INTERVAL = float(config.get("PERSISTENCE_INTERVAL", 10))
+    # Брошенные сессии выгружаются на диск: после простоя (сек) и сверх числа в памяти
+    SESSION_SPILL_DB = config.get("SESSION_SPILL_DB", "sessions_spill.db")
+    SESSION_TTL = float(config.get("SESSION_TTL", 3600))
+    SESSION_MAX_RESIDENT = int(config.get("SESSION_MAX_RESIDENT", 10000))
+    SESSION_SPILL_TTL = float(config.get("SESSION_SPILL_TTL", 30 * 86400))
+    # Сколько апдейтов разных пользователей обрабатывать одновременно (1 — строго по очереди)
+    CONCURRENT_UPDATES = int(config.get("CONCURRENT_UPDATES", 64))
+    # Больше 1 — пользователи делятся между процессами‑воркерами (только с WEBHOOK_URL, см. shard.py)
+    SHARD_WORKERS = int(config.get("SHARD_WORKERS", 1))
+    # Если задан WEBHOOK_URL, бот принимает апдейты webhook'ом вместо long polling
+    WEBHOOK_URL = config.get("WEBHOOK_URL", "")
+    WEBHOOK_LISTEN = config.get("WEBHOOK_LISTEN", "0.0.0.0")
+    WEBHOOK_PORT = int(config.get("WEBHOOK_PORT", 8443))
+    WEBHOOK_SECRET = config.get("WEBHOOK_SECRET") or None
+    # Бюджеты исходящих запросов к Telegram (в секунду): на весь бот и на один чат
+    RATE_LIMIT_GLOBAL = float(config.get("RATE_LIMIT_GLOBAL", 30))
+    RATE_LIMIT_CHAT = float(config.get("RATE_LIMIT_CHAT", 1))
+    RATE_LIMIT_CHAT_BURST = float(config.get("RATE_LIMIT_CHAT_BURST", 5))
+
+    # Ответы Блока D: каталог файлов интервью и лимиты в символах — на ответ и на всё интервью
+    D_SPOOL_DIR = config.get("D_SPOOL_DIR", "d_spool")
+    D_ANSWER_MAX_CHARS = int(config.get("D_ANSWER_MAX_CHARS", 2000))
+    D_SESSION_MAX_CHARS = int(config.get("D_SESSION_MAX_CHARS", 16000))
+
+    ADMIN_SPOOL = config.get("ADMIN_SPOOL", "admin_spool.jsonl")
+    ADMIN_DIGEST_INTERVAL = float(config.get("ADMIN_DIGEST_INTERVAL", 300))
+    ADMIN_DIGEST_MAX_ENTRIES = int(config.get("ADMIN_DIGEST_MAX_ENTRIES", 20))
+
+    REPORT_WORKERS = int(config.get("REPORT_WORKERS", 2))
+    REPORT_FONT = config.get("REPORT_FONT", "")
+
+    RESULTS_DB = config.get("RESULTS_DB", "results.bin")
+
+    METRICS_HOST = config.get("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(config.get("METRICS_PORT", 0))
+
+    # Как часто проверять questions_b.json / interpretations.json на изменения, сек (0 — не следить)
+    CONTENT_WATCH_INTERVAL = float(config.get("CONTENT_WATCH_INTERVAL", 5))
+    # Пороги этапов и «идеализирующие» ответы блока C (см. scoring.py)
+    RULESET_FILE = config.get("RULESET_FILE", "ruleset.json")
+    # Язык экрана результата, если языка клиента пользователя нет в result_text.LOCALES
+    LOCALE = config.get("LOCALE", "ru")
+
+    # Журнал: ротация по размеру (байт) и времени (сек), число старых частей, gzip, JSON‑записи
+    LOG_FILE = config.get("LOG_FILE", "bot.log")
+    LOG_MAX_BYTES = int(config.get("LOG_MAX_BYTES", 10 * 2 ** 20))
+    LOG_ROTATE_INTERVAL = float(config.get("LOG_ROTATE_INTERVAL", 86400))
+    LOG_BACKUPS = int(config.get("LOG_BACKUPS", 7))
+    LOG_COMPRESS = bool(config.get("LOG_COMPRESS", True))
+    LOG_JSON = bool(config.get("LOG_JSON", True))
+    # Сколько записей может ждать фонового потока; при заполнении младшие уровни отбрасываются
+    LOG_QUEUE_SIZE = int(config.get("LOG_QUEUE_SIZE", 10000))
 except FileNotFoundError:
     log.critical("FATAL: config.json not found. Please create it from config.json.example")
     raise SystemExit("config.json not found.")
@@ -55,19 +134,19 @@ except (KeyError, json.JSONDecodeError):
     raise SystemExit("Invalid config.json file.")
 # ---
 
-# --- Logging Setup ---
-log_formatter = logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s")
-log_file = os.path.join(os.path.dirname(__file__), "bot.log")
-
-# Setup handlers
-file_handler = logging.FileHandler(log_file, encoding="utf-8")
-file_handler.setFormatter(log_formatter)
-
-stream_handler = logging.StreamHandler()
-stream_handler.setFormatter(log_formatter)
+# Дочерние процессы (spawn) импортируют этот файл как __mp_main__: процессу пула PDF (report.py)
+# нужны только шрифт и шаблон сводки, воркер шарда загружает контент сам (load_shared в
+# make_shard_app), а журнал обоих пишет родитель — второй файловый обработчик им не нужен.
+CHILD = __name__ == "__mp_main__"
 
-# Configure root logger
-logging.basicConfig(level=logging.INFO, handlers=[file_handler, stream_handler])
+# --- Logging Setup ---
+# Файл и консоль пишет фоновый поток (см. logpipe.py), цикл asyncio только ставит записи в очередь
+if not CHILD:
+    log_listener = setup_logging(
+        os.path.join(os.path.dirname(__file__), LOG_FILE), logging.INFO,
+        max_bytes=LOG_MAX_BYTES, interval=LOG_ROTATE_INTERVAL, backups=LOG_BACKUPS,
+        compress=LOG_COMPRESS, json_records=LOG_JSON, queue_size=LOG_QUEUE_SIZE,
+    )
 
 log = logging.getLogger("EtapBot")
 # ---
@@ -76,9 +155,6 @@ log = logging.getLogger("EtapBot")
 #  CONSTANTS & QUESTIONS
 # ────────────────────────────────────────────────────────────────────────────
 
-SCALE = ["0", "1", "2", "3", "4"]
-TF = ["True", "False"]
-
 BLOCK_A = [
     "Я ощущаю, будто жить «по‑старому» больше невозможно.",
     "Уверен(а), что раскрытие Истины — дело всей моей жизни.",
@@ -92,12 +168,7 @@ BLOCK_A = [
 
 # B‑BLOCK questions → dict{stage: list[str]}. (сокращённые формулировки)
 # Из‑за длины в коде хранится отдельно — см. файл questions_b.json рядом.
-
-with open(os.path.join(os.path.dirname(__file__), "questions_b.json"), "r", encoding="utf‑8") as f:
-    BLOCK_B: Dict[str, List[str]] = json.load(f)  # keys "B1", "B2", … "B7"
-
-with open(os.path.join(os.path.dirname(__file__), "interpretations.json"), "r", encoding="utf‑8") as f:
-    INTERPRETATIONS: Dict[str, Any] = json.load(f)
+# Он и interpretations.json загружаются через ContentStore (см. ниже и content.py).
 
 BLOCK_C = [
     "Я НИКОГДА не злюсь на людей.",
@@ -110,9 +181,6 @@ BLOCK_C = [
     "Бывает, что я говорю то, о чём потом жалею.",
     "Я никогда не чувствовал ревности.",
 ]
-IDEAL_POS_TRUE = {0, 1, 2, 5, 6, 8}  # Индексы, где ответ True говорит об идеализации
-IDEAL_POS_FALSE = {3, 4, 7}          # Индексы, где ответ False говорит об идеализации
-
 BLOCK_D = [
     "Опишите самый сильный недавний опыт, связанный с энергией (место, тело, мысли).",
     "Что Вы чувствуете к своему телу сейчас? Изменилось ли это ощущение за последний год?",
@@ -133,224 +201,325 @@ A, B, C, RESULT, D = range(5)
 #  HELPERS
 # ────────────────────────────────────────────────────────────────────────────
 
+def content_loader(rules: Ruleset) -> Callable[[Content], None]:
+    """Хук ``on_load`` версии контента: правила к ней применимы, затем тексты результата.
+    Так же проверяется и горячая замена файлов — иначе её примет ContentStore."""
+
+    def on_load(content: Content) -> None:
+        try:
+            rules.check(content)
+        except RulesetError as exc:
+            raise ContentError(f"ruleset: {exc}") from exc
+        build_templates(content)
+
+    return on_load
+
+def load_shared() -> None:
+    """Правила (ENGINE), контент (CONTENT) и файлы интервью (ANSWERS) процесса; повторно — ничего."""
+    global ENGINE, CONTENT, ANSWERS
+    if "ANSWERS" in globals():
+        return
+    # Правила подсчёта: тот же движок пересчитывает архив результатов (python scoring.py)
+    try:
+        ENGINE = ScoringEngine(Ruleset.load(os.path.join(os.path.dirname(__file__), RULESET_FILE)))
+    except (OSError, RulesetError) as exc:
+        log.critical("FATAL: %s", exc)
+        raise SystemExit(f"Invalid ruleset: {exc}")
+
+    # Блок B, интерпретации и собранная из них таблица вопросов A/B/C (индекс = Session.pos).
+    # CONTENT.current — последняя проверенная версия; сессия держит ту, с которой начала.
+    # Тексты результата для каждой версии собираются сразу при загрузке (result_text.py).
+    try:
+        CONTENT = ContentStore(os.path.join(os.path.dirname(__file__), "questions_b.json"),
+                               os.path.join(os.path.dirname(__file__), "interpretations.json"),
+                               BLOCK_A, BLOCK_C, states=(A, B, C), interval=CONTENT_WATCH_INTERVAL,
+                               on_load=content_loader(ENGINE.rules))
+    except (OSError, ContentError) as exc:
+        log.critical("FATAL: %s", exc)
+        raise SystemExit(f"Invalid questions_b.json or interpretations.json: {exc}")
+    if LOCALE not in LOCALES:
+        log.critical("FATAL: unknown LOCALE %r, available: %s", LOCALE, ", ".join(LOCALES))
+        raise SystemExit(f"Unknown LOCALE {LOCALE!r}.")
+
+    # Файлы ответов Блока D (interview.py); брошенные интервью живут столько же, сколько выгруженные сессии
+    ANSWERS = InterviewSpool(os.path.join(os.path.dirname(__file__), D_SPOOL_DIR),
+                             D_ANSWER_MAX_CHARS, D_SESSION_MAX_CHARS, ttl=SESSION_SPILL_TTL)
+
+if not CHILD:
+    load_shared()
+
+RESTART_MARKUP = Markup([[Btn("Пройти тест заново", callback_data="restart")]])
+
+START_MARKUP = Markup([[Btn("🚀 Поехали", callback_data="start_A")]])
+RESULT_MARKUP = Markup([[Btn("➕ Пройти интервью (Блок D)", callback_data="startD"), Btn("Завершить", callback_data="done")]])
+FINAL_MARKUP = Markup([
+    [Btn("Пройти тест еще раз", callback_data="restart")],
+    [Btn("Записаться на консультацию", url="http://t.me/mtgates")],
+    [Btn("Подписаться на канал", url="http://t.me/wakeupspirit")]
+])
+
 class Session:
-    """Хранит ответы пользователя."""
-    def __init__(self):
-        self.answers: Dict[str, List[int]] = defaultdict(list)  # A, B1..B7, C
-        self.d_answers: List[str] = []
-        self.b_stage_keys = [f"B{i}" for i in range(1, 8)]
-        self.curr_b_stage = 0
-        self.curr_b_idx = 0
+    """Хранит ответы пользователя (компактно: несколько сотен байт на сессию)."""
+    __slots__ = ("epoch", "content", "scale", "n_scale", "c_bits", "c_idx", "d_answers")
+
+    def __init__(self, epoch: int = 0, content: Optional[Content] = None):
+        self.epoch = epoch               # номер прохождения, зашит в callback_data
+        # Версия вопросов и интерпретаций, с которой начат тест; None — после
+        # перезапуска её нет, а раскладка ответов текущей версии другая
+        self.content: Optional[Content] = content or CONTENT.current
+        self.scale = bytearray(self.content.n_scale)  # ответы 0‑4 на A и B1..B7 по плоскому индексу
+        self.n_scale = 0                 # сколько из них уже дано
+        self.c_bits = 0                  # бит i = ответ True на C[i]
         self.c_idx = 0
-        self.d_idx = 0
+        self.d_answers: Optional[SpooledAnswers] = None  # создаётся только при входе в блок D; ответы — на диске
+
+    def add_scale(self, value: int) -> None:
+        self.scale[self.n_scale] = value
+        self.n_scale += 1
+
+    def add_c(self, value: bool) -> None:
+        if value:
+            self.c_bits |= 1 << self.c_idx
+        self.c_idx += 1
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # В хранилище сессий попадает только идентификатор версии контента и раскладка
+        # ответов по блокам B: по ней проверяется, подходит ли другая версия
+        state = {slot: getattr(self, slot) for slot in self.__slots__}
+        state["content"] = self.content.version if self.content is not None else None
+        state["b_sizes"] = self.content.b_sizes if self.content is not None else None
+        return state
+
+    def __setstate__(self, state: Any) -> None:
+        version = state.pop("content", None)
+        b_sizes = state.pop("b_sizes", None)
+        for slot, value in state.items():
+            setattr(self, slot, value)
+        # Версия ищется у бота, чьи апдейты сейчас обрабатываются (несколько ботов — tenants.py)
+        self.content = (ACTIVE_STORE.get() or CONTENT).resolve(version, len(self.scale), b_sizes)
+
+    @property
+    def pos(self) -> int:
+        """Номер текущего вопроса в content.questions."""
+        return self.n_scale + self.c_idx
+
+    def record(self, value: int) -> None:
+        if self.n_scale < self.content.n_scale:
+            self.add_scale(value)
+        else:
+            self.add_c(bool(value))
 
     # … расчёт баллов и этапа …
-    def compute(self) -> Dict[str, Any]:
-        sums = {}
-        for i, key in enumerate(self.b_stage_keys, start=1):
-            sums[key] = sum(self.answers[key])
-        stage_num = 0
-        for num in range(1, 8):
-            if sums[f"B{num}"] >= 27:
-                stage_num = num
-            else:
-                break
-        
-        c_answers = self.answers["C"]
-        ideal_true = sum(1 for i, v in enumerate(c_answers) if i in IDEAL_POS_TRUE and v == 1)
-        ideal_false = sum(1 for i, v in enumerate(c_answers) if i in IDEAL_POS_FALSE and v == 0)
-        dist = ideal_true + ideal_false
-        
-        return dict(stage=stage_num, sums=sums, distortion=dist)
+    def compute(self, engine: Optional[ScoringEngine] = None) -> Dict[str, Any]:
+        scale = self.scale
+        sums = {key: sum(scale[off:off + n]) for key, off, n in self.content.b_layout}
+        stage, dist, warning = (engine or ENGINE).score_one(list(sums.values()), self.c_bits, self.c_idx)
+        return dict(stage=stage, sums=sums, distortion=dist, warning=warning)
 
 # user_data["sess"] = Session()
 
+def tenant_of(bot_data: Dict[str, Any]) -> Tenant:
+    """Бот, чьи апдейты обрабатываются; без TENANTS — единственный бот из config.json."""
+    tenant = bot_data.get("tenant")
+    if tenant is None:
+        tenant = Tenant("", TOKEN, CONTENT, ENGINE, ANSWERS, LOCALE, CHAT_ID_ADMIN, os.path.dirname(__file__))
+    return tenant
+
 # ────────────────────────────────────────────────────────────────────────────
 #  HANDLERS
 # ────────────────────────────────────────────────────────────────────────────
 
 async def start(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    ctx.user_data["sess"] = Session()
+    prev: Optional[Session] = ctx.user_data.get("sess")
+    # Новая эпоха: кнопки прошлого прохождения больше не примутся как ответы
+    ctx.user_data["sess"] = Session(epoch=prev.epoch + 1 if prev else 0,
+                                    content=tenant_of(ctx.bot_data).content.current)
     text = "Привет! Это диагностика *Этап‑Тест 7D*. Ответьте честно, время ≈30 мин.\n\nНачнём?"
-    markup = Markup([[Btn("🚀 Поехали", callback_data="start_A")]])
 
     if update.callback_query:
         await update.callback_query.answer()
-        await update.callback_query.message.reply_text(text, parse_mode="Markdown", reply_markup=markup)
+        await update.callback_query.message.reply_text(text, parse_mode="Markdown", reply_markup=START_MARKUP)
     else:
         await update.message.reply_text(
             text, parse_mode="Markdown",
-            reply_markup=markup
+            reply_markup=START_MARKUP
         )
     return A
 
-async def a_block(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    sess: Session = ctx.user_data["sess"]
-    idx = len(sess.answers["A"])
-    if update.callback_query.data.startswith("ansA"):
-        sess.answers["A"].append(int(update.callback_query.data.split("|")[1]))
-        idx += 1
-    if idx >= len(BLOCK_A):
-        # go to B
-        return await start_b(update, ctx)
-    q = BLOCK_A[idx]
-    kb = [[Btn(s, callback_data=f"ansA|{s}") for s in SCALE]]
-    text = f"A{idx+1}/{len(BLOCK_A)}\n{q}"
-    if update.callback_query:
-        await update.callback_query.edit_message_text(text, reply_markup=Markup(kb))
-    else:
-        await update.message.reply_text(text, reply_markup=Markup(kb))
-    return A
+def drop(update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> None:
+    """Отброшенное нажатие: ответ на колбэк уходит в фоне, состояние диалога не меняется."""
+    ctx.application.create_task(update.callback_query.answer(), update=update)
+    return None
 
-async def start_b(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    sess: Session = ctx.user_data["sess"]
-    sess.curr_b_stage = 0
-    sess.curr_b_idx = 0
-    return await ask_b(update, ctx)
+async def ask(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    """Записывает ответ на текущий вопрос A/B/C и показывает следующий.
 
-async def ask_b(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    Ответ принимается, только если эпоха и номер вопроса из callback_data
+    совпадают с сессией. Двойное нажатие, повторная доставка или кнопка из
+    прошлого прохождения отбрасываются без записи; колбэк только подтверждается
+    в фоне, чтобы у кнопки пропали «часики».
+    """
     sess: Session = ctx.user_data["sess"]
-    # записать прошлый ответ
-    if update.callback_query and update.callback_query.data.startswith("ansB"):
-        _, val = update.callback_query.data.split("|")
-        key = sess.b_stage_keys[sess.curr_b_stage]
-        sess.answers[key].append(int(val))
-        sess.curr_b_idx += 1
-    stage_key = sess.b_stage_keys[sess.curr_b_stage]
-    total_in_stage = len(BLOCK_B[stage_key])
-    if sess.curr_b_idx >= total_in_stage:
-        sess.curr_b_stage += 1
-        sess.curr_b_idx = 0
-        if sess.curr_b_stage >= 7:
-            return await start_c(update, ctx)
-        stage_key = sess.b_stage_keys[sess.curr_b_stage]
-        total_in_stage = len(BLOCK_B[stage_key])
-    q = BLOCK_B[stage_key][sess.curr_b_idx]
-    kb = [[Btn(s, callback_data=f"ansB|{s}") for s in SCALE]]
-    text = f"{stage_key}-{sess.curr_b_idx+1}/{total_in_stage}\n{q}"
-    await (update.callback_query.edit_message_text if update.callback_query else update.message.reply_text)(
-        text, reply_markup=Markup(kb)
-    )
-    return B
+    query = update.callback_query
+    if sess.content is None:
+        # Сессия из хранилища, а вопросы с тех пор поменялись — продолжить нельзя
+        await query.answer()
+        await query.edit_message_text("Вопросы теста обновились. Пожалуйста, начните заново.",
+                                      reply_markup=RESTART_MARKUP)
+        return ConversationHandler.END
+    questions = sess.content.questions
+    if query.data == "start_A":
+        if sess.pos:
+            return drop(update, ctx)
+        q: Question = questions[0]
+    else:
+        ans = parse_answer(query.data)
+        if ans is None or ans[0] != sess.epoch or ans[1] != sess.pos:
+            return drop(update, ctx)
+        q = questions[sess.pos]
+        if ans[2] not in q.values:
+            return drop(update, ctx)
+        sess.record(ans[2])
+        if q.next is None:
+            return await show_result(update, ctx)
+        q = questions[q.next]
+    edit = query.edit_message_text(q.text, reply_markup=q.markup(sess.epoch))
+    if isinstance(ctx.bot.rate_limiter, SendScheduler):
+        # Не ждём отправки: планировщик сохранит порядок в чате и при быстрых
+        # нажатиях отправит только последнюю правку
+        ctx.application.create_task(edit, update=update)
+    else:
+        await edit
+    return q.state
 
-async def start_c(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    sess: Session = ctx.user_data["sess"]
-    sess.c_idx = 0
-    return await ask_c(update, ctx)
 
-async def ask_c(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    sess: Session = ctx.user_data["sess"]
-    if update.callback_query and update.callback_query.data.startswith("ansC"):
-        _, v = update.callback_query.data.split("|")
-        sess.answers["C"].append(1 if v == "True" else 0)
-        sess.c_idx += 1
-    if sess.c_idx >= len(BLOCK_C):
-        return await show_result(update, ctx)
-    q = BLOCK_C[sess.c_idx]
-    kb = [[Btn("True", callback_data="ansC|True"), Btn("False", callback_data="ansC|False")]]
-    text = f"C{sess.c_idx+1}/{len(BLOCK_C)}\n{q}"
-    await (update.callback_query.edit_message_text if update.callback_query else update.message.reply_text)(
-        text, reply_markup=Markup(kb)
-    )
-    return C
+async def send_parts(update: Update, parts: List[str], reply_markup) -> None:
+    """HTML по частям: первая заменяет сообщение с кнопкой (или отвечает на текст),
+    остальные — новыми сообщениями; кнопки — под последней частью."""
+    for i, text in enumerate(parts):
+        markup = reply_markup if i == len(parts) - 1 else None
+        if i == 0 and update.callback_query:
+            await update.callback_query.edit_message_text(text, parse_mode="HTML", reply_markup=markup)
+        else:
+            await update.effective_message.reply_text(text, parse_mode="HTML", reply_markup=markup)
+
 
+@timed("show_result")
 async def show_result(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     sess: Session = ctx.user_data["sess"]
-    res = sess.compute()
-    stage = str(res["stage"])
+    tenant = tenant_of(ctx.bot_data)
+    res = sess.compute(tenant.engine)
+    stage = res["stage"]
+
+    store: Optional[ResultStore] = ctx.bot_data.get("results")
+    if store is not None:
+        store.append(sess.scale[:len(BLOCK_A)], list(res["sums"].values()), sess.c_bits,
+                     res["stage"], res["distortion"])
     
     # Для определения уровня (low/medium/high) используется балл того блока, который соответствует определённому этапу.
     # Для этапа 0 балл не имеет значения, т.к. там только один уровень.
-    stage_score = res["sums"].get(f"B{stage}", 0) if stage != "0" else 0
+    stage_score = res["sums"].get(f"B{stage}", 0) if stage else 0
+    # Диапазоны уровней проверены при загрузке (content.py) — уровень есть для любого балла
+    _, level, _ = sess.content.level(stage, stage_score)
+
+    # Текст собран заранее для (этап, уровень, предупреждение); подставляются только суммы и искажение
+    locale = pick_locale(update.effective_user.language_code, tenant.locale)
+    parts = result_templates(sess.content, locale).render(stage, level, res["sums"], res["distortion"],
+                                                          res["warning"])
+    await send_parts(update, parts, RESULT_MARKUP)
+    return RESULT
 
-    stage_data = INTERPRETATIONS.get(stage)
-    if not stage_data:
-        await (update.callback_query.edit_message_text if update.callback_query else update.message.reply_text)(
-            "Не удалось найти интерпретацию для вашего этапа. Пожалуйста, свяжитесь с администратором."
-        )
-        return ConversationHandler.END
 
-    level_data = get_level_interpretation(stage_data, stage_score)
-    if not level_data:
-        await (update.callback_query.edit_message_text if update.callback_query else update.message.reply_text)(
-            "Не удалось определить ваш уровень внутри этапа. Пожалуйста, свяжитесь с администратором."
-        )
-        return ConversationHandler.END
+async def stats(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    """/stats [дней] — сводка по всем результатам (только для администратора)."""
+    store: ResultStore = ctx.bot_data["results"]
+    t0 = time.perf_counter()
+    if ctx.args and ctx.args[0].isdigit():
+        days = int(ctx.args[0])
+        since, title = time.time() - days * 86400, f"Результаты за {days} дн."
+    else:
+        since, title = None, "Все результаты"
+    warning = tenant_of(ctx.bot_data).engine.rules.warning
+    if isinstance(store, RemoteResults):
+        summary = await store.summary(since, warning=warning)  # файл результатов — в процессе‑диспетчере
+    elif since is not None:  # проход по хвосту файла — в потоке, цикл тем временем обслуживает других
+        summary = await asyncio.to_thread(store.summary, since, warning=warning)
+    else:
+        summary = store.summary(since, warning=warning)
+    text = format_stats(summary, title, time.perf_counter() - t0)
+    await update.message.reply_text(text, parse_mode="HTML")
 
-    # --- Формирование сообщения с результатами ---
-    msg = []
-    msg.append(f"<b>Ваш основной этап: {stage_data['title']}</b>")
-    if level_data.get('title'):  # У Этапа 0 может не быть заголовка уровня
-        msg.append(f"<b>Уровень освоения: {level_data['title']}</b>")
-    msg.append("")
-    msg.append(f"<i>{level_data['description']}</i>")
-
-    if level_data.get('recommendations'):
-        msg.append("")
-        msg.append("<b>Рекомендации для практики:</b>")
-        for rec in level_data['recommendations']:
-            msg.append(f"• {rec}")
-
-    msg.append("\n" + ("─" * 20))
-    msg.append("\n<b>Детальные результаты:</b>")
-    
-    sums_text = []
-    for k, v in res["sums"].items():
-        sums_text.append(f"{k}: {v}")
-    msg.append("Суммы баллов по блокам: " + f"<code>{', '.join(sums_text)}</code>")
-    msg.append(f"Коэффициент искажения: {res['distortion']}")
-
-    if res["distortion"] >= 4:
-        msg.append("\n⚠️ <i>Вы отметили много «идеальных» ответов. Для точности результата рекомендуется повторить тест позже, отвечая более искренне.</i>")
-
-    msg.append("\n\nЧтобы помочь в исследовании, вы можете пройти короткое анонимное интервью из 10 вопросов.")
-
-    # Отправляем сообщение
-    # Используем HTML для форматирования
-    await (update.callback_query.edit_message_text if update.callback_query else update.message.reply_text)(
-        "\n".join(msg),
-        parse_mode="HTML",
-        reply_markup=Markup([[Btn("➕ Пройти интервью (Блок D)", callback_data="startD"), Btn("Завершить", callback_data="done")]])
-    )
-    return RESULT
+
+async def perf(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    """/perf — задержки и ошибки; /perf profile [сек] — сэмплирующий профайлер цикла."""
+    if not (ctx.args and ctx.args[0] == "profile"):
+        await update.message.reply_text(perf_report(), parse_mode="HTML")
+        return
+    if ctx.bot_data.get("profiler") is not None:
+        await update.message.reply_text("Профайлер уже запущен.")
+        return
+    seconds = min(int(ctx.args[1]), 300) if len(ctx.args) > 1 and ctx.args[1].isdigit() else 10
+    profiler = ctx.bot_data["profiler"] = SamplingProfiler()
+    profiler.start()
+    await update.message.reply_text(f"Профайлер запущен на {seconds} с.")
+
+    async def finish():
+        await asyncio.sleep(seconds)
+        profiler.stop()
+        ctx.bot_data.pop("profiler", None)
+        await update.message.reply_text(f"<pre>{escape(profiler.report())}</pre>", parse_mode="HTML")
+
+    ctx.application.create_task(finish(), update=update)
 
 
 async def start_d(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     sess: Session = ctx.user_data["sess"]
-    sess.d_idx = 0
+    if sess.d_answers is not None:
+        sess.d_answers.remove()
+    sess.d_answers = tenant_of(ctx.bot_data).answers.new(update.effective_user.id)
     await update.callback_query.edit_message_text("Блок D: отвечайте текстом. В любое время можно написать `/stop`.")
-    await update.callback_query.message.reply_text(f"D{sess.d_idx+1}/10\n{BLOCK_D[sess.d_idx]}")
+    await update.callback_query.message.reply_text(f"D1/{len(BLOCK_D)}\n{BLOCK_D[0]}")
     return D
 
 async def d_handler(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     sess: Session = ctx.user_data["sess"]
-    sess.d_answers.append(update.message.text.strip())
-    sess.d_idx += 1
-    
-    if sess.d_idx >= len(BLOCK_D):
+    tenant = tenant_of(ctx.bot_data)
+    cut, kept = tenant.answers.add(sess.d_answers, update.message.text.strip())
+    d_idx = len(sess.d_answers)
+    note = ""
+    if cut:
+        note = (f"(Ответ сохранён не полностью: первые {kept} символов.)\n\n" if kept
+                else "(Достигнут предел длины интервью: ответ не сохранён.)\n\n")
+
+    if d_idx >= len(BLOCK_D):
         await update.message.reply_text("Спасибо! Вы завершили интервью.")
 
-        if CHAT_ID_ADMIN:
-            try:
-                await ctx.bot.send_message(CHAT_ID_ADMIN, f"#Etap7D ответы D от {update.effective_user.id}:\n" + json.dumps(sess.d_answers, ensure_ascii=False, indent=2))
-            except BadRequest:
-                log.error(f"Could not send message to CHAT_ID_ADMIN {CHAT_ID_ADMIN}. "
-                          f"The chat was not found. Please ensure the admin has started the bot.")
-
+        digest: Optional[AdminDigest] = ctx.bot_data.get("admin_digest")
+        if digest is not None:
+            # только запись в спул (ответы читаются из файла интервью) — отправит фоновая сводка
+            digest.submit({"user_id": update.effective_user.id,
+                           "ts": dt.datetime.now().isoformat(timespec="seconds"),
+                           "answers": sess.d_answers})
+
+        renderer: Optional[ReportRenderer] = ctx.bot_data.get("report_renderer")
+        data = report_data(sess, tenant.engine) if renderer is not None else None
+        if data is not None:
+            # PDF рисуется вне цикла и придёт отдельным сообщением
+            ctx.application.create_task(send_report(ctx.bot, update.effective_chat.id, renderer, data),
+                                        update=update)
+        else:
+            sess.d_answers.remove()
+
+        if cut:
+            await update.message.reply_text(note.strip())
         return await end_conv(update, ctx)
         
-    await update.message.reply_text(f"D{sess.d_idx+1}/{len(BLOCK_D)}\n{BLOCK_D[sess.d_idx]}")
+    await update.message.reply_text(f"{note}D{d_idx+1}/{len(BLOCK_D)}\n{BLOCK_D[d_idx]}")
     return D
 
 async def end_conv(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     text = "Тест завершён. Благодарю за искренность."
-    
-    keyboard = [
-        [Btn("Пройти тест еще раз", callback_data="restart")],
-        [Btn("Записаться на консультацию", url="http://t.me/mtgates")],
-        [Btn("Подписаться на канал", url="http://t.me/wakeupspirit")]
-    ]
-    markup = Markup(keyboard)
+    markup = FINAL_MARKUP
 
     # Если пользователь нажал кнопку (например, "Завершить"), 
     # мы отвечаем на колбэк, убираем старые кнопки и отправляем НОВОЕ сообщение.
@@ -368,53 +537,376 @@ async def end_conv(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 async def cancel(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    sess: Optional[Session] = ctx.user_data.get("sess")
+    if sess is not None and sess.d_answers is not None:
+        sess.d_answers.remove()  # прерванное интервью никуда не уйдёт — файл не нужен
+        sess.d_answers = None
     text = "Диагностика прервана."
-    
-    keyboard = [
-        [Btn("Пройти тест еще раз", callback_data="restart")],
-        [Btn("Записаться на консультацию", url="http://t.me/mtgates")],
-        [Btn("Подписаться на канал", url="http://t.me/wakeupspirit")]
-    ]
-        
-    markup = Markup(keyboard)
-    
-    await update.effective_message.reply_text(text, reply_markup=markup)
+    await update.effective_message.reply_text(text, reply_markup=FINAL_MARKUP)
     return ConversationHandler.END
 
-def get_level_interpretation(stage_data, score):
-    """Определяет уровень (low, medium, high) по баллам."""
-    for level_key, level_info in stage_data["levels"].items():
-        min_score, max_score = level_info["range"]
-        if min_score <= score <= max_score:
-            return level_info
-    return None
+async def expired(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    """Кнопка теста, сессии которого нет ни в памяти, ни на диске (см. sessions.py)."""
+    query = update.callback_query
+    await query.answer()
+    await query.edit_message_text("Сессия устарела. Пожалуйста, начните тест заново.",
+                                  reply_markup=RESTART_MARKUP)
+
+def report_data(sess: Session, engine: Optional[ScoringEngine] = None) -> Optional[Dict[str, Any]]:
+    """Данные для PDF‑сводки (report.render_report) или None, если версии вопросов сессии уже нет."""
+    if sess.content is None:
+        return None
+    res = sess.compute(engine)
+    stage = res["stage"]
+    stage_score = res["sums"].get(f"B{stage}", 0) if stage else 0
+    stage_data, level, level_data = sess.content.level(stage, stage_score)
+    # Текст интерпретации едет вместе с отчётом: воркеры пула не знают о смене версий
+    text = {"stage_title": stage_data["title"], "title": level_data.get("title"),
+            "description": level_data["description"],
+            "recommendations": level_data.get("recommendations", [])}
+    return {"date": dt.date.today().strftime("%d.%m.%Y"), "version": sess.content.version,
+            "stage": str(stage), "level": level, "interpretation": text,
+            "sums": res["sums"], "distortion": res["distortion"], "warning": res["warning"],
+            "d_answers": sess.d_answers}  # PDF‑воркер читает ответы из файла интервью сам
+
+async def send_report(bot, chat_id: int, renderer: ReportRenderer, data: Dict[str, Any]) -> None:
+    """Рисует PDF в пуле процессов и отправляет его документом."""
+    try:
+        try:
+            pdf = await renderer.render(data)
+        finally:
+            # сводка и PDF собраны — файл интервью больше не нужен
+            if isinstance(data.get("d_answers"), SpooledAnswers):
+                data["d_answers"].remove()
+        await bot.send_document(chat_id, document=pdf, filename="etap7d.pdf",
+                                caption="PDF‑сводка вашего результата")
+    except Exception:
+        log.exception("Could not send PDF report to %s", chat_id)
 
 # ────────────────────────────────────────────────────────────────────────────
 #  MAIN
 # ────────────────────────────────────────────────────────────────────────────
 
-def main():
-    app = Application.builder().token(TOKEN).build()
+def build_app(builder: Optional[ApplicationBuilder] = None,
+              persistence: Optional[BasePersistence] = None,
+              concurrent_updates: int = 1,
+              rate_limiter: Optional[BaseRateLimiter] = None,
+              admin_digest: Optional[AdminDigest] = None,
+              report_renderer: Optional[ReportRenderer] = None,
+              results: Optional[ResultStore] = None,
+              metrics: bool = False,
+              metrics_server: Optional[MetricsServer] = None,
+              watch_content: bool = False,
+              sessions: Optional[SessionKeeper] = None,
+              tenant: Optional[Tenant] = None) -> Application:
+    """Собирает Application со всеми обработчиками диалога.
+
+    ``metrics`` оборачивает обработчики диалога замером времени (см. metrics.py),
+    ``watch_content`` подхватывает правки questions_b.json / interpretations.json на ходу,
+    ``sessions`` выгружает брошенные сессии на диск и возвращает их при следующем нажатии,
+    ``tenant`` — бот из TENANTS со своими вопросами, правилами и языком (см. tenants.py).
+    """
+    builder = builder or Application.builder().token(TOKEN)
+    builder = builder.post_init(_start_services).post_stop(_stop_services)
+    if persistence is not None:
+        builder = builder.persistence(persistence)
+    if rate_limiter is not None:
+        builder = builder.rate_limiter(rate_limiter)
+    if concurrent_updates > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(concurrent_updates))
+    app = builder.build()
+    if tenant is not None:
+        app.bot_data["tenant"] = tenant
+    tenant = tenant_of(app.bot_data)
+    if admin_digest is not None:
+        app.bot_data["admin_digest"] = admin_digest
+    if report_renderer is not None:
+        app.bot_data["report_renderer"] = report_renderer
+    if results is not None:
+        app.bot_data["results"] = results
+    if metrics:
+        app.bot_data["loop_monitor"] = LoopMonitor()
+    if metrics_server is not None:
+        app.bot_data["metrics_server"] = metrics_server
+    if watch_content:
+        app.bot_data["content"] = tenant.content
     conv = ConversationHandler(
         entry_points=[
             CommandHandler("start", start),
             CallbackQueryHandler(start, pattern="^restart$")
         ],
         states={
-            A: [CallbackQueryHandler(a_block, pattern="^(start_A|ansA).*" )],
-            B: [CallbackQueryHandler(ask_b, pattern="^ansB.*")],
-            C: [CallbackQueryHandler(ask_c, pattern="^ansC.*")],
+            A: [CallbackQueryHandler(ask, pattern=r"^(start_A|q\|)" )],
+            B: [CallbackQueryHandler(ask, pattern=r"^q\|")],
+            C: [CallbackQueryHandler(ask, pattern=r"^q\|")],
             RESULT: [CallbackQueryHandler(start_d, pattern="^startD$"), CallbackQueryHandler(end_conv, pattern="^done$")],
             D: [MessageHandler(filters.TEXT & ~filters.COMMAND, d_handler), CommandHandler("stop", cancel)],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         allow_reentry=True,
+        name="etap7d",
+        persistent=persistence is not None,
     )
+    if metrics:
+        _instrument(conv, tenant.name)
+    _wrap_handlers(conv, with_log_context)
+    if sessions is not None:
+        sessions.bind(app, conv)
+        app.bot_data["sessions"] = sessions
+        # Раньше диалога: выгруженная сессия должна вернуться до выбора обработчика
+        app.add_handler(TypeHandler(Update, sessions.rehydrate), group=-1)
     app.add_handler(conv)
+    if results is not None and tenant.admin_chat:
+        app.add_handler(CommandHandler("stats", stats, filters=filters.Chat(tenant.admin_chat)))
+    if metrics and tenant.admin_chat:
+        app.add_handler(CommandHandler("perf", perf, filters=filters.Chat(tenant.admin_chat)))
+    return app
+
+STATE_NAMES = {A: "A", B: "B", C: "C", RESULT: "RESULT", D: "D"}
+
+def _wrap_handlers(conv: ConversationHandler, wrap) -> None:
+    """Заменяет каждый обработчик диалога на ``wrap(callback, имя состояния)``."""
+    groups = [("entry", conv.entry_points), ("fallback", conv.fallbacks)]
+    groups += [(STATE_NAMES[state], handlers) for state, handlers in conv.states.items()]
+    for state, handlers in groups:
+        for handler in handlers:
+            handler.callback = wrap(handler.callback, state)
+
+# Диалоги по ботам для etap_active_sessions: "" — единственный бот, иначе имя из TENANTS
+_CONVERSATIONS: Dict[str, ConversationHandler] = {}
+
+def _instrument(conv: ConversationHandler, tenant: str = "") -> None:
+    """Замер времени и ошибок каждого обработчика диалога с меткой состояния."""
+    _wrap_handlers(conv, instrument)
+    _CONVERSATIONS[tenant] = conv
+    REGISTRY.gauge("etap_active_sessions", "Active conversations by state", _active_sessions)
+
+def _active_sessions() -> List[tuple]:
+    out = []
+    for tenant, conv in _CONVERSATIONS.items():
+        for state, n in Counter(conv._conversations.values()).items():  # только чтение
+            labels = {"state": STATE_NAMES.get(state, str(state))}
+            if tenant:
+                labels["tenant"] = tenant
+            out.append((labels, n))
+    return out
+
+# Службы, общие для всех ботов процесса: их запускает и останавливает main_tenants, а не каждый бот
+SHARED_SERVICES = ("report_renderer",)
+
+def _own(app: Application, key: str) -> bool:
+    return key in app.bot_data and key not in app.bot_data.get("shared", ())
+
+async def _start_services(app: Application) -> None:
+    # Каталог интервью у воркеров шарда общий: каждый убирает только файлы своих пользователей
+    tenant_of(app.bot_data).answers.sweep(shard=app.bot_data.get("shard"))
+    if _own(app, "admin_digest"):
+        await app.bot_data["admin_digest"].start(app.bot)
+    if _own(app, "report_renderer"):
+        await app.bot_data["report_renderer"].start()
+    if _own(app, "loop_monitor"):
+        app.bot_data["loop_monitor"].start()
+    if _own(app, "metrics_server"):
+        await app.bot_data["metrics_server"].start()
+    if _own(app, "content"):
+        app.bot_data["content"].start()
+    if _own(app, "sessions"):
+        app.bot_data["sessions"].start()
+
+async def _stop_services(app: Application) -> None:
+    if _own(app, "admin_digest"):
+        await app.bot_data["admin_digest"].stop()
+    if _own(app, "report_renderer"):
+        await app.bot_data["report_renderer"].stop()
+    if _own(app, "results"):
+        app.bot_data["results"].close()
+    if _own(app, "loop_monitor"):
+        app.bot_data["loop_monitor"].stop()
+    if _own(app, "metrics_server"):
+        await app.bot_data["metrics_server"].stop()
+    if _own(app, "content"):
+        app.bot_data["content"].stop()
+    if _own(app, "sessions"):
+        await app.bot_data["sessions"].stop()
+
+def _data_path(name: str, tenant: Optional[Tenant] = None) -> str:
+    """Файл данных рядом с ботом или в каталоге бота из TENANTS."""
+    return os.path.join(tenant.root if tenant else os.path.dirname(__file__), name)
+
+def make_persistence(shard: Optional[tuple] = None, tenant: Optional[Tenant] = None) -> Optional[SQLitePersistence]:
+    """SQLite‑хранилище сессий из config.json (или None, если отключено)."""
+    if not PERSISTENCE_DB:
+        return None
+    return SQLitePersistence(_data_path(PERSISTENCE_DB, tenant), update_interval=PERSISTENCE_INTERVAL, shard=shard)
+
+def session_content(user_data: Dict[str, Any]) -> Optional[Content]:
+    """Версия вопросов выгруженной сессии: SessionKeeper держит её, пока сессия на диске."""
+    sess = user_data.get("sess")
+    return sess.content if sess is not None else None
+
+def make_sessions(tenant: Optional[Tenant] = None, shard: Optional[tuple] = None) -> Optional[SessionKeeper]:
+    """Выгрузка брошенных сессий на диск (или None, если SESSION_SPILL_DB пуст)."""
+    if not SESSION_SPILL_DB:
+        return None
+    return SessionKeeper(_data_path(SESSION_SPILL_DB, tenant), SESSION_TTL, SESSION_MAX_RESIDENT,
+                         SESSION_SPILL_TTL, expired=expired, keep=session_content,
+                         tenant=tenant.name if tenant else "",
+                         shard=shard)
+
+def make_scheduler(shards: int = 1, tenant: Optional[Tenant] = None) -> SendScheduler:
+    """Планировщик исходящих запросов; сообщения администратору — низкий приоритет.
+
+    Общий бюджет бота делится между процессами‑воркерами поровну.
+    """
+    admin = tenant.admin_chat if tenant else CHAT_ID_ADMIN
+    return SendScheduler(RATE_LIMIT_GLOBAL / shards, RATE_LIMIT_CHAT, RATE_LIMIT_CHAT_BURST,
+                         bulk_chats={admin} if admin else (), tenant=tenant.name if tenant else "")
+
+def make_digest(tenant: Optional[Tenant] = None) -> Optional[AdminDigest]:
+    """Сводки ответов D для администратора (или None без CHAT_ID_ADMIN)."""
+    admin = tenant.admin_chat if tenant else CHAT_ID_ADMIN
+    if not admin:
+        return None
+    return AdminDigest(admin, _data_path(ADMIN_SPOOL, tenant), ADMIN_DIGEST_INTERVAL, ADMIN_DIGEST_MAX_ENTRIES)
+
+def make_renderer() -> Optional[ReportRenderer]:
+    """Пул процессов для PDF‑сводок (или None, если REPORT_WORKERS = 0)."""
+    if not REPORT_WORKERS:
+        return None
+    try:
+        return ReportRenderer(BLOCK_D, REPORT_FONT, REPORT_WORKERS)
+    except ReportError as exc:
+        log.error("PDF reports disabled: %s", exc)
+        return None
+
+def make_results(tenant: Optional[Tenant] = None) -> Optional[ResultStore]:
+    """Файл результатов для /stats (или None, если RESULTS_DB пуст)."""
+    if not RESULTS_DB:
+        return None
+    return ResultStore(_data_path(RESULTS_DB, tenant))
+
+def make_metrics_server(offset: int = 0) -> Optional[MetricsServer]:
+    """Эндпоинт /metrics для Prometheus (или None, если METRICS_PORT = 0).
+
+    ``offset`` — сдвиг порта: воркер шарда N отдаёт свои метрики на METRICS_PORT + 1 + N.
+    """
+    if not METRICS_PORT:
+        return None
+    return MetricsServer(METRICS_HOST, METRICS_PORT + offset)
+
+def make_shard_app(index: int, shards: int, digest: Optional[AdminDigest],
+                   results: Optional[ResultStore]) -> Application:
+    """Application процесса‑воркера: свои пользователи, общие службы — через диспетчер (None, если их нет)."""
+    load_shared()
+    app = build_app(persistence=make_persistence(shard=(index, shards)),
+                    concurrent_updates=CONCURRENT_UPDATES, rate_limiter=make_scheduler(shards),
+                    admin_digest=digest, report_renderer=make_renderer(), results=results,
+                    metrics=True, metrics_server=make_metrics_server(1 + index),
+                    watch_content=True, sessions=make_sessions(shard=(index, shards)))
+    app.bot_data["shard"] = (index, shards)
+    return app
+
+_ENGINES: Dict[str, ScoringEngine] = {}  # путь к правилам → движок, общий для ботов с одними правилами
+
+def load_tenant(spec: Dict[str, Any]) -> Tenant:
+    """Бот из записи TENANTS: свои вопросы B, интерпретации, правила, язык и администратор."""
+    here = os.path.dirname(__file__)
+    name = spec["NAME"]
+    if not name or "/" in name:
+        raise ValueError(f"invalid tenant name {name!r}")
+    rules = os.path.abspath(os.path.join(here, spec.get("RULESET_FILE", RULESET_FILE)))
+    engine = _ENGINES.get(rules)
+    if engine is None:
+        engine = _ENGINES[rules] = ScoringEngine(Ruleset.load(rules))
+    content = ContentStore(os.path.join(here, spec.get("QUESTIONS_B", "questions_b.json")),
+                           os.path.join(here, spec.get("INTERPRETATIONS", "interpretations.json")),
+                           BLOCK_A, BLOCK_C, states=(A, B, C), interval=CONTENT_WATCH_INTERVAL,
+                           on_load=content_loader(engine.rules))
+    locale = spec.get("LOCALE", LOCALE)
+    if locale not in LOCALES:
+        raise ValueError(f"unknown LOCALE {locale!r}")
+    root = os.path.join(here, TENANTS_DIR, name)
+    os.makedirs(root, exist_ok=True)
+    answers = InterviewSpool(os.path.join(root, D_SPOOL_DIR), D_ANSWER_MAX_CHARS, D_SESSION_MAX_CHARS,
+                             ttl=SESSION_SPILL_TTL)
+    admin = int(spec.get("CHAT_ID_ADMIN", CHAT_ID_ADMIN or 0)) or None
+    return Tenant(name, spec["BOT_TOKEN"], content, engine, answers, locale, admin, root)
+
+def make_tenant_app(tenant: Tenant, builder: ApplicationBuilder, share: FairShare,
+                    renderer: Optional[ReportRenderer] = None) -> Application:
+    """Application бота из TENANTS: свои файлы в ``tenant.root``; HTTP‑клиент (в ``builder``),
+    очередь апдейтов ``share`` и пул PDF — общие для всех ботов процесса."""
+    builder = builder.concurrent_updates(TenantUpdateProcessor(share, tenant.name))
+    app = build_app(builder, persistence=make_persistence(tenant=tenant),
+                    rate_limiter=make_scheduler(tenant=tenant), admin_digest=make_digest(tenant),
+                    report_renderer=renderer, results=make_results(tenant),
+                    metrics=True, watch_content=True, sessions=make_sessions(tenant), tenant=tenant)
+    app.bot_data.pop("loop_monitor")  # цикл один — его замеряет main_tenants
+    app.bot_data["shared"] = SHARED_SERVICES
+    return app
+
+def main_tenants():
+    """Все боты из TENANTS в одном процессе (см. tenants.py)."""
+    try:
+        tenants = [load_tenant(spec) for spec in TENANTS]
+    except (KeyError, ValueError, OSError) as exc:  # ContentError и RulesetError — тоже ValueError
+        log.critical("FATAL: TENANTS: %s", exc)
+        raise SystemExit(f"Invalid TENANTS: {exc}")
+    if len({t.name for t in tenants}) != len(tenants):
+        raise SystemExit("TENANTS: names must be unique.")
+    # Один пул соединений на все боты; второй — для long polling, по соединению на бота
+    request = SharedRequest(HTTPXRequest(connection_pool_size=256))
+    updates = SharedRequest(HTTPXRequest(connection_pool_size=len(tenants)))
+    share = FairShare(CONCURRENT_UPDATES)
+    renderer, monitor, server = make_renderer(), LoopMonitor(), make_metrics_server()
+    apps = [(t, make_tenant_app(t, Application.builder().token(t.token).request(request)
+                                .get_updates_request(updates), share, renderer))
+            for t in tenants]
+
+    async def on_start() -> None:
+        monitor.start()
+        if renderer is not None:
+            await renderer.start()
+        if server is not None:
+            await server.start()
+
+    async def on_stop() -> None:
+        if server is not None:
+            await server.stop()
+        if renderer is not None:
+            await renderer.stop()
+        monitor.stop()
+
+    log.info("Bot started, %d tenants", len(tenants))
+    run_tenants(apps, WEBHOOK_URL or None, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET, on_start, on_stop)
+
+def main():
+    if TENANTS:
+        if SHARD_WORKERS > 1:
+            raise SystemExit("TENANTS cannot be combined with SHARD_WORKERS > 1.")
+        main_tenants()
+        return
+    if SHARD_WORKERS > 1:
+        if not WEBHOOK_URL:
+            raise SystemExit("SHARD_WORKERS > 1 requires WEBHOOK_URL.")
+        dispatcher = ShardDispatcher(make_shard_app, SHARD_WORKERS, digest=make_digest(),
+                                     results=make_results(), log_queue_size=LOG_QUEUE_SIZE)
+        log.info("Bot started, %d shard workers", SHARD_WORKERS)
+        run_sharded(dispatcher, TOKEN, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET,
+                    metrics_server=make_metrics_server())
+        return
+    app = build_app(persistence=make_persistence(), concurrent_updates=CONCURRENT_UPDATES,
+                    rate_limiter=make_scheduler(), admin_digest=make_digest(),
+                    report_renderer=make_renderer(), results=make_results(),
+                    metrics=True, metrics_server=make_metrics_server(),
+                    watch_content=True, sessions=make_sessions())
     log.info("Bot started")
-    app.run_polling()
+    if WEBHOOK_URL:
+        run_webhook(app, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET)
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
-    if not TOKEN or TOKEN == "PASTE_YOUR_BOT_TOKEN_HERE":
+    if not TENANTS and (not TOKEN or TOKEN == "PASTE_YOUR_BOT_TOKEN_HERE"):
         raise SystemExit("BOT_TOKEN is not defined in config.json. Please edit the file.")
     main()
@@ -0,0 +1,85 @@
+"""
+Минимальный асинхронный HTTP/1.1‑сервер на asyncio
+===================================================
+Нужен для webhook‑режима и служебных эндпоинтов без внешних зависимостей
+(tornado/aiohttp). Поддерживает keep‑alive и тела с Content-Length —
+этого достаточно для запросов Telegram и локальных клиентов.
+"""
+
+from __future__ import annotations
+import asyncio, logging
+from http import HTTPStatus
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+log = logging.getLogger("EtapBot.http")
+
+# (method, path, headers, body) → (status, content_type, payload)
+Handler = Callable[[str, str, Dict[str, str], bytes], Awaitable[Tuple[int, str, bytes]]]
+
+
+class HTTPListener:
+    """Принимает соединения и передаёт каждый запрос в ``handler``."""
+
+    def __init__(self, handler: Handler, host: str = "127.0.0.1", port: int = 8080,
+                 max_body: int = 1 << 20):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self._server: Optional[asyncio.base_events.Server] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]  # если был задан порт 0
+        log.info("HTTP listener on %s:%s", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target, version = line.decode("latin-1").split()
+                headers: Dict[str, str] = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                length = int(headers.get("content-length", 0))
+                if length > self.max_body:
+                    self._respond(writer, 413, "text/plain", b"", keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                try:
+                    status, ctype, payload = await self.handler(method, target, headers, body)
+                except Exception:
+                    log.exception("Error while handling %s %s", method, target)
+                    status, ctype, payload = 500, "text/plain", b""
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                self._respond(writer, status, ctype, payload, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def _respond(writer: asyncio.StreamWriter, status: int, ctype: str, payload: bytes,
+                 keep_alive: bool) -> None:
+        head = (
+            f"HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: {ctype}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + payload)
@@ -0,0 +1,135 @@
+"""
+Ответы Блока D на диске
+========================
+Свободные ответы интервью не копятся списком в памяти сессии: каждый ответ
+сразу дописывается в файл этой сессии (``<каталог>/<user_id>-<метка>.d``)
+кадром «длина + способ сжатия + данные», сжатым zlib, если так короче.
+В сессии остаётся ``SpooledAnswers`` — путь к файлу и смещения кадров
+(4 байта на ответ).
+
+``SpooledAnswers`` перебирается как список строк, читая файл по кадру:
+так сводка администратору и PDF (в процессе пула) собираются из файла, не
+поднимая все ответы в память. Кадр, записанный после последнего сохранения
+сессии (падение процесса), не учитывается — смещения в сессии главнее.
+
+``InterviewSpool`` выдаёт файлы новым интервью, режет ответы по лимитам
+(``answer_limit`` символов на ответ, ``session_limit`` на всё интервью) и
+удаляет файлы брошенных интервью старше ``ttl``.
+"""
+
+from __future__ import annotations
+import logging, os, secrets, struct, time, zlib
+from array import array
+from typing import Iterator, Optional, Tuple, Union
+
+from metrics import REGISTRY, Registry
+
+log = logging.getLogger("EtapBot.interview")
+
+_FRAME = struct.Struct("<IB")  # длина данных, способ: 0 — как есть, 1 — zlib
+_RAW, _ZLIB = 0, 1
+ELLIPSIS = "…"
+
+
+class SpooledAnswers:
+    """Ответы одного интервью: путь к файлу и смещения кадров."""
+
+    __slots__ = ("path", "offsets", "chars")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets = array("I")
+        self.chars = 0  # символов во всех ответах — для лимита на интервью
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def __iter__(self) -> Iterator[str]:
+        if not self.offsets:
+            return
+        with open(self.path, "rb") as f:
+            for offset in self.offsets:
+                f.seek(offset)
+                size, codec = _FRAME.unpack(f.read(_FRAME.size))
+                data = f.read(size)
+                yield (zlib.decompress(data) if codec == _ZLIB else data).decode()
+
+    def append(self, text: str) -> None:
+        raw = text.encode()
+        packed = zlib.compress(raw, 6)
+        codec, data = (_ZLIB, packed) if len(packed) < len(raw) else (_RAW, raw)
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            f.write(_FRAME.pack(len(data), codec) + data)
+        self.offsets.append(offset)
+        self.chars += len(text)
+
+    def remove(self) -> None:
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __getstate__(self):
+        return self.path, self.offsets.tobytes(), self.chars
+
+    def __setstate__(self, state) -> None:
+        self.path, offsets, self.chars = state
+        self.offsets = array("I")
+        self.offsets.frombytes(offsets)
+
+
+class InterviewSpool:
+    """Каталог файлов интервью и лимиты на ответы."""
+
+    def __init__(self, directory: str, answer_limit: int = 2000, session_limit: int = 16000,
+                 ttl: float = 30 * 86400, registry: Registry = REGISTRY):
+        self.directory = directory
+        self.answer_limit = answer_limit
+        self.session_limit = session_limit
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        self.truncated = registry.counter("etap_d_answers_truncated_total",
+                                          "Block D answers cut to the per-answer or per-interview limit")
+
+    def new(self, user_id: Union[int, str]) -> SpooledAnswers:
+        """Файл для нового интервью (создаётся с первым ответом)."""
+        return SpooledAnswers(os.path.join(self.directory, f"{user_id}-{secrets.token_hex(4)}.d"))
+
+    def add(self, answers: SpooledAnswers, text: str) -> Tuple[bool, int]:
+        """Записывает ответ с учётом лимитов: (был ли сокращён, сколько символов ответа сохранено)."""
+        room = min(self.answer_limit, max(self.session_limit - answers.chars, 0))
+        if len(text) <= room:
+            answers.append(text)
+            return False, len(text)
+        kept = max(room - len(ELLIPSIS), 0)
+        answers.append(text[:kept] + ELLIPSIS)
+        self.truncated.inc()
+        return True, kept
+
+    def sweep(self, now: Optional[float] = None, shard: Optional[Tuple[int, int]] = None) -> int:
+        """Удаляет файлы интервью, не менявшиеся дольше ``ttl``. Возвращает их число.
+
+        ``shard`` — (номер, число) процесса‑воркера (см. shard.py): каталог у воркеров
+        общий, и каждый трогает только файлы своих пользователей.
+        """
+        deadline = (now if now is not None else time.time()) - self.ttl
+        removed = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".d") or not _owns(entry.name, shard):
+                    continue
+                if entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+                    removed += 1
+        if removed:
+            log.info("Interview spool: removed %d abandoned interviews", removed)
+        return removed
+
+
+def _owns(name: str, shard: Optional[Tuple[int, int]]) -> bool:
+    """Файл ``<user_id>-<метка>.d`` принадлежит воркеру ``shard``."""
+    if shard is None:
+        return True
+    uid = name.rsplit("-", 1)[0]
+    return uid.lstrip("-").isdigit() and int(uid) % shard[1] == shard[0]
@@ -0,0 +1,200 @@
+"""
+Журнал без блокировки цикла asyncio
+====================================
+Обработчики и httpx пишут в лог из потока цикла; запись в файл и в консоль
+уходит в фоновый поток (``QueueListener``), а в потоке цикла остаётся
+только постановка записи в очередь.
+
+• ``BurstQueueHandler`` — очередь с защитой от всплесков: когда она
+  заполнена наполовину, DEBUG отбрасывается, а INFO пропускается выборочно
+  (каждая ``sample``‑я запись); когда заполнена целиком — отбрасывается всё
+  ниже ERROR. Ошибки не теряются никогда. Число отброшенных записей
+  попадает в метрику ``etap_log_dropped_total`` и в сам журнал.
+• ``RotatingLogFile`` — ротация по размеру и/или по времени, старые части
+  сжимаются gzip (в фоновом потоке).
+• ``JsonFormatter`` — одна запись = одна JSON‑строка с ``user_id`` и
+  состоянием диалога, в котором пришёл апдейт (см. ``with_log_context``).
+• ``forward_logging`` — в процессе‑воркере (shard.py): записи уходят в
+  очередь multiprocessing и пишутся в журнал родительского процесса.
+"""
+
+from __future__ import annotations
+import atexit, contextvars, copy, datetime as dt, functools, gzip, json, logging, os, queue, shutil, time
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+from metrics import REGISTRY
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
+
+# (user_id, состояние диалога) апдейта, который сейчас обрабатывается; наследуется задачами
+LOG_CONTEXT: contextvars.ContextVar[Tuple[Optional[int], Optional[str]]] = \
+    contextvars.ContextVar("log_context", default=(None, None))
+
+
+def with_log_context(callback: Callable[..., Awaitable[Any]], state: str) -> Callable[..., Awaitable[Any]]:
+    """Оборачивает обработчик диалога: записи лога внутри него получают user_id и состояние."""
+    @functools.wraps(callback)
+    async def wrapper(update, ctx):
+        user = update.effective_user
+        token = LOG_CONTEXT.set((user.id if user else None, state))
+        try:
+            return await callback(update, ctx)
+        finally:
+            LOG_CONTEXT.reset(token)
+
+    return wrapper
+
+
+class BurstQueueHandler(QueueHandler):
+    """Ставит записи в очередь фонового потока; при всплеске отбрасывает младшие уровни."""
+
+    def __init__(self, q: Any, capacity: int = 10_000, sample: int = 10):
+        super().__init__(q)
+        self.capacity = capacity
+        self.high = capacity // 2
+        self.sample = sample
+        self.dropped: Counter = Counter()  # уровень → сколько отброшено всего
+        self._unreported = 0
+        self._seen = 0
+
+    def _depth(self) -> int:
+        try:
+            return self.queue.qsize()
+        except NotImplementedError:  # multiprocessing.Queue на macOS
+            return 0
+
+    def emit(self, record: logging.LogRecord) -> None:
+        depth = self._depth()
+        level = record.levelno
+        if depth >= self.high and level < logging.ERROR:
+            self._seen += 1
+            if (depth >= self.capacity or level < logging.INFO
+                    or level == logging.INFO and self._seen % self.sample):
+                self._drop(record)
+                return
+        elif self._unreported:
+            self._report()
+        try:
+            self.enqueue(self.prepare(record))
+        except Exception:
+            self.handleError(record)
+
+    def _drop(self, record: logging.LogRecord) -> None:
+        self.dropped[record.levelname] += 1
+        self._unreported += 1
+        REGISTRY.counter("etap_log_dropped_total", "Log records dropped under burst",
+                         level=record.levelname).inc()
+
+    def _report(self) -> None:
+        n, self._unreported = self._unreported, 0
+        record = logging.LogRecord("EtapBot.log", logging.WARNING, __file__, 0,
+                                   "Log queue overflow: dropped %d records (total by level: %s)",
+                                   (n, dict(self.dropped)), None)
+        self.enqueue(self.prepare(record))
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Текст и traceback — здесь, пока аргументы ещё живы; форматирование — в фоне
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info:
+            record.exc_text = _EXC.formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        if not hasattr(record, "user_id"):  # запись из воркера уже с контекстом
+            record.user_id, record.state = LOG_CONTEXT.get()
+        return record
+
+
+_EXC = logging.Formatter()
+_EXTRA = ("user_id", "state", "worker")
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной JSON‑строкой."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        out = {"ts": dt.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+               "level": record.levelname, "logger": record.name, "msg": record.getMessage()}
+        for key in _EXTRA:
+            value = getattr(record, key, None)
+            if value is not None:
+                out[key] = value
+        if record.exc_info:
+            out["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False)
+
+
+class RotatingLogFile(RotatingFileHandler):
+    """Файл журнала с ротацией по размеру (``max_bytes``) и/или времени (``interval``, сек).
+
+    Части нумеруются как у RotatingFileHandler: bot.log.1 — самая свежая;
+    при ``compress`` они сжимаются: bot.log.1.gz.
+    """
+
+    def __init__(self, path: str, max_bytes: int = 0, interval: float = 0, backups: int = 7,
+                 compress: bool = False):
+        super().__init__(path, maxBytes=max_bytes, backupCount=max(backups, 1), encoding="utf-8", delay=True)
+        self.interval = interval
+        self._rollover_at = time.time() + interval
+        if compress:
+            self.namer = lambda name: name + ".gz"
+            self.rotator = _gzip_rotate
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.interval and time.time() >= self._rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self._rollover_at = time.time() + self.interval
+
+
+def _gzip_rotate(source: str, dest: str) -> None:
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def setup_logging(path: str, level: int = logging.INFO, max_bytes: int = 0, interval: float = 0,
+                  backups: int = 7, compress: bool = False, json_records: bool = False,
+                  queue_size: int = 10_000) -> QueueListener:
+    """Корневой логгер → очередь → файл и консоль в фоновом потоке. Возвращает запущенный listener."""
+    text = logging.Formatter(TEXT_FORMAT)
+    file_handler = RotatingLogFile(path, max_bytes, interval, backups, compress)
+    file_handler.setFormatter(JsonFormatter() if json_records else text)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(text)
+
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(BurstQueueHandler(q, queue_size))
+    root.setLevel(level)
+    listener = QueueListener(q, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # дописать очередь перед выходом
+    return listener
+
+
+def forward_logging(q: Any, level: int = logging.INFO, queue_size: int = 10_000, **tags: Any) -> None:
+    """Для дочернего процесса: корневой логгер → ``q`` (multiprocessing.Queue родителя).
+
+    ``tags`` добавляются в каждую запись (например, ``worker=2``).
+    """
+    handler = BurstQueueHandler(q, queue_size)
+
+    def tag(record: logging.LogRecord) -> bool:
+        record.__dict__.update(tags)
+        return True
+
+    handler.addFilter(tag)
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
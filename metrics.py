@@ -0,0 +1,313 @@
+"""
+Метрики и профилирование
+=========================
+Гистограммы задержек обработчиков по состояниям диалога и вызовов Bot API
+по методам, счётчики ошибок, датчики (активные сессии, очередь отправки,
+задержка цикла asyncio). Объекты метрик создаются один раз — на горячем пути
+остаются ``bisect`` и два сложения.
+
+``REGISTRY.expose()`` отдаёт всё в текстовом формате Prometheus
+(``MetricsServer`` — на локальном HTTP‑порту), ``perf_report`` — краткая
+сводка для команды ``/perf``. ``SamplingProfiler`` из отдельного потока
+снимает стек цикла asyncio и показывает, где он проводит время.
+"""
+
+from __future__ import annotations
+import asyncio, functools, logging, sys, threading, time
+from bisect import bisect_left
+from collections import Counter as _Tally
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from httplistener import HTTPListener
+
+log = logging.getLogger("EtapBot.metrics")
+
+# Границы корзин, сек (как у prometheus_client, с запасом вниз)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+           0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # последняя — +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля линейной интерполяцией внутри корзины (как histogram_quantile)."""
+        total = self.count
+        if not total:
+            return 0.0
+        rank, seen = q * total, 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lo = BUCKETS[i - 1] if i else 0.0
+                hi = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lo + (hi - lo) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class Registry:
+    """Именованные метрики с метками; ``histogram``/``counter`` возвращают один и тот же объект."""
+
+    def __init__(self):
+        self._help: Dict[str, Tuple[str, str]] = {}  # имя → (тип, описание)
+        self._metrics: Dict[Tuple[str, Labels], Any] = {}
+        self._gauges: Dict[str, Callable[[], Iterable[Tuple[Dict[str, str], float]]]] = {}
+
+    def _get(self, kind: str, cls: type, name: str, doc: str, labels: Dict[str, str]) -> Any:
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            self._help.setdefault(name, (kind, doc))
+            metric = self._metrics[key] = cls()
+        return metric
+
+    def histogram(self, name: str, doc: str = "", **labels: str) -> Histogram:
+        return self._get("histogram", Histogram, name, doc, labels)
+
+    def counter(self, name: str, doc: str = "", **labels: str) -> Counter:
+        return self._get("counter", Counter, name, doc, labels)
+
+    def gauge(self, name: str, doc: str, collect: Callable[[], Iterable[Tuple[Dict[str, str], float]]]) -> None:
+        """Датчик, значения которого снимаются функцией ``collect`` в момент запроса."""
+        self._help[name] = ("gauge", doc)
+        self._gauges[name] = collect
+
+    def read_gauge(self, name: str) -> List[Tuple[Dict[str, str], float]]:
+        """Текущие значения датчика; ошибка датчика пишется в журнал, а не роняет отчёт."""
+        try:
+            return list(self._gauges[name]())
+        except Exception:
+            log.exception("Gauge %s failed", name)
+            return []
+
+    def series(self, name: str) -> List[Tuple[Dict[str, str], Any]]:
+        return [(dict(labels), m) for (n, labels), m in self._metrics.items() if n == name]
+
+    def expose(self) -> str:
+        """Текстовый формат Prometheus 0.0.4."""
+        out: List[str] = []
+        for name, (kind, doc) in sorted(self._help.items()):
+            out += [f"# HELP {name} {doc}", f"# TYPE {name} {kind}"]
+            if kind == "gauge":
+                out += [f"{name}{_labels(l)} {v}" for l, v in self.read_gauge(name)]
+                continue
+            for labels, m in self.series(name):
+                if kind == "counter":
+                    out.append(f"{name}{_labels(labels)} {m.value}")
+                    continue
+                cum = 0
+                for bound, n in zip((*BUCKETS, "+Inf"), m.counts):
+                    cum += n
+                    out.append(f"{name}_bucket{_labels({**labels, 'le': str(bound)})} {cum}")
+                out += [f"{name}_sum{_labels(labels)} {m.sum}", f"{name}_count{_labels(labels)} {cum}"]
+        return "\n".join(out) + "\n"
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+REGISTRY = Registry()
+
+
+# ── обёртки ───────────────────────────────────────────────────────────────
+
+def instrument(callback: Callable[..., Awaitable[Any]], state: str,
+               registry: Registry = REGISTRY) -> Callable[..., Awaitable[Any]]:
+    """Оборачивает обработчик диалога: время, число вызовов и ошибки по состоянию."""
+    name = callback.__name__
+    hist = registry.histogram("etap_handler_seconds", "Handler latency by conversation state",
+                              handler=name, state=state)
+    errors = registry.counter("etap_handler_errors_total", "Exceptions raised by handlers",
+                              handler=name, state=state)
+
+    @functools.wraps(callback)
+    async def wrapper(update, ctx):
+        t0 = time.perf_counter()
+        try:
+            return await callback(update, ctx)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            hist.observe(time.perf_counter() - t0)
+
+    return wrapper
+
+
+def timed(section: str, registry: Registry = REGISTRY):
+    """Декоратор для отдельного участка (например, show_result внутри ask)."""
+    hist = registry.histogram("etap_section_seconds", "Latency of instrumented code sections", section=section)
+
+    def deco(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                hist.observe(time.perf_counter() - t0)
+        return wrapper
+    return deco
+
+
+# ── фоновые службы ────────────────────────────────────────────────────────
+
+class LoopMonitor:
+    """Раз в ``interval`` секунд меряет, насколько цикл asyncio опаздывает с пробуждением."""
+
+    def __init__(self, interval: float = 0.5, registry: Registry = REGISTRY):
+        self.interval = interval
+        self.hist = registry.histogram("etap_event_loop_lag_seconds", "Event loop wake-up delay")
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.hist.observe(max(time.perf_counter() - t0 - self.interval, 0.0))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+class MetricsServer:
+    """``GET /metrics`` на локальном порту для Prometheus."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 9108, registry: Registry = REGISTRY):
+        self.registry = registry
+        self.listener = HTTPListener(self._handle, host, port)
+
+    async def _handle(self, method: str, path: str, headers: Dict[str, str], body: bytes):
+        if method != "GET" or path.split("?")[0] != "/metrics":
+            return 404, "text/plain", b"not found"
+        return 200, "text/plain; version=0.0.4", self.registry.expose().encode()
+
+    async def start(self) -> None:
+        await self.listener.start()
+
+    async def stop(self) -> None:
+        await self.listener.stop()
+
+
+class SamplingProfiler:
+    """Из отдельного потока раз в ``interval`` секунд снимает стек потока цикла asyncio."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples = 0
+        self.own: _Tally = _Tally()        # функция на вершине стека
+        self.inclusive: _Tally = _Tally()  # функция где‑то в стеке
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        target = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(target,), name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, target: int) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.own[_where(frame)] += 1
+            seen = set()
+            while frame is not None:
+                where = _where(frame)
+                if where not in seen:
+                    seen.add(where)
+                    self.inclusive[where] += 1
+                frame = frame.f_back
+
+    def report(self, top: int = 12) -> str:
+        if not self.samples:
+            return "нет сэмплов"
+        lines = [f"{self.samples} сэмплов по {self.interval * 1e3:.0f} мс", "self:"]
+        lines += [f"{100 * n / self.samples:5.1f}% {w}" for w, n in self.own.most_common(top)]
+        lines.append("inclusive:")
+        lines += [f"{100 * n / self.samples:5.1f}% {w}" for w, n in self.inclusive.most_common(top)]
+        return "\n".join(lines)
+
+
+def _where(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})"
+
+
+# ── сводка для /perf ──────────────────────────────────────────────────────
+
+def perf_report(registry: Registry = REGISTRY) -> str:
+    """Короткая таблица: вызовы и p50/p95/p99 по обработчикам и методам API, ошибки, датчики."""
+    lines: List[str] = []
+
+    def table(title: str, name: str, keys: Tuple[str, ...]) -> None:
+        rows = [(l, h) for l, h in registry.series(name) if h.count]
+        if not rows:
+            return
+        lines.append(f"<b>{title}</b> (n, p50/p95/p99 мс)")
+        for labels, h in sorted(rows, key=lambda r: -r[1].count):
+            label = " ".join(labels[k] for k in keys if k in labels)
+            q = "/".join(f"{h.quantile(p) * 1e3:.1f}" for p in (0.5, 0.95, 0.99))
+            lines.append(f"<code>{label:<18} {h.count:>7} {q}</code>")
+        lines.append("")
+
+    table("Обработчики", "etap_handler_seconds", ("state", "handler"))
+    table("Участки", "etap_section_seconds", ("section",))
+    table("Bot API", "etap_api_seconds", ("endpoint",))
+    table("Цикл asyncio", "etap_event_loop_lag_seconds", ())
+
+    errors = [(l, c.value) for name in ("etap_handler_errors_total", "etap_api_errors_total")
+              for l, c in registry.series(name) if c.value]
+    if errors:
+        lines.append("<b>Ошибки</b>")
+        lines += [f"<code>{' '.join(l.values())}: {v}</code>" for l, v in errors]
+        lines.append("")
+    for name, (kind, doc) in sorted(registry._help.items()):
+        if kind == "gauge":
+            values = ", ".join(f"{' '.join(l.values()) or 'всего'}={v:g}" for l, v in registry.read_gauge(name))
+            lines.append(f"{doc}: {values or '0'}")
+    return "\n".join(lines).strip() or "Метрик пока нет."
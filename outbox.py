@@ -0,0 +1,301 @@
+"""
+Планировщик исходящих запросов к Bot API
+=========================================
+``SendScheduler`` подключается к PTB как ``rate_limiter`` и пропускает через
+себя все отправки/правки сообщений:
+
+• глобальный бюджет (по умолчанию 30 запросов/с) и бюджет на чат
+  (token bucket), порядок запросов в одном чате сохраняется;
+• интерактивные правки пользователям идут раньше служебного трафика
+  (чаты из ``bulk_chats``, например CHAT_ID_ADMIN);
+• если правка сообщения ещё ждёт очереди, а пришла новая правка того же
+  сообщения, отправляется только последняя — ждавшие получают её результат;
+• на ``RetryAfter`` (HTTP 429) чат ставится на паузу и запрос повторяется
+  с экспоненциальной задержкой;
+• ``stats()`` — глубина очереди, время ожидания, повторы, склейки;
+  время каждого вызова Bot API и ошибки пишутся в ``metrics.REGISTRY``.
+"""
+
+from __future__ import annotations
+import asyncio, heapq, itertools, logging, time, weakref
+from collections import Counter, deque
+from typing import Any, Callable, Collection, Deque, Dict, List, Optional, Tuple
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import REGISTRY, Histogram
+
+log = logging.getLogger("EtapBot.outbox")
+
+INTERACTIVE, BULK = 0, 1
+
+# Эти методы не расходуют лимиты на сообщения
+_UNLIMITED = frozenset({
+    "getMe", "getUpdates", "setWebhook", "deleteWebhook", "getWebhookInfo",
+    "answerCallbackQuery", "close", "logOut",
+})
+# Long polling: время ответа — это таймаут ожидания, а не задержка Telegram
+_UNTIMED = frozenset({"getUpdates"})
+# Правки, которые можно склеить: новая полностью заменяет старую
+_COALESCE = frozenset({"editMessageText"})
+
+# Все планировщики процесса (по одному на бота, см. tenants.py) — для etap_send_queue_depth
+_SCHEDULERS: "weakref.WeakSet[SendScheduler]" = weakref.WeakSet()
+
+
+def _queue_depth() -> List[Tuple[Dict[str, str], int]]:
+    depth: Counter = Counter()
+    for sched in list(_SCHEDULERS):
+        for priority, name in ((INTERACTIVE, "interactive"), (BULK, "bulk")):
+            depth[sched.tenant, name] += sched.depth[priority]
+    return [({"priority": name, **({"tenant": tenant} if tenant else {})}, n)
+            for (tenant, name), n in depth.items()]
+
+
+class _Bucket:
+    """Token bucket: ``rate`` токенов в секунду, не больше ``burst`` про запас."""
+    __slots__ = ("rate", "burst", "tokens", "stamp", "paused_until")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до свободного токена (0 — можно слать сейчас)."""
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        wait = self.paused_until - now
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return max(wait, 0.0)
+
+    def idle(self, now: float) -> bool:
+        return self.tokens + (now - self.stamp) * self.rate >= self.burst and now >= self.paused_until
+
+
+class _Chat:
+    __slots__ = ("lock", "bucket", "pending")
+
+    def __init__(self, rate: float, burst: float):
+        self.lock = asyncio.Lock()  # FIFO: запросы в чат уходят в порядке поступления
+        self.bucket = _Bucket(rate, burst)
+        self.pending = 0
+
+
+class _Job:
+    __slots__ = ("superseded", "done", "result", "error")
+
+    def __init__(self):
+        self.superseded: Optional[_Job] = None  # более новая правка того же сообщения
+        self.done = asyncio.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+    async def outcome(self) -> Any:
+        await self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SendScheduler(BaseRateLimiter):
+    """Rate limiter с приоритетами, склейкой правок и повтором при 429."""
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 5,
+                 bulk_chats: Collection[Any] = (), max_retries: int = 5, backoff: float = 1.0,
+                 tenant: str = ""):
+        self.tenant = tenant  # метка в метриках, если ботов в процессе несколько
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.bulk_chats = frozenset(bulk_chats)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # Глобально — ровный темп без запаса: Telegram считает лимит в скользящем окне 1 с
+        self._global = _Bucket(global_rate, 1)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []  # (приоритет, номер, future)
+        self._seq = itertools.count()
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._chats: Dict[Any, _Chat] = {}
+        self._edits: Dict[Tuple[Any, Any], _Job] = {}  # правки, ещё не ушедшие в сеть
+        self._calls = 0
+        # метрики
+        self.depth = [0, 0]  # по приоритетам
+        self.sent = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.failed = 0
+        self._waits: Tuple[Deque[float], Deque[float]] = (deque(maxlen=2048), deque(maxlen=2048))
+        self._api: Dict[str, Histogram] = {}
+        self._wait_hist = tuple(REGISTRY.histogram("etap_send_wait_seconds", "Time spent queued in SendScheduler",
+                                                   priority=p) for p in ("interactive", "bulk"))
+        _SCHEDULERS.add(self)
+        REGISTRY.gauge("etap_send_queue_depth", "Requests waiting in SendScheduler", _queue_depth)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    async def process_request(self, callback: Callable[..., Any], args: Any, kwargs: Dict[str, Any],
+                              endpoint: str, data: Dict[str, Any], rate_limit_args: Optional[int]) -> Any:
+        chat_id = data.get("chat_id")
+        if endpoint in _UNLIMITED or chat_id is None:
+            if endpoint in _UNTIMED:
+                return await callback(*args, **kwargs)
+            return await self._timed(endpoint, callback, args, kwargs)
+
+        priority = rate_limit_args if rate_limit_args is not None else (
+            BULK if chat_id in self.bulk_chats else INTERACTIVE)
+        job = _Job()
+        key = None
+        if endpoint in _COALESCE and data.get("message_id"):
+            key = (chat_id, data["message_id"])
+            older = self._edits.get(key)
+            if older is not None:
+                older.superseded = job
+                self.coalesced += 1
+            self._edits[key] = job
+
+        chat = self._chat(chat_id)
+        chat.pending += 1
+        self.depth[priority] += 1
+        queued, in_queue = time.monotonic(), True
+        try:
+            async with chat.lock:
+                if job.superseded is None:
+                    await self._take(chat, priority)
+                    if job.superseded is not None:  # обогнали, пока ждали токен, — вернём его
+                        chat.bucket.tokens += 1
+                        self._global.tokens += 1
+                if job.superseded is None:
+                    if key is not None and self._edits.get(key) is job:
+                        del self._edits[key]
+                    self.depth[priority] -= 1
+                    in_queue = False
+                    waited = time.monotonic() - queued
+                    self._waits[priority].append(waited)
+                    self._wait_hist[priority].observe(waited)
+                    job.result = await self._send(endpoint, callback, args, kwargs, chat, priority)
+                    self.sent += 1
+                    return job.result
+            # Правку обогнала более новая — вернём её результат
+            self.depth[priority] -= 1
+            in_queue = False
+            job.result = await job.superseded.outcome()
+            return job.result
+        except BaseException as exc:
+            job.error = exc
+            raise
+        finally:
+            if in_queue:
+                self.depth[priority] -= 1
+            if key is not None and self._edits.get(key) is job:
+                del self._edits[key]
+            job.done.set()
+            chat.pending -= 1
+            self._calls += 1
+            if not self._calls % 1024:
+                self._sweep()
+
+    # ── внутреннее ────────────────────────────────────────────────────────
+
+    def _chat(self, chat_id: Any) -> _Chat:
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(self.chat_rate, self.chat_burst)
+        return chat
+
+    def _sweep(self) -> None:
+        now = time.monotonic()
+        for chat_id in [c for c, chat in self._chats.items() if not chat.pending and chat.bucket.idle(now)]:
+            del self._chats[chat_id]
+
+    async def _take(self, chat: _Chat, priority: int) -> None:
+        while True:
+            wait = chat.bucket.delay(time.monotonic())
+            if not wait:
+                break
+            await asyncio.sleep(wait)
+        chat.bucket.tokens -= 1
+        await self._acquire_global(priority)
+
+    async def _acquire_global(self, priority: int) -> None:
+        if not self._waiters and not self._global.delay(time.monotonic()):
+            self._global.tokens -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        await fut
+
+    async def _dispatch(self) -> None:
+        # Раздаёт глобальные токены ожидающим: сначала INTERACTIVE, внутри приоритета — FIFO
+        while self._waiters:
+            wait = self._global.delay(time.monotonic())
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                self._global.tokens -= 1
+                fut.set_result(None)
+
+    async def _timed(self, endpoint: str, callback: Callable[..., Any], args: Any,
+                     kwargs: Dict[str, Any]) -> Any:
+        hist = self._api.get(endpoint)
+        if hist is None:
+            hist = self._api[endpoint] = REGISTRY.histogram(
+                "etap_api_seconds", "Bot API call latency by method", endpoint=endpoint)
+        t0 = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception as exc:
+            REGISTRY.counter("etap_api_errors_total", "Failed Bot API calls",
+                             endpoint=endpoint, error=type(exc).__name__).inc()
+            raise
+        finally:
+            hist.observe(time.perf_counter() - t0)
+
+    async def _send(self, endpoint: str, callback: Callable[..., Any], args: Any, kwargs: Dict[str, Any],
+                    chat: _Chat, priority: int) -> Any:
+        for attempt in itertools.count():
+            try:
+                return await self._timed(endpoint, callback, args, kwargs)
+            except RetryAfter as exc:
+                if attempt >= self.max_retries:
+                    self.failed += 1
+                    raise
+                self.retries += 1
+                delay = max(float(exc.retry_after), self.backoff * 2 ** attempt)
+                log.warning("Flood control: retry in %.1fs (attempt %d)", delay, attempt + 1)
+                chat.bucket.paused_until = time.monotonic() + delay
+                await asyncio.sleep(delay)
+                await self._acquire_global(priority)
+            except Exception:
+                self.failed += 1
+                raise
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики очереди; времена ожидания — по последним 2048 запросам каждого приоритета."""
+        out: Dict[str, Any] = {
+            "queue_depth": sum(self.depth),
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "retries": self.retries,
+            "failed": self.failed,
+        }
+        for name, prio in (("interactive", INTERACTIVE), ("bulk", BULK)):
+            waits = sorted(self._waits[prio])
+            out[f"queue_depth_{name}"] = self.depth[prio]
+            out[f"wait_p50_{name}"] = waits[len(waits) // 2] if waits else 0.0
+            out[f"wait_p95_{name}"] = waits[int(len(waits) * 0.95)] if waits else 0.0
+            out[f"wait_max_{name}"] = waits[-1] if waits else 0.0
+        return out
@@ -0,0 +1,168 @@
+"""
+SQLite‑хранилище сессий «Этап‑Тест 7D»
+=======================================
+Переживает рестарт/деплой: ``ctx.user_data`` (с объектом ``Session``) и
+состояния ``ConversationHandler`` сохраняются в SQLite (режим WAL).
+
+Запись отложенная (write‑behind): PTB раз в ``update_interval`` секунд
+отдаёт пачку изменённых пользователей, мы копим их в памяти и пишем одной
+транзакцией в отдельном потоке — одно нажатие кнопки не стоит одного fsync.
+"""
+
+from __future__ import annotations
+import asyncio, json, logging, pickle, sqlite3
+from typing import Dict, Any, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+log = logging.getLogger("EtapBot.persistence")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id INTEGER PRIMARY KEY,
+    data    BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name  TEXT NOT NULL,
+    key   TEXT NOT NULL,
+    state INTEGER,
+    PRIMARY KEY (name, key)
+);
+"""
+
+
+class SQLitePersistence(BasePersistence):
+    """Persistence для PTB: user_data + conversations в одном файле SQLite."""
+
+    def __init__(self, path: str, update_interval: float = 10, shard: Optional[Tuple[int, int]] = None):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        # (номер, число) процесса‑воркера в режиме шардирования (см. shard.py): в один файл
+        # пишут все воркеры, но каждый загружает только своих пользователей
+        self.shard = shard
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")  # в WAL fsync только на checkpoint
+        self._db.executescript(_SCHEMA)
+        # «Грязные» записи: None → удалить строку
+        self._dirty_users: Dict[int, Optional[bytes]] = {}
+        self._dirty_convs: Dict[Tuple[str, str], Optional[int]] = {}
+        self._writer: Optional[asyncio.Task] = None
+
+    # ── загрузка при старте ───────────────────────────────────────────────
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        rows = self._db.execute("SELECT user_id, data FROM user_data").fetchall()
+        return {uid: pickle.loads(blob) for uid, blob in rows if self._owns(uid)}
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[Any, ...], object]:
+        rows = self._db.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        keys = ((tuple(json.loads(key)), state) for key, state in rows)
+        return {key: state for key, state in keys if self._owns(key[-1])}  # ключ — (chat_id, user_id)
+
+    def _owns(self, user_id: int) -> bool:
+        return self.shard is None or user_id % self.shard[1] == self.shard[0]
+
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    # ── накопление изменений ──────────────────────────────────────────────
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        # PTB уже передаёт deepcopy, поэтому сериализуем сразу, в потоке событий
+        self._dirty_users[user_id] = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._dirty_users[user_id] = None
+        self._schedule_write()
+
+    async def update_conversation(self, name: str, key: Tuple[Any, ...], new_state: Optional[object]) -> None:
+        self._dirty_convs[(name, json.dumps(list(key)))] = new_state  # type: ignore[assignment]
+        self._schedule_write()
+
+    async def update_chat_data(self, chat_id: int, data: Any) -> None:
+        pass
+
+    async def update_bot_data(self, data: Any) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: Any) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Any) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Any) -> None:
+        pass
+
+    # ── запись ────────────────────────────────────────────────────────────
+
+    def _schedule_write(self) -> None:
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_running_loop().create_task(self._write_behind())
+
+    async def _write_behind(self) -> None:
+        # PTB вызывает update_* пачкой через asyncio.gather: один проход цикла событий —
+        # и вся пачка уже в буфере, пишем её одной транзакцией.
+        await asyncio.sleep(0)
+        while self._dirty_users or self._dirty_convs:
+            users, convs = self._take_dirty()
+            try:
+                await asyncio.to_thread(self._commit, users, convs)
+            except sqlite3.Error:
+                log.exception("Could not write %d sessions to %s", len(users), self.path)
+                # Пачку не теряем: вернём в буфер под более свежие изменения и запишем
+                # со следующим обновлением или в flush() при остановке
+                self._dirty_users = {**users, **self._dirty_users}
+                self._dirty_convs = {**convs, **self._dirty_convs}
+                return
+
+    def _take_dirty(self):
+        users, self._dirty_users = self._dirty_users, {}
+        convs, self._dirty_convs = self._dirty_convs, {}
+        return users, convs
+
+    def _commit(self, users: Dict[int, Optional[bytes]], convs: Dict[Tuple[str, str], Optional[int]]) -> None:
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+                [(uid, blob) for uid, blob in users.items() if blob is not None],
+            )
+            self._db.executemany(
+                "DELETE FROM user_data WHERE user_id = ?",
+                [(uid,) for uid, blob in users.items() if blob is None],
+            )
+            self._db.executemany(
+                "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                [(name, key, state) for (name, key), state in convs.items() if state is not None],
+            )
+            self._db.executemany(
+                "DELETE FROM conversations WHERE name = ? AND key = ?",
+                [(name, key) for (name, key), state in convs.items() if state is None],
+            )
+
+    async def flush(self) -> None:
+        """Вызывается PTB при остановке: дописываем всё, что осталось в буфере."""
+        if self._writer is not None:
+            await self._writer
+        if self._dirty_users or self._dirty_convs:
+            self._commit(*self._take_dirty())
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,88 @@
+"""
+Скомпилированная таблица вопросов A/B/C
+========================================
+Блоки A, B1..B7 и C один раз при старте превращаются в плоский неизменяемый
+кортеж ``Question``: готовый текст с заголовком, клавиатуры, допустимые
+ответы и указатель на следующий вопрос. Обработчику остаётся взять
+``table[sess.pos]`` — без сборки кнопок и форматирования на каждое нажатие.
+
+Протокол кнопок: ``callback_data = "q|<эпоха>|<qid>|<ответ>"``. Эпоха — номер
+прохождения теста пользователем (полный, без остатка по модулю), qid — номер
+вопроса. По ним обработчик узнаёт дубль, повтор доставки или кнопку из любого
+прошлого прохождения и отбрасывает её, не полагаясь на изменяемые счётчики.
+Клавиатуры первых ``EPOCHS`` прохождений собираются заранее и общие для всех
+сессий; дальше (редкий случай) — собираются на каждый вопрос.
+Клавиатура зависит только от qid и вида шкалы, поэтому одна и та же
+сохраняется между версиями вопросов и ботами процесса (см. tenants.py).
+"""
+
+from __future__ import annotations
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Tuple
+
+from telegram import InlineKeyboardButton as Btn, InlineKeyboardMarkup as Markup
+
+SCALE = ["0", "1", "2", "3", "4"]
+TF = ["True", "False"]
+EPOCHS = 8  # для скольких первых прохождений клавиатуры собраны заранее
+
+
+class Question(NamedTuple):
+    """Один пункт блоков A/B/C."""
+    qid: int                    # плоский номер (= Session.pos до ответа на него)
+    state: int                  # состояние диалога, в котором задаётся вопрос
+    text: str                   # «B3-5/15\n…»
+    markups: Tuple[Markup, ...] # клавиатура для каждой из первых EPOCHS эпох
+    values: FrozenSet[int]      # допустимые значения ответа
+    next: Optional[int]         # qid следующего вопроса; None → показать результат
+
+    def markup(self, epoch: int) -> Markup:
+        """Клавиатура прохождения ``epoch``: готовая или, после первых EPOCHS, собранная заново."""
+        if epoch < len(self.markups):
+            return self.markups[epoch]
+        return Markup([[Btn(b.text, callback_data=answer_data(epoch, self.qid, parse_answer(b.callback_data)[2]))
+                        for b in self.markups[0].inline_keyboard[0]]])
+
+
+def answer_data(epoch: int, qid: int, value: int) -> str:
+    return f"q|{epoch}|{qid}|{value}"
+
+
+def parse_answer(data: str) -> Optional[Tuple[int, int, int]]:
+    """``"q|3|57|4"`` → ``(3, 57, 4)``; None, если это не ответ или данные испорчены."""
+    parts = data.split("|")
+    if len(parts) != 4 or parts[0] != "q":
+        return None
+    try:
+        return int(parts[1]), int(parts[2]), int(parts[3])
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=None)  # ключей не больше, чем номеров вопросов × 2 шкалы
+def _markups(qid: int, labels: Tuple[str, ...], values: Tuple[int, ...]) -> Tuple[Markup, ...]:
+    return tuple(
+        Markup([[Btn(label, callback_data=answer_data(epoch, qid, v)) for label, v in zip(labels, values)]])
+        for epoch in range(EPOCHS)
+    )
+
+
+def compile_table(block_a: Sequence[str], block_b: Dict[str, List[str]], block_c: Sequence[str],
+                  states: Tuple[int, int, int]) -> Tuple[Question, ...]:
+    """Собирает таблицу: сначала A, затем B1..B7 по порядку ключей, затем C."""
+    state_a, state_b, state_c = states
+    scale = (tuple(SCALE), tuple(range(5)))
+    tf = (tuple(TF), (1, 0))
+
+    rows = [(state_a, f"A{i+1}/{len(block_a)}\n{q}", scale) for i, q in enumerate(block_a)]
+    for key in sorted(block_b, key=lambda k: int(k[1:])):
+        items = block_b[key]
+        rows += [(state_b, f"{key}-{i+1}/{len(items)}\n{q}", scale) for i, q in enumerate(items)]
+    rows += [(state_c, f"C{i+1}/{len(block_c)}\n{q}", tf) for i, q in enumerate(block_c)]
+
+    last = len(rows) - 1
+    return tuple(
+        Question(qid, state, text, _markups(qid, labels, values), frozenset(values),
+                 qid + 1 if qid < last else None)
+        for qid, (state, text, (labels, values)) in enumerate(rows)
+    )
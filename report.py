@@ -0,0 +1,221 @@
+"""
+PDF‑сводка результата (reportlab)
+==================================
+Отчёт рисуется в отдельных процессах (``ReportRenderer``), чтобы вёрстка
+не останавливала цикл asyncio. В каждом процессе‑воркере один раз при старте
+регистрируется кириллический TTF‑шрифт и собираются стили и шаблон страницы,
+а статичный текст интерпретации кэшируется по (версия контента, этап,
+уровень) — на каждый отчёт остаётся только вёрстка ответов пользователя.
+Текст интерпретации приходит вместе с данными отчёта, поэтому новая версия
+interpretations.json (см. content.py) не требует перезапуска пула.
+"""
+
+from __future__ import annotations
+import asyncio, io, logging, multiprocessing, os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape
+
+log = logging.getLogger("EtapBot.report")
+
+FONT = "EtapSans"
+# Начертания рядом с обычным файлом шрифта: DejaVuSans-Bold.ttf, arialbd.ttf, …
+FACE_SUFFIXES = {
+    "bold": ("-Bold", "bd", " Bold"),
+    "italic": ("-Oblique", "-Italic", "i", " Italic"),
+    "boldItalic": ("-BoldOblique", "-BoldItalic", "bi", " Bold Italic"),
+}
+FONT_CANDIDATES = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+)
+
+
+class ReportError(RuntimeError):
+    """Отчёт нельзя нарисовать: нет шрифта с кириллицей."""
+
+
+def find_font(path: str = "") -> Optional[str]:
+    """Путь к TTF с кириллицей: из настроек или из системных шрифтов; None, если такого нет."""
+    for candidate in (path, *FONT_CANDIDATES):
+        if candidate and os.path.exists(candidate):
+            if _has_cyrillic(candidate):
+                return candidate
+            log.warning("Font %s has no Cyrillic glyphs, skipped", candidate)
+    return None
+
+
+def _has_cyrillic(path: str) -> bool:
+    from reportlab.pdfbase.ttfonts import TTFError, TTFontFile
+    try:
+        return ord("Ж") in TTFontFile(path).charToGlyph
+    except TTFError:
+        return False
+
+
+def font_faces(path: str) -> Dict[str, str]:
+    """Файлы начертаний семейства: обычное и те из жирного/курсива, что лежат рядом."""
+    stem, ext = os.path.splitext(path)
+    faces = {"normal": path}
+    for face, suffixes in FACE_SUFFIXES.items():
+        for suffix in suffixes:
+            if os.path.exists(stem + suffix + ext):
+                faces[face] = stem + suffix + ext
+                break
+    return faces
+
+
+# ── в процессе‑воркере ────────────────────────────────────────────────────
+
+_static_blocks: Dict[Tuple[str, str, str], tuple] = {}
+_block_d: Sequence[str] = ()
+_styles: Dict[str, Any] = {}
+_template: Any = None
+
+
+def init_worker(font_path: str, block_d: Sequence[str]) -> None:
+    """Один раз на процесс: шрифт, стили, шаблон страницы и вопросы блока D.
+
+    Начертание, которого у шрифта нет, заменяется обычным: <b> и <i> тогда
+    ничего не выделяют, но текст остаётся читаемым.
+    """
+    global _block_d, _template
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import ParagraphStyle
+    from reportlab.lib.units import mm
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.platypus import Frame, PageTemplate
+
+    names = {}
+    for face, path in font_faces(font_path).items():
+        names[face] = FONT if face == "normal" else f"{FONT}-{face}"
+        pdfmetrics.registerFont(TTFont(names[face], path))
+    bold = names.get("bold", FONT)
+    pdfmetrics.registerFontFamily(FONT, normal=FONT, bold=bold, italic=names.get("italic", FONT),
+                                  boldItalic=names.get("boldItalic", bold))
+    base = ParagraphStyle("base", fontName=FONT, fontSize=10.5, leading=14)
+    _styles.update(
+        base=base,
+        title=ParagraphStyle("title", base, fontSize=18, leading=22, spaceAfter=4 * mm),
+        h=ParagraphStyle("h", base, fontSize=13, leading=17, spaceBefore=4 * mm, spaceAfter=2 * mm),
+        note=ParagraphStyle("note", base, textColor="#555555"),
+        item=ParagraphStyle("item", base, leftIndent=5 * mm, bulletIndent=1 * mm),
+    )
+    width, height = A4
+    frame = Frame(18 * mm, 18 * mm, width - 36 * mm, height - 36 * mm, id="body")
+    _template = PageTemplate(id="page", frames=[frame], onPage=_decorate, pagesize=A4)
+    _block_d = block_d
+    _static_blocks.clear()
+
+
+def _decorate(canvas, doc) -> None:
+    from reportlab.lib.units import mm
+    canvas.saveState()
+    canvas.setFont(FONT, 8)
+    canvas.setFillColor("#888888")
+    canvas.drawString(18 * mm, 10 * mm, "Этап‑Тест 7D")
+    canvas.drawRightString(doc.pagesize[0] - 18 * mm, 10 * mm, str(doc.page))
+    canvas.restoreState()
+
+
+def _static_block(data: Dict[str, Any]) -> tuple:
+    """Заголовок, описание и рекомендации уровня — одинаковы для всех в одной версии."""
+    key = (data["version"], data["stage"], data["level"])
+    block = _static_blocks.get(key)
+    if block is not None:
+        return block
+    from reportlab.platypus import Paragraph
+    text = data["interpretation"]
+    out = [Paragraph(f"Ваш основной этап: {escape(text['stage_title'])}", _styles["h"])]
+    if text.get("title"):
+        out.append(Paragraph(f"Уровень освоения: {escape(text['title'])}", _styles["base"]))
+    out.append(Paragraph(f"<i>{escape(text['description'])}</i>", _styles["base"]))
+    if text.get("recommendations"):
+        out.append(Paragraph("Рекомендации для практики", _styles["h"]))
+        out.extend(Paragraph(escape(rec), _styles["item"], bulletText="•")
+                   for rec in text["recommendations"])
+    block = _static_blocks[key] = tuple(out)
+    return block
+
+
+def render_report(data: Dict[str, Any]) -> bytes:
+    """PDF для одного пользователя. ``data`` — см. ``report_data`` в etap_test_bot.py."""
+    from reportlab.platypus import BaseDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+    s = _styles
+    story: List[Any] = [
+        Paragraph("Этап‑Тест 7D — ваш результат", s["title"]),
+        Paragraph(escape(data["date"]), s["note"]),
+    ]
+    story.extend(_static_block(data))
+
+    story.append(Paragraph("Детальные результаты", s["h"]))
+    sums = list(data["sums"].items())
+    table = Table([[k for k, _ in sums], [str(v) for _, v in sums]])
+    table.setStyle(TableStyle([("FONT", (0, 0), (-1, -1), FONT, 10),
+                               ("GRID", (0, 0), (-1, -1), 0.5, "#999999"),
+                               ("ALIGN", (0, 0), (-1, -1), "CENTER")]))
+    story += [table, Spacer(0, 6),
+              Paragraph(f"Коэффициент искажения: {data['distortion']}", s["base"])]
+    if data["warning"]:
+        story.append(Paragraph("<i>Вы отметили много «идеальных» ответов. Для точности результата "
+                               "рекомендуется повторить тест позже, отвечая более искренне.</i>", s["note"]))
+
+    if data.get("d_answers"):
+        story.append(Paragraph("Ваши ответы в интервью", s["h"]))
+        for question, answer in zip(_block_d, data["d_answers"]):
+            story += [Paragraph(f"<b>{escape(question)}</b>", s["base"]),
+                      Paragraph(escape(answer), s["item"]), Spacer(0, 4)]
+
+    buf = io.BytesIO()
+    doc = BaseDocTemplate(buf, pageTemplates=[_template], title="Этап‑Тест 7D",
+                          author="EtapBot", invariant=True)
+    doc.build(story)
+    return buf.getvalue()
+
+
+def _ping() -> None:
+    pass
+
+
+# ── в основном процессе ───────────────────────────────────────────────────
+
+class ReportRenderer:
+    """Пул процессов для ``render_report``; не больше ``queue`` отчётов в работе."""
+
+    def __init__(self, block_d: Sequence[str], font_path: str = "", workers: int = 2,
+                 queue: Optional[int] = None):
+        self.workers = workers
+        font = find_font(font_path)
+        if font is None:
+            raise ReportError("no TTF font with Cyrillic glyphs found, set REPORT_FONT")
+        missing = sorted(FACE_SUFFIXES.keys() - font_faces(font).keys())
+        if missing:
+            log.warning("Font %s has no %s face(s), PDF reports use the regular one",
+                        font, ", ".join(missing))
+        self._initargs = (font, list(block_d))
+        self._slots = asyncio.Semaphore(queue or workers * 4)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.rendered = 0
+
+    async def start(self) -> None:
+        """Поднимает процессы заранее, чтобы первый отчёт не ждал их запуска."""
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=init_worker, initargs=self._initargs)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, _ping) for _ in range(self.workers)))
+
+    async def render(self, data: Dict[str, Any]) -> bytes:
+        async with self._slots:
+            pdf = await asyncio.get_running_loop().run_in_executor(self._pool, render_report, data)
+        self.rendered += 1
+        return pdf
+
+    async def stop(self) -> None:
+        if self._pool is not None:
+            await asyncio.to_thread(self._pool.shutdown, True, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,220 @@
+"""
+Экран результата: готовые шаблоны, языки и длинные сообщения
+=============================================================
+Текст результата почти целиком определяется тройкой (этап, уровень,
+предупреждение об искажении): заголовки, описание и рекомендации из
+``interpretations.json``. ``ResultTemplates`` собирает все такие тексты
+один раз на версию контента и язык, а для пользователя подставляет только
+суммы блоков и коэффициент искажения — три склейки строк.
+
+``Locale`` — подписи экрана результата (и, по желанию, перевод
+интерпретаций) для одного языка. Языки регистрируются в ``LOCALES``;
+пользователю достаётся язык его клиента Telegram, если такой есть, иначе
+язык по умолчанию. Шаблоны каждого языка кэшируются одинаково.
+
+``split_html`` режет текст длиннее лимита Telegram (4096 символов) на
+несколько сообщений по строкам, не разрывая HTML‑теги.
+"""
+
+from __future__ import annotations
+import re, weakref
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from content import MAX_ANSWER, Content
+
+MESSAGE_LIMIT = 4096  # символов (UTF‑16) в одном сообщении Telegram
+
+
+class Locale(NamedTuple):
+    """Подписи экрана результата на одном языке."""
+    code: str
+    stage: str            # "… {этап}"
+    level: str            # "… {уровень}"
+    recommendations: str
+    details: str
+    sums: str
+    distortion: str
+    warning: str
+    invite: str
+    # Перевод интерпретаций: {этап: {"title": …, "levels": {уровень: {"title"/"description"/"recommendations": …}}}};
+    # чего нет — берётся из interpretations.json
+    texts: Optional[Dict[str, Any]] = None
+
+
+RU = Locale(
+    code="ru",
+    stage="<b>Ваш основной этап: {}</b>",
+    level="<b>Уровень освоения: {}</b>",
+    recommendations="<b>Рекомендации для практики:</b>",
+    details="\n<b>Детальные результаты:</b>",
+    sums="Суммы баллов по блокам: ",
+    distortion="Коэффициент искажения: ",
+    warning="\n⚠️ <i>Вы отметили много «идеальных» ответов. Для точности результата рекомендуется "
+            "повторить тест позже, отвечая более искренне.</i>",
+    invite="\n\nЧтобы помочь в исследовании, вы можете пройти короткое анонимное интервью из 10 вопросов.",
+)
+
+LOCALES: Dict[str, Locale] = {RU.code: RU}
+
+
+def register_locale(locale: Locale) -> None:
+    LOCALES[locale.code] = locale
+
+
+def pick_locale(language_code: Optional[str], default: str = RU.code) -> Locale:
+    """Язык пользователя ("en-US" → "en"), если он зарегистрирован, иначе ``default``."""
+    if language_code:
+        locale = LOCALES.get(language_code.split("-", 1)[0].lower())
+        if locale is not None:
+            return locale
+    return LOCALES[default]
+
+
+class ResultTemplates:
+    """Тексты результата одной версии контента на одном языке."""
+
+    def __init__(self, content: Content, locale: Locale):
+        self.version = content.version
+        self.locale = locale.code
+        # (этап, уровень, предупреждение) → (до сумм, между суммами и искажением, после искажения)
+        self._parts: Dict[Tuple[int, str, bool], Tuple[str, str, str]] = {}
+        # ("B3", 17) → "B3: 17" для всех возможных сумм блока
+        self._sums = {(key, value): f"{key}: {value}" for key, _, size in content.b_layout
+                      for value in range(MAX_ANSWER * size + 1)}
+        texts = locale.texts or {}
+        for stage_key, stage_data in content.interpretations.items():
+            stage_text = texts.get(stage_key, {})
+            for level_key, level_data in stage_data["levels"].items():
+                level_text = {**level_data, **stage_text.get("levels", {}).get(level_key, {})}
+                head = [locale.stage.format(stage_text.get("title", stage_data["title"]))]
+                if level_text.get("title"):  # у этапа 0 может не быть заголовка уровня
+                    head.append(locale.level.format(level_text["title"]))
+                head += ["", f"<i>{level_text['description']}</i>"]
+                if level_text.get("recommendations"):
+                    head += ["", locale.recommendations]
+                    head += [f"• {rec}" for rec in level_text["recommendations"]]
+                head += ["\n" + "─" * 20, locale.details, locale.sums + "<code>"]
+                middle = "</code>\n" + locale.distortion
+                for warning in (False, True):
+                    tail = ("\n" + locale.warning if warning else "") + "\n" + locale.invite
+                    self._parts[(int(stage_key), level_key, warning)] = ("\n".join(head), middle, tail)
+
+    def render(self, stage: int, level: str, sums: Dict[str, int], distortion: int, warning: bool) -> List[str]:
+        """Готовый HTML результата, разбитый на сообщения не длиннее лимита."""
+        head, middle, tail = self._parts[(stage, level, warning)]
+        sums_text = ", ".join(map(self._sums.__getitem__, sums.items()))
+        text = "".join((head, sums_text, middle, str(distortion), tail))
+        return split_html(text)
+
+
+_TEMPLATES: "weakref.WeakKeyDictionary[Content, Dict[str, ResultTemplates]]" = weakref.WeakKeyDictionary()
+
+
+def result_templates(content: Content, locale: Locale) -> ResultTemplates:
+    """Шаблоны версии контента и языка; собираются один раз, пока версия жива."""
+    by_locale = _TEMPLATES.get(content)
+    if by_locale is None:
+        by_locale = _TEMPLATES[content] = {}
+    templates = by_locale.get(locale.code)
+    if templates is None:
+        templates = by_locale[locale.code] = ResultTemplates(content, locale)
+    return templates
+
+
+def build_templates(content: Content) -> None:
+    """Шаблоны всех языков сразу при загрузке версии (хук ``ContentStore``)."""
+    for locale in list(LOCALES.values()):
+        result_templates(content, locale)
+
+
+# ── длинные сообщения ─────────────────────────────────────────────────────
+
+_TAG = re.compile(r"<(/?)([a-zA-Z]+)[^>]*>")
+_OPEN_TAIL = re.compile(r"(?:\s*<[a-zA-Z][^>]*>)+\s*$")  # открывающие теги в конце части
+
+
+def _units(text: str) -> int:
+    """Длина в UTF‑16, как её считает Telegram (с запасом: разметка тоже учитывается)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def split_html(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Делит HTML на части ≤ ``limit``: по строкам, а слишком длинную строку — по пробелам.
+
+    Теги, открытые на месте разреза, закрываются в конце части и открываются
+    заново в начале следующей.
+    """
+    if len(text) * 2 <= limit or _units(text) <= limit:
+        return [text]
+    parts: List[str] = []
+    opened: List[Tuple[str, str]] = []  # (имя тега, открывающий тег) на конец ``chunk``
+    chunk, body = "", False  # текущая часть; есть ли в ней что‑то кроме заново открытых тегов
+    for line in text.split("\n"):
+        after = _track(list(opened), line)
+        joined = f"{chunk}\n{line}" if body else chunk + line
+        if _units(joined + _closing(after)) <= limit:
+            chunk, opened, body = joined, after, True
+            continue
+        if body:
+            parts.append(chunk + _closing(opened))
+            chunk = _reopen(opened)
+        if _units(chunk + line + _closing(after)) <= limit:
+            chunk, opened, body = chunk + line, after, True
+            continue
+        pieces, chunk, opened = _split_line(line, limit, opened, chunk)
+        parts += pieces
+        body = True
+    if _TAG.sub("", chunk).strip():
+        parts.append(chunk + _closing(opened))
+    return parts
+
+
+def _closing(opened: List[Tuple[str, str]]) -> str:
+    return "".join(f"</{name}>" for name, _ in reversed(opened))
+
+
+def _reopen(opened: List[Tuple[str, str]]) -> str:
+    return "".join(tag for _, tag in opened)
+
+
+def _track(opened: List[Tuple[str, str]], text: str) -> List[Tuple[str, str]]:
+    """Стек открытых тегов после ``text`` (меняет и возвращает ``opened``)."""
+    for tag in _TAG.finditer(text):
+        if tag.group(1):
+            if opened and opened[-1][0] == tag.group(2).lower():
+                opened.pop()
+        else:
+            opened.append((tag.group(2).lower(), tag.group()))
+    return opened
+
+
+def _split_line(line: str, limit: int, opened: List[Tuple[str, str]],
+                piece: str) -> Tuple[List[str], str, List[Tuple[str, str]]]:
+    """Режет строку по словам: (готовые части, начатая часть, открытые в ней теги)."""
+    pieces: List[str] = []
+    opened = list(opened)
+    for token in re.split(r"(<[^>]+>|\s+)", line):
+        if not token:
+            continue
+        tag = _TAG.fullmatch(token)
+        if tag is None and not token.isspace():
+            closing = _closing(opened)
+            if _units(piece + token + closing) > limit:
+                # теги, открытые прямо перед словом, переносятся в следующую часть вместе с ним
+                tail = _OPEN_TAIL.search(piece)
+                moved = len(_TAG.findall(tail.group())) if tail else 0
+                head = (piece[:tail.start()] if tail else piece).rstrip()
+                if _TAG.sub("", head).strip():
+                    pieces.append(head + _closing(opened[:len(opened) - moved]))
+                piece = _reopen(opened)
+            while _units(token) > limit - _units(piece + closing):  # одно «слово» длиннее лимита
+                room = max((limit - _units(piece + closing)) // 2, 1)  # символ — до двух единиц UTF‑16
+                amp = token.rfind("&", 0, room)
+                if amp > 0 and ";" not in token[amp:room]:  # сущность вроде &amp; не разрезается
+                    room = amp
+                pieces.append(piece + token[:room] + closing)
+                piece, token = _reopen(opened), token[room:]
+        piece += token
+        if tag:
+            _track(opened, token)
+    return pieces, piece, opened
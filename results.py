@@ -0,0 +1,221 @@
+"""
+Хранилище результатов тестов
+=============================
+Каждый завершённый тест дописывается в файл фиксированными записями по
+23 байта (``RECORD``): время, ответы блока A, суммы B1..B7, биты блока C,
+этап и коэффициент искажения. Файл только растёт, поэтому читается через
+``np.memmap`` без копирования.
+
+Для ``/stats`` держатся гистограммы по каждому столбцу (``Aggregates``): они
+обновляются при каждой записи и сохраняются рядом с файлом
+(``<path>.agg.npz``) каждые ``checkpoint_every`` записей и при остановке —
+после рестарта (и после падения) дочитывается только хвост. Запись,
+недописанная при падении, отрезается при открытии. Средние и
+перцентили считаются по гистограммам, выборка «за N дней» — бинарным поиском
+по времени (записи упорядочены) и векторной агрегацией хвоста.
+"""
+
+from __future__ import annotations
+import logging, os, time
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+log = logging.getLogger("EtapBot.results")
+
+MAGIC = b"ETAPRES1"
+HEADER = 16  # MAGIC + размер записи (u4) + резерв (u4)
+N_A, N_B = 8, 7
+RECORD = np.dtype([
+    ("ts", "<u4"),             # unix‑время, с
+    ("a", "u1", (N_A,)),       # ответы 0‑4 на A1..A8
+    ("b", "u1", (N_B,)),       # суммы B1..B7
+    ("c", "<u2"),              # бит i = ответ True на C[i]
+    ("stage", "u1"),
+    ("distortion", "u1"),
+])
+BINS = 256  # все столбцы гистограмм — u1
+
+
+class Aggregates:
+    """Гистограммы по столбцам; складываются и пополняются без прохода по файлу."""
+
+    def __init__(self):
+        self.count = 0
+        self.stage = np.zeros(BINS, np.int64)
+        self.distortion = np.zeros(BINS, np.int64)
+        self.b = np.zeros((N_B, BINS), np.int64)
+        self.a = np.zeros((N_A, BINS), np.int64)
+
+    def add(self, rows: np.ndarray) -> "Aggregates":
+        if not len(rows):
+            return self
+        self.count += len(rows)
+        self.stage += np.bincount(rows["stage"], minlength=BINS)
+        self.distortion += np.bincount(rows["distortion"], minlength=BINS)
+        self.b += _bincount2d(rows["b"])
+        self.a += _bincount2d(rows["a"])
+        return self
+
+    def save(self, path: str, rows: int, last_ts: int = 0) -> None:
+        """``last_ts`` — время последней учтённой записи: по нему видно, что файл тот же."""
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, rows=rows, last_ts=last_ts, stage=self.stage, distortion=self.distortion,
+                 b=self.b, a=self.a)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Tuple[Aggregates, int]":
+        agg = cls()
+        with np.load(path) as f:
+            agg.count = int(f["rows"])
+            agg.stage, agg.distortion, agg.b, agg.a = f["stage"], f["distortion"], f["b"], f["a"]
+            last_ts = int(f["last_ts"])
+        return agg, last_ts
+
+    def summary(self, warning: int, percentiles: Sequence[float] = (0.5, 0.9, 0.99)) -> Dict[str, Any]:
+        """Распределение этапов, доля искажённых (``warning`` — порог предупреждения из
+        правил), средние и перцентили сумм B."""
+        n = max(self.count, 1)
+        values = np.arange(BINS)
+        return {
+            "count": self.count,
+            "stage": self.stage[:N_B + 1].tolist(),
+            "distortion_mean": float(self.distortion @ values) / n,
+            "warning": warning,
+            "distortion_high": float(self.distortion[warning:].sum()) / n,
+            "distortion_pct": {q: _percentile(self.distortion, q) for q in percentiles},
+            "b_mean": (self.b @ values / n).tolist(),
+            "b_pct": {q: [_percentile(h, q) for h in self.b] for q in percentiles},
+        }
+
+
+def _bincount2d(cols: np.ndarray) -> np.ndarray:
+    """Гистограмма каждого столбца (n, k) u1 за один bincount."""
+    k = cols.shape[1]
+    flat = cols.astype(np.intp) + np.arange(k) * BINS
+    return np.bincount(flat.ravel(), minlength=k * BINS).reshape(k, BINS)
+
+
+def _percentile(hist: np.ndarray, q: float) -> int:
+    """Перцентиль по гистограмме целых значений (как np.percentile(method="inverted_cdf"))."""
+    cum = np.cumsum(hist)
+    if not cum[-1]:
+        return 0
+    return int(np.searchsorted(cum, q * cum[-1], side="left"))
+
+
+def _check_header(path: str) -> None:
+    with open(path, "rb") as f:
+        head = f.read(HEADER)
+    if head[:8] != MAGIC or int(np.frombuffer(head, "<u4", 1, 8)[0]) != RECORD.itemsize:
+        raise ValueError(f"{path}: not a results file of this version")
+
+
+def read_rows(path: str) -> np.ndarray:
+    """Все записи файла только для чтения (memmap) — для разовых выгрузок и пересчёта."""
+    _check_header(path)
+    rows = (os.path.getsize(path) - HEADER) // RECORD.itemsize
+    return np.memmap(path, RECORD, "r", HEADER, (rows,)) if rows else np.empty(0, RECORD)
+
+
+class ResultStore:
+    """Файл результатов + агрегаты для ``/stats``."""
+
+    def __init__(self, path: str, checkpoint_every: int = 1000):
+        self.path = path
+        self.agg_path = path + ".agg.npz"
+        self.checkpoint_every = checkpoint_every
+        new = not os.path.exists(path) or os.path.getsize(path) < HEADER
+        self._file = open(path, "ab")
+        if new:
+            self._file.truncate(0)
+            self._file.write(MAGIC + np.array([RECORD.itemsize, 0], "<u4").tobytes())
+            self._file.flush()
+        else:
+            _check_header(path)
+        size = os.path.getsize(path)
+        self.rows = (size - HEADER) // RECORD.itemsize
+        whole = HEADER + self.rows * RECORD.itemsize
+        if size > whole:
+            # Процесс упал посреди append: без этого все следующие записи сдвинутся
+            log.warning("Results: dropped %d bytes of an unfinished record in %s", size - whole, path)
+            self._file.truncate(whole)
+        self.agg = self._load_aggregates()
+        self._saved = self.agg.count
+
+    def _load_aggregates(self) -> Aggregates:
+        agg, last_ts = Aggregates(), 0
+        try:
+            agg, last_ts = Aggregates.load(self.agg_path)
+        except (OSError, KeyError, ValueError):
+            pass
+        if agg.count > self.rows or (agg.count and int(self.view(agg.count - 1)["ts"][0]) != last_ts):
+            agg = Aggregates()  # файл подменили или обрезали — считаем заново
+        if agg.count < self.rows:
+            t0, tail = time.perf_counter(), self.rows - agg.count
+            agg.add(self.view(agg.count))
+            log.info("Results: aggregated %d rows in %.1f ms", tail, (time.perf_counter() - t0) * 1e3)
+        return agg
+
+    def view(self, start: int = 0) -> np.ndarray:
+        """Записи начиная с ``start`` (memmap, без копирования)."""
+        if self.rows <= start:
+            return np.empty(0, RECORD)
+        return np.memmap(self.path, RECORD, "r", HEADER + start * RECORD.itemsize, (self.rows - start,))
+
+    def append(self, a: Sequence[int], b: Sequence[int], c_bits: int, stage: int, distortion: int,
+               ts: Optional[float] = None) -> None:
+        rec = np.zeros(1, RECORD)
+        rec["ts"] = int(ts if ts is not None else time.time())
+        rec["a"], rec["b"], rec["c"] = a, b, c_bits
+        rec["stage"], rec["distortion"] = stage, distortion
+        self._file.write(rec.tobytes())
+        self._file.flush()
+        self.rows += 1
+        self.agg.add(rec)
+        if self.rows - self._saved >= self.checkpoint_every:
+            self._checkpoint()
+
+    def _checkpoint(self) -> None:
+        last_ts = int(self.view(self.rows - 1)["ts"][0]) if self.rows else 0
+        self.agg.save(self.agg_path, self.rows, last_ts)
+        self._saved = self.rows
+
+    def summary(self, since: Optional[float] = None, *, warning: int) -> Dict[str, Any]:
+        """Сводка для /stats по всем записям или начиная с ``since``."""
+        return (self.agg if since is None else self.since(since)).summary(warning)
+
+    def since(self, ts: float) -> Aggregates:
+        """Агрегаты за период с ``ts``: поиск начала по времени и проход только по хвосту.
+
+        Читает только файл (не ``agg``), поэтому может идти в отдельном потоке, пока цикл дописывает записи.
+        """
+        rows = self.view()
+        start = int(np.searchsorted(rows["ts"], int(ts), side="left")) if len(rows) else 0
+        return Aggregates().add(rows[start:])
+
+    def close(self) -> None:
+        self._checkpoint()
+        self._file.close()
+
+
+def format_stats(s: Dict[str, Any], title: str, elapsed: float) -> str:
+    """Текст ответа на /stats."""
+    n = s["count"]
+    if not n:
+        return f"<b>{title}</b>\nНет завершённых тестов."
+    lines = [f"<b>{title}</b>: {n} тестов", "", "<b>Этапы:</b>"]
+    top = max(s["stage"]) or 1
+    for stage, cnt in enumerate(s["stage"]):
+        lines.append(f"<code>{stage} {'█' * round(12 * cnt / top):<12} {100 * cnt / n:5.1f}%</code>")
+    pct = s["distortion_pct"]
+    lines += ["", f"<b>Искажение:</b> среднее {s['distortion_mean']:.2f}, "
+                  f"≥{s['warning']} у {100 * s['distortion_high']:.1f}%, "
+                  + ", ".join(f"p{int(q * 100)}={v}" for q, v in pct.items()),
+              "", "<b>Суммы B (среднее / " + " / ".join(f"p{int(q * 100)}" for q in s["b_pct"]) + "):</b>"]
+    for i, mean in enumerate(s["b_mean"]):
+        lines.append(f"<code>B{i + 1}: {mean:5.1f} / " + " / ".join(f"{v[i]:2d}" for v in s["b_pct"].values())
+                     + "</code>")
+    lines.append(f"\n<i>{elapsed * 1e3:.1f} ms</i>")
+    return "\n".join(lines)
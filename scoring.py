@@ -0,0 +1,243 @@
+"""
+Подсчёт результата теста: правила методики и векторный движок
+==============================================================
+Пороги этапов, позиции «идеализирующих» ответов блока C и порог
+предупреждения об искажении вынесены в ``Ruleset`` (``ruleset.json``).
+``ScoringEngine`` считает сразу массив результатов NumPy‑операциями:
+
+• этап — последовательная проверка B1..B7: этап n пройден, только если
+  пройдены все предыдущие (``logical_and.accumulate`` по строке);
+• искажение — popcount битов C через таблицу на 2¹⁶ значений;
+• уровень — таблица «этап × балл → код уровня» (``LevelTable``) из
+  проверенного индекса ``interpretations.json`` (см. content.py).
+
+Бот считает одну сессию тем же движком (``Session.compute``), поэтому
+пересчёт архива и живой результат не расходятся.
+
+Пересчёт архива результатов по новым правилам с отчётом, у кого сменился
+этап::
+
+    python scoring.py results.bin --rules new_ruleset.json [--old ruleset.json]
+                      [--interpretations new_interpretations.json]
+"""
+
+from __future__ import annotations
+import argparse, json, os, sys, time, weakref
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from content import B_KEYS, MAX_ANSWER, STAGE_THRESHOLD, Content, level_index
+from results import read_rows
+
+N_STAGES = len(B_KEYS)
+C_BITS = 16  # столбец "c" файла результатов — u2
+# Методика по умолчанию (она же в ruleset.json)
+IDEAL_TRUE = (0, 1, 2, 5, 6, 8)
+IDEAL_FALSE = (3, 4, 7)
+DISTORTION_WARNING = 4
+_FIELDS = ("stage_thresholds", "ideal_true", "ideal_false", "distortion_warning")
+_POPCOUNT = np.array([bin(i).count("1") for i in range(1 << C_BITS)], np.uint8)
+
+
+class RulesetError(ValueError):
+    """Файл правил не прошёл проверку."""
+
+
+class Ruleset:
+    """Правила методики; после создания не меняются."""
+    __slots__ = ("thresholds", "ideal_true", "ideal_false", "warning", "true_mask", "false_mask")
+
+    def __init__(self, thresholds: Sequence[int] = (STAGE_THRESHOLD,) * N_STAGES,
+                 ideal_true: Sequence[int] = IDEAL_TRUE, ideal_false: Sequence[int] = IDEAL_FALSE,
+                 warning: int = DISTORTION_WARNING):
+        thresholds, ideal_true, ideal_false = tuple(thresholds), frozenset(ideal_true), frozenset(ideal_false)
+        if len(thresholds) != N_STAGES or not all(isinstance(t, int) and t >= 0 for t in thresholds):
+            raise RulesetError(f"stage_thresholds: expected {N_STAGES} non-negative integers")
+        for name, pos in (("ideal_true", ideal_true), ("ideal_false", ideal_false)):
+            if not all(isinstance(i, int) and 0 <= i < C_BITS for i in pos):
+                raise RulesetError(f"{name}: positions must be integers 0..{C_BITS - 1}")
+        if ideal_true & ideal_false:
+            raise RulesetError(f"positions {sorted(ideal_true & ideal_false)} are both ideal_true and ideal_false")
+        if not isinstance(warning, int) or warning < 0:
+            raise RulesetError("distortion_warning must be a non-negative integer")
+        self.thresholds = thresholds       # сумма блока B<n>, с которой этап n пройден
+        self.ideal_true = ideal_true       # ответ True на C[i] говорит об идеализации
+        self.ideal_false = ideal_false     # ответ False на C[i] говорит об идеализации
+        self.warning = warning             # с какого искажения предупреждать о неискренности
+        self.true_mask = sum(1 << i for i in ideal_true)
+        self.false_mask = sum(1 << i for i in ideal_false)
+
+    @classmethod
+    def load(cls, path: str) -> "Ruleset":
+        """Правила из JSON; отсутствующие поля — по умолчанию, лишние — ошибка (опечатка)."""
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except json.JSONDecodeError as exc:
+            raise RulesetError(f"{path}: invalid JSON: {exc}") from exc
+        if not isinstance(data, dict):
+            raise RulesetError(f"{path}: expected a JSON object")
+        unknown = set(data) - set(_FIELDS)
+        if unknown:
+            raise RulesetError(f"{path}: unknown fields {', '.join(sorted(unknown))}")
+        thresholds = data.get("stage_thresholds", STAGE_THRESHOLD)
+        if isinstance(thresholds, int):
+            thresholds = (thresholds,) * N_STAGES
+        return cls(thresholds, data.get("ideal_true", IDEAL_TRUE), data.get("ideal_false", IDEAL_FALSE),
+                   data.get("distortion_warning", DISTORTION_WARNING))
+
+    def check(self, content: Content) -> None:
+        """Пороги достижимы при числе вопросов в блоках этой версии контента, а позиции
+        идеализирующих ответов есть в её блоке C."""
+        for (key, _, n), threshold in zip(content.b_layout, self.thresholds):
+            if threshold > n * MAX_ANSWER:
+                raise RulesetError(f"{key} has {n} questions, stage threshold {threshold} is unreachable")
+        n_c = len(content.questions) - content.n_scale
+        for name, pos in (("ideal_true", self.ideal_true), ("ideal_false", self.ideal_false)):
+            if pos and max(pos) >= n_c:
+                raise RulesetError(f"{name}: position {max(pos)} is out of range, block C has {n_c} questions")
+
+
+class LevelTable:
+    """Уровни этапов для массивов: ``codes[этап, балл]`` → номер в ``keys[этап]``."""
+
+    def __init__(self, index: Sequence[tuple]):
+        self.keys = tuple(tuple(dict.fromkeys(entry[1] for entry in stage)) for stage in index)
+        self.codes = np.zeros((len(index), max(len(stage) for stage in index)), np.uint8)
+        for s, stage in enumerate(index):
+            row = [self.keys[s].index(entry[1]) for entry in stage]
+            self.codes[s, :len(row)] = row
+            self.codes[s, len(row):] = row[-1]  # балл выше максимума — последний уровень, как Content.level
+        self._names = np.array([key for keys in self.keys for key in keys])
+        self._offsets = np.cumsum([0] + [len(keys) for keys in self.keys[:-1]])
+
+    def lookup(self, stages: np.ndarray, scores: np.ndarray) -> np.ndarray:
+        return self.codes[stages, np.minimum(scores, self.codes.shape[1] - 1)]
+
+    def names(self, stages: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Ключи уровней ("low", …) — коды разных файлов интерпретаций не сравнимы."""
+        return self._names[self._offsets[stages] + codes]
+
+
+class ScoringEngine:
+    """Этап, искажение и уровень для массива результатов по правилам ``rules``."""
+
+    def __init__(self, rules: Ruleset):
+        self.rules = rules
+        self._thresholds = np.array(rules.thresholds, np.uint16)
+        self._tables: "weakref.WeakKeyDictionary[Content, LevelTable]" = weakref.WeakKeyDictionary()
+
+    @staticmethod
+    def b_sums(scale: np.ndarray, content: Content) -> np.ndarray:
+        """Суммы B1..B7 из сырых ответов (n, content.n_scale) в раскладке ``Session.scale``."""
+        starts = [off for _, off, _ in content.b_layout]
+        return np.add.reduceat(scale.astype(np.uint16), starts, axis=1)
+
+    def stages(self, b_sums: np.ndarray) -> np.ndarray:
+        passed = np.asarray(b_sums) >= self._thresholds
+        return np.logical_and.accumulate(passed, axis=1).sum(axis=1, dtype=np.uint8)
+
+    def distortion(self, c_bits: np.ndarray, c_answered: Any = None) -> np.ndarray:
+        """``c_answered`` — сколько вопросов C отвечено (по умолчанию все)."""
+        c = np.asarray(c_bits, np.uint32)
+        answered = (1 << C_BITS) - 1 if c_answered is None else (1 << np.asarray(c_answered, np.uint32)) - 1
+        return _POPCOUNT[c & self.rules.true_mask] + _POPCOUNT[~c & answered & self.rules.false_mask]
+
+    def levels(self, content: Content) -> LevelTable:
+        table = self._tables.get(content)
+        if table is None:
+            table = self._tables[content] = LevelTable(content.levels)
+        return table
+
+    def score(self, b_sums: np.ndarray, c_bits: np.ndarray, c_answered: Any = None,
+              levels: Optional[LevelTable] = None) -> Dict[str, np.ndarray]:
+        """Словарь массивов: stage, distortion, warning и (если дана таблица) level."""
+        b_sums = np.asarray(b_sums)
+        stage = self.stages(b_sums)
+        distortion = self.distortion(c_bits, c_answered)
+        out = {"stage": stage, "distortion": distortion, "warning": distortion >= self.rules.warning}
+        if levels is not None:
+            # Уровень — по баллу блока этапа; у этапа 0 балл всегда 0
+            score = np.where(stage > 0, b_sums[np.arange(len(stage)), np.maximum(stage, 1) - 1], 0)
+            out["level"] = levels.lookup(stage, score)
+        return out
+
+    def score_one(self, b_sums: Sequence[int], c_bits: int, c_answered: int) -> Tuple[int, int, bool]:
+        """(этап, искажение, предупреждение) одной сессии — тем же кодом, что и массив."""
+        res = self.score(np.array([b_sums], np.uint16), np.array([c_bits]), np.array([c_answered]))
+        return int(res["stage"][0]), int(res["distortion"][0]), bool(res["warning"][0])
+
+
+# ── пересчёт архива ──────────────────────────────────────────────────────
+
+CHUNK = 1 << 20  # записей за проход: память под временные массивы ограничена
+
+
+def rescore(rows: np.ndarray, old: ScoringEngine, new: ScoringEngine,
+            old_levels: LevelTable, new_levels: LevelTable) -> Dict[str, Any]:
+    """Сравнивает назначения по старым и новым правилам для записей ``results.RECORD``."""
+    moves = np.zeros((N_STAGES + 1, N_STAGES + 1), np.int64)
+    stored_mismatch = warning_flips = level_changes = 0
+    for start in range(0, len(rows), CHUNK):
+        chunk = rows[start:start + CHUNK]
+        a = old.score(chunk["b"], chunk["c"], levels=old_levels)
+        b = new.score(chunk["b"], chunk["c"], levels=new_levels)
+        np.add.at(moves, (a["stage"], b["stage"]), 1)
+        stored_mismatch += int(np.count_nonzero(a["stage"] != chunk["stage"]))
+        warning_flips += int(np.count_nonzero(a["warning"] != b["warning"]))
+        renamed = old_levels.names(a["stage"], a["level"]) != new_levels.names(b["stage"], b["level"])
+        level_changes += int(np.count_nonzero((a["stage"] == b["stage"]) & renamed))
+    return {"rows": len(rows), "moves": moves, "stored_mismatch": stored_mismatch,
+            "warning_flips": warning_flips, "level_changes": level_changes}
+
+
+def format_moves(report: Dict[str, Any]) -> str:
+    """Таблица «этап по старым правилам → этап по новым»."""
+    moves, n = report["moves"], max(report["rows"], 1)
+    changed = int(moves.sum() - np.trace(moves))
+    lines = [f"{report['rows']} records, stage changed for {changed} ({100 * changed / n:.2f}%)", "",
+             "old\\new " + "".join(f"{s:>9}" for s in range(N_STAGES + 1))]
+    for s, row in enumerate(moves):
+        lines.append(f"{s:>7} " + "".join(f"{v:>9}" for v in row))
+    lines += ["", f"distortion warning flipped: {report['warning_flips']}",
+              f"level changed within the same stage: {report['level_changes']}",
+              f"stored stage differs from the old ruleset: {report['stored_mismatch']}"]
+    return "\n".join(lines)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    here = os.path.dirname(os.path.abspath(__file__))
+    ap = argparse.ArgumentParser(description="Пересчёт архива результатов по новым правилам методики.")
+    ap.add_argument("results", help="файл результатов (RESULTS_DB)")
+    ap.add_argument("--rules", required=True, help="новые правила (JSON как ruleset.json)")
+    ap.add_argument("--old", default=os.path.join(here, "ruleset.json"), help="прежние правила")
+    ap.add_argument("--questions", default=os.path.join(here, "questions_b.json"))
+    ap.add_argument("--interpretations", default=os.path.join(here, "interpretations.json"),
+                    help="интерпретации для новых правил (прежние — --old-interpretations)")
+    ap.add_argument("--old-interpretations", default=os.path.join(here, "interpretations.json"))
+    args = ap.parse_args(argv)
+
+    try:
+        with open(args.questions, encoding="utf-8") as f:
+            block_b = json.load(f)
+        tables = []
+        for path in (args.old_interpretations, args.interpretations):
+            with open(path, encoding="utf-8") as f:
+                tables.append(LevelTable(level_index(block_b, json.load(f))))
+        old, new = ScoringEngine(Ruleset.load(args.old)), ScoringEngine(Ruleset.load(args.rules))
+        rows = read_rows(args.results)
+    except (OSError, ValueError) as exc:  # JSONDecodeError, ContentError, RulesetError — тоже ValueError
+        print(f"error: {exc}", file=sys.stderr)
+        return 2
+
+    t0 = time.perf_counter()
+    report = rescore(rows, old, new, *tables)
+    elapsed = time.perf_counter() - t0
+    print(format_moves(report))
+    print(f"\nrescored in {elapsed:.2f} s ({report['rows'] / max(elapsed, 1e-9) / 1e6:.1f} M records/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,268 @@
+"""
+Жизненный цикл сессий «Этап‑Тест 7D»
+=====================================
+Брошенный на полпути тест раньше навсегда оставался в памяти вместе с
+ответами блока D. ``SessionKeeper`` выгружает сессии на диск:
+
+• по простою — кто не нажимал кнопок дольше ``ttl`` секунд;
+• по числу — если в памяти больше ``max_resident`` пользователей, выгружаются
+  те, кто дольше всех не заходил (LRU).
+
+Выгруженная сессия — это ``user_data`` и состояние диалога одной строкой
+SQLite (pickle + zlib, несколько сотен байт). Когда пользователь снова
+нажимает кнопку, обработчик группы −1 возвращает её в память раньше, чем
+апдейт дойдёт до ``ConversationHandler``, — тест продолжается с того же
+вопроса. Если сессии нет нигде (её выгрузка старше ``spill_ttl`` или бот
+перезапущен без хранилища), старая кнопка получает предложение начать
+заново вместо ошибки в обработчике.
+
+Число сессий в памяти и на диске — в метриках ``etap_sessions``.
+"""
+
+from __future__ import annotations
+import asyncio, logging, pickle, sqlite3, threading, time, weakref, zlib
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application, ApplicationHandlerStop, ContextTypes, ConversationHandler
+
+from metrics import REGISTRY, Registry
+
+log = logging.getLogger("EtapBot.sessions")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spilled (
+    user_id INTEGER PRIMARY KEY,
+    ts      REAL NOT NULL,
+    data    BLOB NOT NULL
+);
+"""
+
+# Сколько сессий сериализовать подряд, не отдавая управление циклу
+_CHUNK = 256
+
+# Внутреннее состояние PTB, без которого выгрузка невозможна: публичного API для
+# этого нет. Проверено на python-telegram-bot 20.7 (версия закреплена в
+# requirements.txt); при обновлении PTB bind() остановит запуск, если их не стало.
+_PTB_PRIVATE = ((ConversationHandler, "_conversations"),
+                (Application, "_user_ids_to_be_deleted_in_persistence"),
+                (Application, "_user_ids_to_be_updated_in_persistence"))
+
+# Все SessionKeeper процесса (по одному на бота, см. tenants.py) — для etap_sessions
+_KEEPERS: "weakref.WeakSet[SessionKeeper]" = weakref.WeakSet()
+
+
+def _sessions() -> List[Tuple[Dict[str, str], int]]:
+    count: Counter = Counter()
+    for keeper in list(_KEEPERS):
+        count[keeper.tenant, "resident"] += len(keeper._seen)
+        count[keeper.tenant, "spilled"] += keeper.spilled
+    return [({"where": where, **({"tenant": tenant} if tenant else {})}, n)
+            for (tenant, where), n in count.items()]
+
+
+class SessionKeeper:
+    """Выгрузка простаивающих сессий на диск и прозрачная загрузка обратно.
+
+    ``grace`` — сессии, тронутые за последние ``grace`` секунд, не выгружаются
+    даже сверх ``max_resident``: их апдейт может ещё обрабатываться.
+    ``expired`` — корутина (update, ctx) для нажатия кнопки, сессии которой нет.
+    ``keep`` — что из ``user_data`` держать в памяти, пока сессия на диске (у бота —
+    версия вопросов, с которой начат тест: иначе её заберёт сборщик мусора и сессия
+    вернётся уже к другой версии).
+    ``shard`` — (номер, число) процесса‑воркера (см. shard.py): файл у воркеров общий,
+    и каждый считает и удаляет только строки своих пользователей.
+    """
+
+    def __init__(self, path: str, ttl: float = 3600, max_resident: int = 10_000,
+                 spill_ttl: float = 30 * 86400, interval: float = 60, grace: float = 30,
+                 expired: Optional[Callable[[Update, Any], Awaitable[Any]]] = None,
+                 keep: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                 registry: Registry = REGISTRY, tenant: str = "",
+                 shard: Optional[Tuple[int, int]] = None):
+        self.tenant = tenant  # метка в метриках, если ботов в процессе несколько
+        self.path = path
+        # Условие «строка этого воркера» для COUNT и удаления просроченных
+        self._own, self._own_args = ((" AND user_id % ? = ?", (shard[1], shard[0])) if shard else ("", ()))
+        self.ttl = ttl
+        self.max_resident = max_resident
+        self.spill_ttl = spill_ttl
+        self.interval = interval
+        self.grace = grace
+        self.expired = expired
+        self.keep = keep
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()  # соединение одно, потоков два (запись и чтение)
+        self.spilled = self._db.execute("SELECT COUNT(*) FROM spilled WHERE 1" + self._own,
+                                        self._own_args).fetchone()[0]
+        # user_id → (время последнего апдейта, chat_id); порядок — от давних к свежим
+        self._seen: "OrderedDict[int, Tuple[float, int]]" = OrderedDict()
+        # Ещё не записано на диск: user_id → blob (None — строку удалить)
+        self._dirty: Dict[int, Optional[bytes]] = {}
+        self._inflight: Dict[int, Optional[bytes]] = {}
+        # user_id → (время выгрузки, результат keep); порядок — от давних к свежим
+        self._held: "OrderedDict[int, Tuple[float, Any]]" = OrderedDict()
+        self._app: Optional[Application] = None
+        self._conv: Optional[ConversationHandler] = None
+        self._task: Optional[asyncio.Task] = None
+        self.evicted = {reason: registry.counter("etap_sessions_evicted_total",
+                                                 "Sessions spilled to disk", reason=reason)
+                        for reason in ("ttl", "lru")}
+        self.rehydrated = registry.counter("etap_sessions_rehydrated_total",
+                                           "Spilled sessions loaded back on a new update")
+        _KEEPERS.add(self)
+        registry.gauge("etap_sessions", "Sessions in memory and spilled to disk", _sessions)
+
+    def bind(self, app: Application, conv: ConversationHandler) -> None:
+        missing = [f"{cls.__name__}.{attr}" for cls, attr in _PTB_PRIVATE
+                   if not hasattr(conv if cls is ConversationHandler else app, attr)]
+        if missing:
+            raise RuntimeError(f"SessionKeeper needs PTB internals missing in this version "
+                               f"(tested with python-telegram-bot 20.7): {', '.join(missing)}")
+        self._app, self._conv = app, conv
+
+    @property
+    def resident(self) -> int:
+        return len(self._seen)
+
+    # ── горячий путь: каждый апдейт ───────────────────────────────────────
+
+    async def rehydrate(self, update: Update, ctx: ContextTypes.DEFAULT_TYPE) -> None:
+        """Обработчик группы −1: отмечает активность и возвращает выгруженную сессию."""
+        user, chat = update.effective_user, update.effective_chat
+        if user is None or chat is None:
+            return
+        uid = user.id
+        self._seen.pop(uid, None)
+        self._seen[uid] = (time.monotonic(), chat.id)
+        if ctx.user_data:
+            return
+        blob = await self._load(uid)
+        if blob is not None:
+            chat_id, state, data = pickle.loads(zlib.decompress(blob))
+            self._held.pop(uid, None)  # сессия снова в памяти и сама держит своё
+            ctx.user_data.update(data)
+            if state is not None:
+                self._conv._conversations[(chat_id, uid)] = state
+            self._dirty[uid] = None
+            self.spilled -= 1
+            self.rehydrated.inc()
+            return
+        # Состояние диалога без user_data обработчики не переживут — сбрасываем
+        self._conv._conversations.pop((chat.id, uid), None)
+        query = update.callback_query
+        if self.expired is not None and query is not None and query.data != "restart":
+            await self.expired(update, ctx)
+            raise ApplicationHandlerStop
+
+    async def _load(self, uid: int) -> Optional[bytes]:
+        for pending in (self._dirty, self._inflight):
+            if uid in pending:
+                return pending[uid]
+        return await asyncio.to_thread(self._select, uid)
+
+    def _select(self, uid: int) -> Optional[bytes]:
+        with self._lock:
+            row = self._db.execute("SELECT data FROM spilled WHERE user_id = ? AND ts >= ?",
+                                   (uid, time.time() - self.spill_ttl)).fetchone()
+        return row[0] if row else None
+
+    # ── выгрузка ──────────────────────────────────────────────────────────
+
+    async def sweep(self) -> Tuple[int, int]:
+        """Выгружает простаивающие и лишние сессии. Возвращает (по простою, по числу)."""
+        now = time.monotonic()
+        by_ttl = by_lru = 0
+        while self._seen:
+            uid, (seen, chat_id) = next(iter(self._seen.items()))
+            idle = now - seen
+            if idle > self.ttl:
+                by_ttl += 1
+            elif len(self._seen) > self.max_resident and idle > self.grace:
+                by_lru += 1
+            else:
+                break
+            del self._seen[uid]
+            self._evict(uid, chat_id)
+            if (by_ttl + by_lru) % _CHUNK == 0:
+                await asyncio.sleep(0)
+                now = time.monotonic()
+        self.evicted["ttl"].inc(by_ttl)
+        self.evicted["lru"].inc(by_lru)
+        deadline = time.time() - self.spill_ttl  # выгрузка просрочена — держать больше нечего
+        while self._held and next(iter(self._held.values()))[0] < deadline:
+            self._held.popitem(last=False)
+        await self._flush()
+        if by_ttl or by_lru:
+            log.info("Spilled %d idle and %d least recently used sessions; resident %d, spilled %d",
+                     by_ttl, by_lru, len(self._seen), self.spilled)
+        return by_ttl, by_lru
+
+    def _evict(self, uid: int, chat_id: int) -> None:
+        app = self._app
+        data = app.user_data.get(uid)
+        state = self._conv._conversations.pop((chat_id, uid), None)
+        if data:
+            blob = pickle.dumps((chat_id, state, dict(data)), pickle.HIGHEST_PROTOCOL)
+            self._dirty[uid] = zlib.compress(blob)
+            self.spilled += 1
+            held = self.keep(data) if self.keep is not None else None
+            if held is not None:
+                self._held.pop(uid, None)
+                self._held[uid] = (time.time(), held)
+        app.drop_user_data(uid)
+        if app.persistence is None:
+            # Без хранилища PTB копит эти id вечно — ровно то, от чего мы избавляемся
+            app._user_ids_to_be_deleted_in_persistence.discard(uid)
+            app._user_ids_to_be_updated_in_persistence.discard(uid)
+
+    async def _flush(self) -> None:
+        self._inflight, self._dirty = self._dirty, {}
+        try:
+            self.spilled = await asyncio.to_thread(self._commit, self._inflight)
+        except sqlite3.Error:
+            log.exception("Could not spill %d sessions to %s", len(self._inflight), self.path)
+            self._dirty = {**self._inflight, **self._dirty}
+        finally:
+            self._inflight = {}
+
+    def _commit(self, rows: Dict[int, Optional[bytes]]) -> int:
+        now = time.time()
+        with self._lock, self._db:
+            self._db.executemany("INSERT OR REPLACE INTO spilled (user_id, ts, data) VALUES (?, ?, ?)",
+                                 [(uid, now, blob) for uid, blob in rows.items() if blob is not None])
+            self._db.executemany("DELETE FROM spilled WHERE user_id = ?",
+                                 [(uid,) for uid, blob in rows.items() if blob is None])
+            self._db.execute("DELETE FROM spilled WHERE ts < ?" + self._own, (now - self.spill_ttl, *self._own_args))
+            return self._db.execute("SELECT COUNT(*) FROM spilled WHERE 1" + self._own,
+                                    self._own_args).fetchone()[0]
+
+    # ── фоновая служба ────────────────────────────────────────────────────
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                log.exception("Session sweep failed")
+
+    def start(self) -> None:
+        # Сессии, загруженные из хранилища при старте, считаются только что тронутыми
+        now = time.monotonic()
+        chats = {key[-1]: key[0] for key in self._conv._conversations}  # ключ — (chat_id, user_id)
+        for uid in self._app.user_data:
+            self._seen.setdefault(uid, (now, chats.get(uid, uid)))
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._dirty:
+            await self._flush()
+        self._db.close()
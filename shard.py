@@ -0,0 +1,408 @@
+"""
+Шардирование: несколько процессов‑воркеров за одним webhook
+============================================================
+Один процесс с одним циклом asyncio использует одно ядро. При
+``SHARD_WORKERS > 1`` webhook принимает диспетчер (``ShardDispatcher``) и
+пересылает апдейт одному из N процессов‑воркеров по ``user_id % N``. У
+каждого воркера своё Application: сессии его пользователей живут только в
+нём, а апдейты одного пользователя идут по одному соединению в порядке
+поступления (внутри воркера порядок держит PerUserUpdateProcessor).
+
+Общие службы — сводки администратору (AdminDigest) и файл результатов
+(ResultStore) — остаются в диспетчере. Воркеры обращаются к ним через то же
+локальное соединение (``RemoteDigest``, ``RemoteResults``). Журнал воркеров
+попадает в журнал диспетчера через очередь multiprocessing (logpipe.py).
+Метрики у каждого процесса свои: диспетчер отдаёт на ``METRICS_PORT`` только
+раскладку апдейтов, воркер N — всё остальное на ``METRICS_PORT + 1 + N``.
+Упавший воркер перезапускается. Пока он поднимается, webhook отвечает на
+апдейты его пользователей 503, и Telegram доставит их повторно.
+
+Кадр в соединении: 4 байта длины, 1 байт типа, тело в JSON. Порт слушает
+только 127.0.0.1, но и там соединение принимается, лишь когда воркер
+подтвердил ключ, полученный от диспетчера при запуске: на случайный вызов
+(CHALLENGE) он отвечает HMAC‑SHA256 от него (AUTH), как в
+``multiprocessing.connection``.
+"""
+
+from __future__ import annotations
+import asyncio, hashlib, hmac, itertools, json, logging, multiprocessing, secrets, signal, struct
+from logging.handlers import QueueListener
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+from telegram import Bot, Update
+from telegram.ext import Application
+
+from httplistener import HTTPListener
+from logpipe import forward_logging
+from metrics import REGISTRY
+
+log = logging.getLogger("EtapBot.shard")
+
+_HEAD = struct.Struct("!IB")
+HELLO, UPDATE, QUIT, DIGEST, RESULT, STATS, REPLY, CHALLENGE, AUTH = range(9)
+AUTH_TIMEOUT = 10.0  # сек на ответ AUTH после подключения
+
+# (номер воркера, число воркеров, RemoteDigest, RemoteResults) → Application воркера; вместо
+# службы, которой нет у диспетчера, передаётся None. Должна быть функцией уровня модуля
+# (или functools.partial от неё): передаётся в spawn‑процесс.
+AppFactory = Callable[[int, int, Optional["RemoteDigest"], Optional["RemoteResults"]], Application]
+
+
+async def _read_frame(reader: asyncio.StreamReader) -> Tuple[int, bytes]:
+    size, kind = _HEAD.unpack(await reader.readexactly(_HEAD.size))
+    return kind, await reader.readexactly(size)
+
+
+def _write_frame(writer: asyncio.StreamWriter, kind: int, payload: bytes = b"") -> None:
+    writer.writelines((_HEAD.pack(len(payload), kind), payload))
+
+
+def _mac(authkey: bytes, challenge: bytes, index: int) -> str:
+    return hmac.new(authkey, challenge + str(index).encode(), hashlib.sha256).hexdigest()
+
+
+def user_of(update: Dict[str, Any]) -> Optional[int]:
+    """user_id отправителя апдейта (как effective_user в PTB), иначе id чата."""
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        sender = value.get("from") or value.get("user")
+        if sender:
+            return sender.get("id")
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat.get("id")
+    return None
+
+
+# ── диспетчер (основной процесс) ──────────────────────────────────────────
+
+class ShardDispatcher:
+    """Запускает ``workers`` процессов и раскладывает по ним апдейты."""
+
+    def __init__(self, factory: AppFactory, workers: int, digest: Any = None, results: Any = None,
+                 log_queue_size: int = 10_000):
+        self.factory = factory
+        self.n = workers
+        self.digest = digest
+        self.results = results
+        self.log_queue_size = log_queue_size
+        self._mp = multiprocessing.get_context("spawn")
+        self._procs: List[Any] = [None] * workers
+        self._links: List[Optional[asyncio.StreamWriter]] = [None] * workers
+        self._ready: List[asyncio.Event] = []
+        self._conns: Set[asyncio.Task] = set()
+        self._server: Optional[asyncio.base_events.Server] = None
+        self._monitor: Optional[asyncio.Task] = None
+        self._log_queue: Any = None
+        self._log_listener: Optional[QueueListener] = None
+        self._stopping = False
+        self._authkey = secrets.token_bytes(32)  # уходит воркерам в аргументах spawn, не в сеть
+        self.port = 0
+        self.routed = [REGISTRY.counter("etap_shard_updates_total", "Updates routed to each shard worker",
+                                        shard=str(i)) for i in range(workers)]
+        REGISTRY.gauge("etap_shard_workers_up", "Connected shard workers",
+                       lambda: [({}, sum(link is not None for link in self._links))])
+
+    async def start(self, bot: Optional[Bot] = None, timeout: float = 120) -> None:
+        """Поднимает воркеры и ждёт, пока каждый подключится; ``bot`` — для сводок администратору."""
+        self._ready = [asyncio.Event() for _ in range(self.n)]
+        self._server = await asyncio.start_server(self._serve_worker, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._log_queue = self._mp.Queue()
+        self._log_listener = QueueListener(self._log_queue, *logging.getLogger().handlers)
+        self._log_listener.start()
+        if self.digest is not None:
+            await self.digest.start(bot)
+        for index in range(self.n):
+            self._spawn(index)
+        await asyncio.wait_for(asyncio.gather(*(ready.wait() for ready in self._ready)), timeout)
+        self._monitor = asyncio.create_task(self._watch())
+        log.info("Shard dispatcher: %d workers ready", self.n)
+
+    def _spawn(self, index: int) -> None:
+        proc = self._mp.Process(target=worker_main, name=f"etap-shard-{index}",
+                                args=(self.factory, index, self.n, self.port, self._authkey,
+                                      (self.digest is not None, self.results is not None),
+                                      self._log_queue, self.log_queue_size))
+        proc.start()
+        self._procs[index] = proc
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(1)
+            for index, proc in enumerate(self._procs):
+                if not proc.is_alive() and not self._stopping:
+                    log.error("Shard worker %d exited with code %s, restarting", index, proc.exitcode)
+                    self._spawn(index)
+
+    async def _serve_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._conns.add(task)
+        index = None
+        try:
+            index = await self._authenticate(reader, writer)
+            if index is None:
+                return
+            kind, _ = await _read_frame(reader)  # HELLO: Application воркера запущено
+            self._links[index] = writer
+            self._ready[index].set()
+            while True:
+                kind, payload = await _read_frame(reader)
+                try:
+                    self._handle(writer, kind, payload)
+                except Exception:  # битый кадр не должен рвать связь с воркером
+                    log.exception("Shard worker %d: could not handle a frame of type %d", index, kind)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if index is not None and self._links[index] is writer:
+                self._links[index] = None
+                self._ready[index].clear()
+            writer.close()
+            self._conns.discard(task)
+
+    async def _authenticate(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> Optional[int]:
+        """Номер воркера, если он знает ключ; иначе None (соединение закроется)."""
+        challenge = secrets.token_bytes(32)
+        _write_frame(writer, CHALLENGE, challenge)
+        try:
+            kind, payload = await asyncio.wait_for(_read_frame(reader), AUTH_TIMEOUT)
+            auth = json.loads(payload) if kind == AUTH else {}
+            index, mac = int(auth["index"]), str(auth["mac"])
+        except (asyncio.TimeoutError, ValueError, KeyError, TypeError):
+            index, mac = -1, ""
+        if not (0 <= index < self.n and hmac.compare_digest(mac, _mac(self._authkey, challenge, index))):
+            log.warning("Shard dispatcher: rejected a connection that failed authentication")
+            return None
+        return index
+
+    def _handle(self, writer: asyncio.StreamWriter, kind: int, payload: bytes) -> None:
+        # Воркеры не шлют кадры служб, которых у диспетчера нет (получают None вместо них)
+        if kind == DIGEST and self.digest is not None:
+            self.digest.submit(json.loads(payload))
+        elif kind == RESULT and self.results is not None:
+            self.results.append(*json.loads(payload))
+        elif kind == STATS:
+            req, (since, warning) = json.loads(payload)
+            if self.results is not None and since is not None:
+                # проход по хвосту файла — в потоке, диспетчер тем временем принимает апдейты
+                task = asyncio.create_task(self._stats(writer, req, since, warning))
+                self._conns.add(task)
+                task.add_done_callback(self._conns.discard)
+                return
+            summary = self.results.summary(since, warning=warning) if self.results is not None else None
+            _write_frame(writer, REPLY, json.dumps([req, summary]).encode())
+
+    async def _stats(self, writer: asyncio.StreamWriter, req: int, since: float, warning: int) -> None:
+        try:
+            summary = await asyncio.to_thread(self.results.summary, since, warning=warning)
+        except Exception:  # как и с другими кадрами: ошибка в журнал, связь с воркером остаётся
+            log.exception("Shard dispatcher: could not compute /stats")
+            return
+        _write_frame(writer, REPLY, json.dumps([req, summary]).encode())
+
+    async def route(self, body: bytes, update: Dict[str, Any]) -> bool:
+        """Отдаёт апдейт воркеру его пользователя; False — воркер сейчас недоступен."""
+        uid = user_of(update)
+        index = uid % self.n if uid is not None else 0
+        link = self._links[index]
+        if link is None:
+            return False
+        _write_frame(link, UPDATE, body)
+        self.routed[index].inc()
+        await link.drain()
+        return True
+
+    def listener(self, path: str, host: str, port: int, secret_token: Optional[str] = None) -> HTTPListener:
+        """Webhook, который раскладывает апдейты по воркерам (ср. webhook.webhook_listener)."""
+
+        async def handle(method: str, target: str, headers: Dict[str, str], body: bytes):
+            if method != "POST" or target.split("?", 1)[0] != path:
+                return 404, "text/plain", b""
+            if secret_token and headers.get("x-telegram-bot-api-secret-token") != secret_token:
+                return 403, "text/plain", b""
+            try:
+                update = json.loads(body)
+            except ValueError:
+                return 400, "text/plain", b""
+            if not isinstance(update, dict):
+                return 400, "text/plain", b""
+            if not await self.route(body, update):
+                return 503, "text/plain", b""
+            return 200, "text/plain", b"OK"
+
+        return HTTPListener(handle, host, port)
+
+    async def stop(self, timeout: float = 30) -> None:
+        """Воркеры дорабатывают принятые апдейты и сохраняют сессии; затем закрываются общие службы."""
+        self._stopping = True
+        if self._monitor is not None:
+            self._monitor.cancel()
+        for link in self._links:
+            if link is not None:
+                _write_frame(link, QUIT)
+        await asyncio.to_thread(self._join, timeout)
+        if self._conns:  # дочитать последние кадры воркеров
+            await asyncio.wait(set(self._conns), timeout=timeout)
+        self._server.close()
+        await self._server.wait_closed()
+        if self.digest is not None:
+            await self.digest.stop()
+        if self.results is not None:
+            self.results.close()
+        self._log_listener.stop()
+
+    def _join(self, timeout: float) -> None:
+        for index, proc in enumerate(self._procs):
+            proc.join(timeout)
+            if proc.is_alive():
+                log.warning("Shard worker %d did not stop in %.0f s, terminating", index, timeout)
+                proc.terminate()
+                proc.join()
+
+
+async def serve_sharded(dispatcher: ShardDispatcher, token: str, url: str, listen: str = "0.0.0.0",
+                        port: int = 8443, secret_token: Optional[str] = None,
+                        stop: Optional[asyncio.Event] = None, metrics_server: Any = None) -> None:
+    """Регистрирует webhook и раздаёт апдейты воркерам, пока не выставлен ``stop``."""
+    stop = stop or asyncio.Event()
+    listener = dispatcher.listener(urlsplit(url).path or "/", listen, port, secret_token)
+    async with Bot(token) as bot:
+        await dispatcher.start(bot)
+        if metrics_server is not None:
+            await metrics_server.start()
+        await bot.set_webhook(url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES,
+                              max_connections=100)
+        await listener.start()
+        log.info("Sharded webhook mode: %s, %d workers", url, dispatcher.n)
+        try:
+            await stop.wait()
+        finally:
+            await listener.stop()
+            await dispatcher.stop()
+            if metrics_server is not None:
+                await metrics_server.stop()
+
+
+def run_sharded(dispatcher: ShardDispatcher, token: str, url: str, listen: str = "0.0.0.0",
+                port: int = 8443, secret_token: Optional[str] = None, metrics_server: Any = None) -> None:
+    """Блокирующий запуск до SIGINT/SIGTERM (аналог ``webhook.run_webhook``)."""
+
+    async def _main() -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await serve_sharded(dispatcher, token, url, listen, port, secret_token, stop, metrics_server)
+
+    asyncio.run(_main())
+
+
+# ── воркер (дочерний процесс) ─────────────────────────────────────────────
+
+class _Link:
+    """Соединение воркера с диспетчером: отправка кадров и ответы на запросы."""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self._replies: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+
+    def send(self, kind: int, obj: Any) -> None:
+        _write_frame(self.writer, kind, json.dumps(obj, ensure_ascii=False).encode())
+
+    async def request(self, kind: int, obj: Any, timeout: float = 30) -> Any:
+        req = next(self._ids)
+        fut = self._replies[req] = asyncio.get_running_loop().create_future()
+        self.send(kind, [req, obj])
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            self._replies.pop(req, None)
+
+    def resolve(self, req: int, result: Any) -> None:
+        fut = self._replies.get(req)
+        if fut is not None and not fut.done():
+            fut.set_result(result)
+
+
+class RemoteDigest:
+    """AdminDigest для воркера: записи уходят в сводку диспетчера."""
+
+    def __init__(self, link: _Link):
+        self._link = link
+
+    def submit(self, record: Dict[str, Any]) -> None:
+        # Файл интервью может быть удалён раньше, чем диспетчер прочтёт запись
+        self._link.send(DIGEST, {**record, "answers": list(record.get("answers", ()))})
+
+    async def start(self, bot: Any) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class RemoteResults:
+    """ResultStore для воркера: запись и /stats — в файле результатов диспетчера."""
+
+    def __init__(self, link: _Link):
+        self._link = link
+
+    def append(self, a, b, c_bits: int, stage: int, distortion: int) -> None:
+        # Время ставит диспетчер: файл упорядочен по нему (см. ResultStore.since)
+        self._link.send(RESULT, [[int(x) for x in a], [int(x) for x in b], int(c_bits), int(stage),
+                                 int(distortion)])
+
+    async def summary(self, since: Optional[float] = None, *, warning: int) -> Dict[str, Any]:
+        summary = await self._link.request(STATS, [since, warning])
+        # В JSON ключи‑перцентили стали строками
+        for key in ("distortion_pct", "b_pct"):
+            summary[key] = {float(q): v for q, v in summary[key].items()}
+        return summary
+
+    def close(self) -> None:
+        pass
+
+
+def worker_main(factory: AppFactory, index: int, workers: int, port: int, authkey: bytes,
+                services: Tuple[bool, bool], log_queue: Any, log_queue_size: int) -> None:
+    """Точка входа процесса‑воркера; ``services`` — есть ли у диспетчера сводки и результаты."""
+    forward_logging(log_queue, queue_size=log_queue_size, worker=index)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C получает диспетчер и останавливает воркеры сам
+    asyncio.run(_worker(factory, index, workers, port, authkey, services))
+
+
+async def _worker(factory: AppFactory, index: int, workers: int, port: int, authkey: bytes,
+                  services: Tuple[bool, bool]) -> None:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    kind, challenge = await _read_frame(reader)
+    link = _Link(writer)
+    link.send(AUTH, {"index": index, "mac": _mac(authkey, challenge, index)})
+    has_digest, has_results = services
+    app = factory(index, workers, RemoteDigest(link) if has_digest else None,
+                  RemoteResults(link) if has_results else None)
+    async with app:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        _write_frame(writer, HELLO)
+        try:
+            while True:
+                kind, payload = await _read_frame(reader)
+                if kind == UPDATE:
+                    await app.update_queue.put(Update.de_json(json.loads(payload), app.bot))
+                elif kind == REPLY:
+                    link.resolve(*json.loads(payload))
+                elif kind == QUIT:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            log.error("Shard worker %d lost the dispatcher connection", index)
+        finally:
+            await app.stop()
+            if app.post_stop:
+                await app.post_stop(app)
+            writer.close()
+            await writer.wait_closed()
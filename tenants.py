@@ -0,0 +1,262 @@
+"""
+Несколько ботов в одном процессе
+=================================
+Вместо отдельного процесса на каждый вариант анкеты (свой ``config.json``,
+свой интерпретатор, свой пул HTTP‑соединений) один процесс держит
+несколько Application — по одному на токен (``TENANTS`` в config.json).
+У каждого бота свои вопросы B и интерпретации, правила подсчёта, язык,
+администратор, файлы сессий, результатов и интервью. Общие у всех:
+
+• один цикл asyncio и общие службы процесса (пул PDF, /metrics, замер цикла);
+• HTTP‑клиент: ``SharedRequest`` отдаёт всем ботам один пул соединений
+  (и второй — для long polling), а закрывает его последний из них;
+• одинаковые вопросы и интерпретации загружаются один раз (content.py), а
+  клавиатуры вопросов общие даже у разных анкет (questions.py);
+• бюджет одновременно обрабатываемых апдейтов: ``FairShare`` выдаёт
+  освободившееся место ботам по кругу, поэтому наплыв пользователей одного
+  бота не задерживает ответы остальных дольше, чем на одну очередь.
+
+``serve_tenants`` запускает боты long polling'ом или одним webhook‑сервером
+(путь ``<путь WEBHOOK_URL>/<имя бота>``). Бот, который не смог стартовать
+(например, токен отозван), пишется в журнал, остальные работают.
+"""
+
+from __future__ import annotations
+import asyncio, logging, signal
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, NamedTuple, Optional, Sequence, Tuple
+from urllib.parse import urlsplit
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+from content import ACTIVE_STORE, ContentStore
+from webhook import PerUserUpdateProcessor, webhook_routes
+
+log = logging.getLogger("EtapBot.tenants")
+
+
+class Tenant(NamedTuple):
+    """Один бот процесса и то, что у него своё."""
+    name: str                  # имя в журнале, метриках и пути webhook
+    token: str
+    content: ContentStore      # вопросы B и интерпретации
+    engine: Any                # scoring.ScoringEngine
+    answers: Any               # interview.InterviewSpool
+    locale: str                # язык результата по умолчанию
+    admin_chat: Optional[int]
+    root: str                  # каталог файлов бота (сессии, результаты, спулы)
+
+
+def tenant_url(base: str, name: str) -> str:
+    return f"{base.rstrip('/')}/{name}"
+
+
+# ── общий HTTP‑клиент ─────────────────────────────────────────────────────
+
+class SharedRequest(BaseRequest):
+    """Один ``BaseRequest`` на несколько ботов.
+
+    Токен входит в URL запроса, поэтому пул соединений годится для любого
+    бота. ``initialize``/``shutdown`` считают пользователей: клиент создаётся
+    первым ботом и закрывается, когда остановился последний.
+    """
+
+    def __init__(self, request: BaseRequest):
+        self.request = request
+        self.users = 0
+        self._lock = asyncio.Lock()
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.request.read_timeout
+
+    async def initialize(self) -> None:
+        async with self._lock:
+            if not self.users:
+                await self.request.initialize()
+            self.users += 1
+
+    async def shutdown(self) -> None:
+        async with self._lock:
+            if not self.users:
+                return
+            self.users -= 1
+            if not self.users:
+                await self.request.shutdown()
+
+    async def do_request(self, *args: Any, **kwargs: Any) -> Tuple[int, bytes]:
+        return await self.request.do_request(*args, **kwargs)
+
+
+# ── честная очередь апдейтов ──────────────────────────────────────────────
+
+class FairShare:
+    """Не больше ``slots`` апдейтов всех ботов в обработке одновременно.
+
+    Пока места есть, апдейт проходит сразу. Иначе он ждёт в очереди своего
+    бота, а освободившееся место переходит к следующему по кругу боту с
+    ожидающими апдейтами — не к тому, кто пришёл раньше всех.
+    """
+
+    def __init__(self, slots: int):
+        self.slots = slots
+        self.busy = 0
+        self._queues: Dict[str, Deque[asyncio.Future]] = {}
+        self._ring: Deque[str] = deque()  # боты с ожидающими апдейтами, чья очередь следующая
+
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    async def acquire(self, tenant: str) -> None:
+        if self.busy < self.slots and not self._ring:
+            self.busy += 1
+            return
+        queue = self._queues.get(tenant)
+        if queue is None:
+            queue = self._queues[tenant] = deque()
+            self._ring.append(tenant)
+        fut = asyncio.get_running_loop().create_future()
+        queue.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()  # место уже передано этому апдейту — отдаём дальше
+            else:
+                queue.remove(fut)
+                if not queue:
+                    del self._queues[tenant]
+                    self._ring.remove(tenant)
+            raise
+
+    def release(self) -> None:
+        if not self._ring:
+            self.busy -= 1
+            return
+        tenant = self._ring.popleft()
+        queue = self._queues[tenant]
+        fut = queue.popleft()
+        if queue:
+            self._ring.append(tenant)  # в конец круга
+        else:
+            del self._queues[tenant]
+        fut.set_result(None)  # место переходит ожидающему, busy не меняется
+
+
+class TenantUpdateProcessor(PerUserUpdateProcessor):
+    """Порядок апдейтов пользователя — как в ``PerUserUpdateProcessor``, место в обработке — из ``FairShare``.
+
+    Место берётся под замком пользователя, поэтому ждущие своей очереди апдейты
+    одного пользователя не занимают общий бюджет.
+    """
+
+    def __init__(self, share: FairShare, tenant: str):
+        super().__init__(share.slots)
+        self.share = share
+        self.tenant = tenant
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        try:
+            await self.share.acquire(self.tenant)
+        except asyncio.CancelledError:
+            coroutine.close()
+            raise
+        try:
+            await coroutine
+        finally:
+            self.share.release()
+
+
+# ── запуск ────────────────────────────────────────────────────────────────
+
+async def _start(tenant: Tenant, app: Application, webhook: Optional[str], secret_token: Optional[str]) -> None:
+    # Свой контекст у каждого бота: сессии из хранилища находят версии вопросов этого бота
+    ACTIVE_STORE.set(tenant.content)
+    await app.initialize()
+    try:
+        if webhook:
+            await app.bot.set_webhook(tenant_url(webhook, tenant.name), secret_token=secret_token,
+                                      allowed_updates=Update.ALL_TYPES,
+                                      max_connections=min(100, max(app.update_processor.max_concurrent_updates, 40)))
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        if not webhook:
+            await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+    except BaseException:
+        await app.shutdown()
+        raise
+
+
+async def _stop(app: Application) -> None:
+    if app.updater and app.updater.running:
+        await app.updater.stop()
+    if app.running:
+        await app.stop()
+    if app.post_stop:
+        await app.post_stop(app)
+    await app.shutdown()
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+
+
+async def serve_tenants(tenants: Sequence[Tuple[Tenant, Application]], webhook: Optional[str] = None,
+                        listen: str = "0.0.0.0", port: int = 8443, secret_token: Optional[str] = None,
+                        stop: Optional[asyncio.Event] = None,
+                        on_start: Optional[Callable[[], Awaitable[None]]] = None,
+                        on_stop: Optional[Callable[[], Awaitable[None]]] = None) -> None:
+    """Запускает боты (webhook, если задан ``webhook``, иначе long polling) до ``stop``.
+
+    ``on_start``/``on_stop`` поднимают и останавливают общие службы процесса:
+    до старта первого бота и после остановки последнего.
+    """
+    stop = stop or asyncio.Event()
+    if on_start is not None:
+        await on_start()
+    running: List[Tuple[Tenant, Application]] = []
+    listener = None
+    try:
+        started = await asyncio.gather(*(_start(t, app, webhook, secret_token) for t, app in tenants),
+                                       return_exceptions=True)
+        for (tenant, app), error in zip(tenants, started):
+            if isinstance(error, BaseException):
+                log.error("Tenant %s failed to start: %r", tenant.name, error)
+            else:
+                running.append((tenant, app))
+        if not running:
+            raise RuntimeError("no tenant could start")
+        if webhook:
+            path = urlsplit(webhook).path
+            listener = webhook_routes({tenant_url(path, t.name): app for t, app in running},
+                                      listen, port, secret_token)
+            await listener.start()
+        log.info("Tenants running (%s): %s", "webhook" if webhook else "polling",
+                 ", ".join(t.name for t, _ in running))
+        await stop.wait()
+    finally:
+        if listener is not None:
+            await listener.stop()
+        for (tenant, _), error in zip(running, await asyncio.gather(
+                *(_stop(app) for _, app in running), return_exceptions=True)):
+            if isinstance(error, BaseException):
+                log.error("Tenant %s failed to stop cleanly: %r", tenant.name, error)
+        if on_stop is not None:
+            await on_stop()
+
+
+def run_tenants(tenants: Sequence[Tuple[Tenant, Application]], webhook: Optional[str] = None,
+                listen: str = "0.0.0.0", port: int = 8443, secret_token: Optional[str] = None,
+                on_start: Optional[Callable[[], Awaitable[None]]] = None,
+                on_stop: Optional[Callable[[], Awaitable[None]]] = None) -> None:
+    """Блокирующий запуск всех ботов до SIGINT/SIGTERM."""
+
+    async def _main() -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await serve_tenants(tenants, webhook, listen, port, secret_token, stop, on_start, on_stop)
+
+    asyncio.run(_main())
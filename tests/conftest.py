@@ -0,0 +1,16 @@
+"""
+Общее для тестов: бот собирается против ``FakeBotAPI`` (benchmarks/fake_telegram.py),
+файлы интервью Блока D пишутся во временный каталог теста.
+"""
+
+import pytest
+
+import etap_test_bot as bot
+from interview import InterviewSpool
+
+
+@pytest.fixture(autouse=True)
+def answers(tmp_path, monkeypatch):
+    spool = InterviewSpool(str(tmp_path / "d_spool"))
+    monkeypatch.setattr(bot, "ANSWERS", spool)
+    return spool
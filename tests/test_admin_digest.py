@@ -0,0 +1,56 @@
+"""Сводки администратору: битая строка спула и сбой отправки не останавливают доставку."""
+
+import asyncio
+
+from admin_digest import AdminDigest
+
+
+class Bot:
+    def __init__(self, fail: int = 0):
+        self.fail = fail
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("network stack exploded")
+        self.sent.append(text)
+
+
+def test_unreadable_line_quarantined(tmp_path):
+    path = str(tmp_path / "admin.jsonl")
+    digest = AdminDigest(1, path)
+    digest.submit({"user_id": 1, "ts": "t1", "answers": ["a"]})
+    digest._spool.write(b'{"user_id": 2, "ts": \n')
+    digest._spool.flush()
+    digest.pending += 1
+    digest.submit({"user_id": 3, "ts": "t3", "answers": ["c"]})
+
+    async def scenario():
+        digest.bot = Bot()
+        return await digest.deliver(), digest.bot.sent
+
+    delivered, sent = asyncio.run(scenario())
+    assert delivered == 2 and digest.pending == 0
+    assert "от 1 " in sent[0] and "от 3 " in sent[0]
+    with open(path + ".bad", "rb") as f:
+        assert f.read() == b'{"user_id": 2, "ts": \n'
+    digest.close()
+
+
+def test_background_task_survives_unexpected_error(tmp_path):
+    digest = AdminDigest(1, str(tmp_path / "admin.jsonl"), interval=0.01)
+
+    async def scenario():
+        bot = Bot(fail=2)
+        await digest.start(bot)
+        digest.submit({"user_id": 1, "ts": "t", "answers": ["a"]})
+        for _ in range(100):
+            if bot.sent:
+                break
+            await asyncio.sleep(0.01)
+        await digest.stop()
+        return bot.sent
+
+    assert len(asyncio.run(scenario())) == 1 and digest.pending == 0
+    digest.close()
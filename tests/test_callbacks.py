@@ -0,0 +1,136 @@
+"""Идемпотентные колбэки: дубли и нажатия не по порядку не записывают ответ второй раз."""
+
+import asyncio, copy, random
+from collections import defaultdict
+
+from telegram import Update
+
+import etap_test_bot as bot
+from questions import EPOCHS, parse_answer
+from benchmarks.fake_telegram import (
+    FakeBotAPI, UpdateTracker, callback_update, fake_builder, text_update, update_ids, walk_user,
+)
+
+
+def replayed(data):
+    """Тот же колбэк ещё раз: двойной тап или повторная доставка."""
+    dup = copy.deepcopy(data)
+    dup["update_id"] = next(update_ids)
+    dup["callback_query"]["id"] = str(next(update_ids))
+    return dup
+
+
+def test_duplicate_and_out_of_order_callbacks_recorded_once():
+    async def scenario(users):
+        api = FakeBotAPI()
+        app = bot.build_app(fake_builder(api), concurrent_updates=8)
+        tracker = UpdateTracker(app)
+
+        async def deliver(data):
+            await app.update_queue.put(Update.de_json(data, app.bot))
+
+        feed_one = tracker.feed(deliver)
+        intended, last_tap, sessions = defaultdict(list), {}, {}
+
+        async def feed(data):
+            cq = data.get("callback_query")
+            ans = parse_answer(cq["data"]) if cq else None
+            if ans is None:
+                await feed_one(data)
+                return
+            uid = cq["from"]["id"]
+            intended[uid].append(ans[2])
+            # вместе с нажатием — его дубль и повтор предыдущего нажатия
+            extra = [replayed(data), replayed(last_tap[uid])] if uid in last_tap else []
+            last_tap[uid] = data
+            await asyncio.gather(feed_one(data), *map(feed_one, extra))
+            sessions[uid] = app.user_data[uid]["sess"]
+
+        async with app:
+            await app.start()
+            uids = range(1000, 1000 + users)
+            await asyncio.gather(*(walk_user(app, api, uid, random.Random(uid), feed=feed) for uid in uids))
+            await app.stop()
+        return sessions, intended
+
+    sessions, intended = asyncio.run(scenario(5))
+    n_scale = bot.CONTENT.current.n_scale
+    assert len(sessions) == 5
+    for uid, sess in sessions.items():
+        assert list(sess.scale) == intended[uid][:n_scale], uid
+        assert sess.c_bits == sum(1 << i for i, v in enumerate(intended[uid][n_scale:]) if v), uid
+
+
+def test_button_from_previous_run_ignored_after_restart():
+    async def scenario():
+        api = FakeBotAPI()
+        app = bot.build_app(fake_builder(api))
+        uid = 7
+        async with app:
+            await app.start()
+            last = {}
+
+            async def feed(data):
+                if "callback_query" in data:
+                    last["tap"] = data
+                await app.process_update(Update.de_json(data, app.bot))
+
+            await walk_user(app, api, uid, random.Random(uid), feed=feed, max_taps=10)
+            await feed(text_update(uid, "/start"))
+            await app.process_update(Update.de_json(replayed(last["tap"]), app.bot))
+            await app.stop()
+        return app.user_data[uid]["sess"]
+
+    sess = asyncio.run(scenario())
+    assert sess.epoch == 1 and sess.pos == 0
+
+
+def test_button_from_run_a_multiple_of_epochs_ago_ignored():
+    async def scenario():
+        api = FakeBotAPI()
+        app = bot.build_app(fake_builder(api))
+        uid = 8
+        async with app:
+            await app.start()
+
+            async def run():
+                await app.process_update(Update.de_json(text_update(uid, "/start"), app.bot))
+                await app.process_update(Update.de_json(callback_update(uid, "start_A", api.last_message_id[uid]),
+                                                        app.bot))
+                return callback_update(uid, api.keyboards[uid][0], api.last_message_id[uid])
+
+            old = await run()
+            for _ in range(EPOCHS):
+                tap = await run()
+            await app.process_update(Update.de_json(old, app.bot))  # эпоха 0 ≡ 8 по модулю EPOCHS
+            stale = app.user_data[uid]["sess"].pos
+            await app.process_update(Update.de_json(tap, app.bot))
+            await app.stop()
+        return stale, app.user_data[uid]["sess"], api.keyboards[uid]
+
+    stale, sess, keyboard = asyncio.run(scenario())
+    assert stale == 0 and sess.epoch == EPOCHS and sess.pos == 1
+    assert keyboard[0].startswith(f"q|{EPOCHS}|1|")  # клавиатура сверх заранее собранных
+
+
+def test_dropped_callback_is_answered():
+    async def scenario():
+        api = FakeBotAPI()
+        app = bot.build_app(fake_builder(api))
+        uid = 42
+        async with app:
+            await app.start()
+            await app.process_update(Update.de_json(text_update(uid, "/start"), app.bot))
+            await app.process_update(Update.de_json(callback_update(uid, "start_A", api.last_message_id[uid]),
+                                                    app.bot))
+            tap = callback_update(uid, api.keyboards[uid][0], api.last_message_id[uid])
+            await app.process_update(Update.de_json(tap, app.bot))
+            answered, edits = api.calls["answerCallbackQuery"], api.calls["editMessageText"]
+            await app.process_update(Update.de_json(replayed(tap), app.bot))
+            await app.stop()  # дожидается фоновых задач
+        return api, answered, edits, app.user_data[uid]["sess"]
+
+    api, answered, edits, sess = asyncio.run(scenario())
+    assert api.calls["answerCallbackQuery"] == answered + 1
+    assert api.calls["editMessageText"] == edits
+    assert sess.pos == 1
@@ -0,0 +1,92 @@
+"""Проверка файлов вопросов и интерпретаций, горячая замена с ошибками."""
+
+import asyncio, json, os, shutil
+
+import pytest
+
+import etap_test_bot as bot
+from content import MAX_BLOCK, ContentError, ContentStore, level_index
+from scoring import Ruleset, RulesetError
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load(name):
+    with open(os.path.join(HERE, name), encoding="utf-8") as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("patch", [
+    lambda i: i.update({"3": []}),
+    lambda i: i["3"].update(levels=["low"]),
+    lambda i: i["3"]["levels"].update(low="text"),
+])
+def test_wrong_shapes_rejected(patch):
+    interpretations = load("interpretations.json")
+    patch(interpretations)
+    with pytest.raises(ContentError):
+        level_index(load("questions_b.json"), interpretations)
+
+
+def test_block_too_large_for_results_file_rejected():
+    blocks = load("questions_b.json")
+    blocks["B3"] = [f"Вопрос {i}" for i in range(MAX_BLOCK + 1)]
+    with pytest.raises(ContentError, match="B3 has 64 questions"):
+        level_index(blocks, load("interpretations.json"))
+
+
+def store(tmp_path, on_load=None):
+    for name in ("questions_b.json", "interpretations.json"):
+        shutil.copy(os.path.join(HERE, name), tmp_path / name)
+    return ContentStore(str(tmp_path / "questions_b.json"), str(tmp_path / "interpretations.json"),
+                        bot.BLOCK_A, bot.BLOCK_C, (bot.A, bot.B, bot.C), interval=0.01, on_load=on_load)
+
+
+def test_watcher_survives_bad_file_and_failing_hook(tmp_path):
+    calls = []
+
+    def on_load(content):
+        calls.append(content.version)
+        if len(calls) == 2:
+            raise RuntimeError("hook failed")
+
+    content = store(tmp_path, on_load)
+    first = content.current.version
+
+    async def scenario():
+        content.start()
+        path = tmp_path / "interpretations.json"
+        interpretations = load("interpretations.json")
+        for step, change in enumerate(({"1": "not an object"}, {"title": "hook fails"}, {"title": "accepted"})):
+            data = json.loads(json.dumps(interpretations))
+            if "title" in change:
+                data["1"]["title"] = change["title"]
+            else:
+                data.update(change)
+            path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            os.utime(path, ns=(10**9, (step + 10) * 10**9))  # mtime меняется и в пределах одной секунды
+            await asyncio.sleep(0.1)
+        content.stop()
+
+    asyncio.run(scenario())
+    assert content.current.version != first
+    assert content.current.levels[1][0][0]["title"] == "accepted"
+    assert len(calls) == 3
+
+
+def test_reload_checked_against_ruleset(tmp_path):
+    content = store(tmp_path, bot.content_loader(Ruleset()))
+    first = content.current.version
+    blocks = load("questions_b.json")
+    blocks["B2"] = blocks["B2"][:3]  # 3 × 4 < порога 27
+    (tmp_path / "questions_b.json").write_text(json.dumps(blocks, ensure_ascii=False), encoding="utf-8")
+    assert not asyncio.run(content.reload())
+    assert content.current.version == first
+
+
+def test_ruleset_positions_checked_against_block_c():
+    content = bot.CONTENT.current
+    n_c = len(content.questions) - content.n_scale
+    Ruleset(ideal_true=[n_c - 1], ideal_false=[]).check(content)
+    with pytest.raises(RulesetError, match="block C"):
+        Ruleset(ideal_true=[n_c], ideal_false=[]).check(content)
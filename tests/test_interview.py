@@ -0,0 +1,68 @@
+"""Блок D: лимиты ответов, восстановление сессии и удаление файла интервью."""
+
+import asyncio, os, pickle, time
+
+import etap_test_bot as bot
+from interview import InterviewSpool
+from benchmarks.bench_interview import say, to_interview
+from benchmarks.fake_telegram import FakeBotAPI, fake_builder
+
+
+def run_interview(answers, uid=1000):
+    """Открывает Блок D, отправляет ``answers``; возвращает ответы бота, сессию и путь к файлу интервью."""
+
+    async def scenario():
+        api = FakeBotAPI()
+        app = bot.build_app(fake_builder(api))
+        async with app:
+            await app.start()
+            await to_interview(app, api, uid)
+            replies = [await say(app, api, uid, text) for text in answers]
+            sess = app.user_data[uid]["sess"]
+            path = sess.d_answers.path if sess.d_answers is not None else None
+            await app.stop()
+        return replies, sess, path
+
+    return asyncio.run(scenario())
+
+
+def test_answer_and_interview_limits(monkeypatch):
+    spool = InterviewSpool(bot.ANSWERS.directory, answer_limit=10, session_limit=25)
+    monkeypatch.setattr(bot, "ANSWERS", spool)
+    replies, sess, _ = run_interview(["x" * 15, "y" * 10, "z" * 10, "w"])
+    assert replies[0].startswith("(Ответ сохранён не полностью: первые 9 символов.)") and "D2/" in replies[0]
+    assert "первые 4 символов" in replies[2]
+    assert replies[3].startswith("(Достигнут предел длины интервью")
+    assert list(sess.d_answers) == ["x" * 9 + "…", "y" * 10, "z" * 4 + "…", "…"]
+    assert spool.truncated.value == 3
+
+
+def test_restored_session_skips_unsaved_frame(answers):
+    _, sess, path = run_interview(["ответ 0", "ответ 1"])
+    saved = pickle.loads(pickle.dumps(sess))  # как в хранилище сессий
+    answers.add(sess.d_answers, "ответ 2, записан перед падением")
+    assert len(list(sess.d_answers)) == 3
+    assert list(saved.d_answers) == ["ответ 0", "ответ 1"]
+    assert saved.d_answers.path == path
+
+
+def test_stop_removes_interview_file():
+    _, _, path = run_interview(["ответ 0"])
+    assert os.path.exists(path)  # файл есть, пока интервью не прервано
+    replies, sess, _ = run_interview(["ответ 0", "/stop"], uid=1001)
+    assert replies[-1] == "Диагностика прервана."
+    assert sess.d_answers is None
+    assert not any(name.startswith("1001-") for name in os.listdir(bot.ANSWERS.directory))
+
+
+def test_finished_interview_file_removed_without_report():
+    replies, sess, path = run_interview([f"ответ {i}" for i in range(len(bot.BLOCK_D))])
+    assert len(sess.d_answers) == len(bot.BLOCK_D)
+    assert not os.path.exists(path)
+
+
+def test_sweep_touches_only_own_shard(answers):
+    for uid in (10, 11, 12):
+        answers.add(answers.new(uid), "ответ")
+    assert answers.sweep(now=time.time() + answers.ttl + 1, shard=(0, 2)) == 2
+    assert [name.split("-")[0] for name in os.listdir(answers.directory)] == ["11"]
@@ -0,0 +1,29 @@
+"""Датчики: значения всех экземпляров, сбой датчика не роняет отчёты."""
+
+from metrics import REGISTRY, Registry, perf_report
+from outbox import BULK, INTERACTIVE, SendScheduler
+from sessions import SessionKeeper
+
+
+def test_queue_depth_covers_every_scheduler():
+    first, second = SendScheduler(), SendScheduler()
+    first.depth[INTERACTIVE], second.depth[INTERACTIVE], second.depth[BULK] = 2, 3, 1
+    values = {labels["priority"]: v for labels, v in REGISTRY.read_gauge("etap_send_queue_depth")
+              if "tenant" not in labels}
+    assert values["interactive"] >= 5 and values["bulk"] >= 1
+
+
+def test_failing_gauge_does_not_break_reports():
+    registry = Registry()
+    registry.gauge("etap_broken", "Broken gauge", lambda: 1 / 0)
+    registry.gauge("etap_fine", "Fine gauge", lambda: [({}, 7)])
+    assert "Fine gauge: всего=7" in perf_report(registry)
+    assert "etap_fine 7" in registry.expose()
+
+
+def test_sessions_gauge_per_tenant(tmp_path):
+    first = SessionKeeper(str(tmp_path / "a.db"), tenant="alpha")
+    second = SessionKeeper(str(tmp_path / "b.db"), tenant="beta")
+    first.spilled, second.spilled = 2, 5
+    values = {(labels.get("tenant"), labels["where"]): v for labels, v in REGISTRY.read_gauge("etap_sessions")}
+    assert values["alpha", "spilled"] == 2 and values["beta", "spilled"] == 5
@@ -0,0 +1,94 @@
+"""SendScheduler против fake Bot API, который отвечает 429."""
+
+import asyncio
+
+from telegram.error import RetryAfter
+
+import etap_test_bot as bot
+from outbox import SendScheduler
+from benchmarks.fake_telegram import FakeBotAPI, fake_builder
+
+
+async def started(api, scheduler=None):
+    app = bot.build_app(fake_builder(api), rate_limiter=scheduler)
+    await app.initialize()
+    return app
+
+
+def test_global_budget_avoids_flood_errors():
+    async def scenario(scheduled):
+        api = FakeBotAPI(flood_global=30)
+        app = await started(api, SendScheduler(global_rate=30) if scheduled else None)
+        results = await asyncio.gather(*(app.bot.send_message(c, "hi") for c in range(1, 41)),
+                                       return_exceptions=True)
+        await app.shutdown()
+        return sum(isinstance(r, RetryAfter) for r in results), api.calls["429"]
+
+    assert asyncio.run(scenario(False))[0] > 0
+    assert asyncio.run(scenario(True)) == (0, 0)
+
+
+def test_pending_edits_coalesced_to_latest():
+    async def scenario():
+        api = FakeBotAPI()
+        sched = SendScheduler(chat_rate=1, chat_burst=1)
+        app = await started(api, sched)
+        await app.bot.send_message(1, "q0")
+        msg_id = api.last_message_id[1]
+        results = await asyncio.gather(*(app.bot.edit_message_text(f"q{i}", chat_id=1, message_id=msg_id)
+                                         for i in range(1, 11)))
+        await app.shutdown()
+        return api, sched, results
+
+    api, sched, results = asyncio.run(scenario())
+    assert api.last_text[1] == "q10"
+    assert api.calls["editMessageText"] < 10 and sched.coalesced == 10 - api.calls["editMessageText"]
+    assert all(r.text == "q10" for r in results[-2:])
+
+
+def test_chat_order_kept_and_retry_after_429():
+    async def scenario():
+        api = FakeBotAPI(flood_chat=2, retry_after=1)
+        sent = []
+        handle = api.handle
+
+        def record(method, params):
+            if method == "sendMessage":
+                sent.append(params["text"])
+            return handle(method, params)
+
+        api.handle = record
+        sched = SendScheduler(chat_rate=10, chat_burst=10, backoff=0.1)
+        app = await started(api, sched)
+        await asyncio.gather(*(app.bot.send_message(1, f"m{i}") for i in range(5)))
+        await app.shutdown()
+        return api, sched, sent
+
+    api, sched, sent = asyncio.run(scenario())
+    assert sent == [f"m{i}" for i in range(5)]
+    assert api.calls["429"] > 0 and sched.retries == api.calls["429"] and sched.failed == 0
+
+
+def test_interactive_before_bulk():
+    async def scenario():
+        api = FakeBotAPI()
+        sched = SendScheduler(global_rate=20, bulk_chats=range(100, 200))
+        app = await started(api, sched)
+        order = []
+        handle = api.handle
+
+        def record(method, params):
+            order.append(int(params["chat_id"]))
+            return handle(method, params)
+
+        api.handle = record
+        bulk = [app.bot.send_message(100 + i, "digest") for i in range(20)]
+        users = [app.bot.send_message(1 + i, "next question") for i in range(20)]
+        await asyncio.gather(*bulk, *users)
+        await app.shutdown()
+        return order
+
+    order = asyncio.run(scenario())
+    last_user = max(i for i, chat in enumerate(order) if chat < 100)
+    # Первые запросы уходят по запасу токенов, дальше пользователи обгоняют рассылку
+    assert sum(chat >= 100 for chat in order[:last_user]) < 10
@@ -0,0 +1,55 @@
+"""split_html: длинный результат делится на сообщения, не ломая разметку."""
+
+import re
+
+import pytest
+
+import etap_test_bot as bot
+from content import MAX_ANSWER
+from result_text import MESSAGE_LIMIT, RU, result_templates, split_html
+
+
+def balanced(part):
+    """Каждый открытый тег закрыт в той же части, в правильном порядке."""
+    stack = []
+    for closing, name in re.findall(r"<(/?)([a-z]+)[^>]*>", part):
+        if closing:
+            assert stack and stack.pop() == name, part
+        else:
+            stack.append(name)
+    return not stack
+
+
+def test_long_text_split_at_paragraphs():
+    paragraphs = [f"Абзац {i}: " + "слово " * 60 for i in range(40)]
+    parts = split_html("\n".join(paragraphs))
+    assert len(parts) > 1 and all(len(part) <= MESSAGE_LIMIT for part in parts)
+    assert "\n".join(parts).split("\n") == paragraphs  # ни один абзац не разрезан
+
+
+def test_open_tags_closed_and_reopened():
+    text = "<b>Рекомендации: <i>" + "совет " * 2000 + "</i></b>"
+    parts = split_html(text)
+    assert len(parts) > 1
+    assert all(balanced(part) and len(part) <= MESSAGE_LIMIT for part in parts)
+    assert all(part.startswith("<b>Рекомендации") or part.startswith("<b><i>") for part in parts)
+    assert re.sub(r"</?[bi]>", "", "".join(parts)).replace(" ", "") == re.sub(r"</?[bi]>", "", text).replace(" ", "")
+
+
+@pytest.mark.parametrize("shift", range(5))
+def test_entity_not_cut(shift):
+    word = "x" * shift + "&amp;" * 3000  # одно «слово» без пробелов длиннее лимита
+    parts = split_html(word, limit=1000)
+    assert len(parts) > 1 and all(len(part) <= 1000 for part in parts)
+    assert all(re.fullmatch(r"x*(?:&amp;)*", part) for part in parts)
+    assert "".join(parts) == word
+
+
+def test_render_rejects_sum_out_of_block_range():
+    content = bot.CONTENT.current
+    templates = result_templates(content, RU)
+    _, level, _ = content.level(1, 0)
+    key, _, size = content.b_layout[0]
+    assert templates.render(1, level, {key: MAX_ANSWER * size}, 0, False)
+    with pytest.raises(KeyError):
+        templates.render(1, level, {key: MAX_ANSWER * size + 1}, 0, False)
@@ -0,0 +1,55 @@
+"""Файл результатов после падения: недописанная запись и устаревшие агрегаты."""
+
+import os
+
+from results import HEADER, RECORD, Aggregates, ResultStore
+
+
+def fill(store, n, ts0=1000):
+    for i in range(n):
+        store.append([i % 5] * 8, [i % 40] * 7, i, i % 8, i % 6, ts=ts0 + i)
+
+
+def test_unfinished_record_dropped_on_open(tmp_path):
+    path = str(tmp_path / "results.bin")
+    store = ResultStore(path)
+    fill(store, 3)
+    store._file.write(b"\x01" * 5)  # процесс упал посреди записи
+    store._file.close()
+
+    store = ResultStore(path)
+    assert store.rows == 3 and os.path.getsize(path) == HEADER + 3 * RECORD.itemsize
+    fill(store, 1, ts0=2000)
+    assert store.view()["ts"].tolist() == [1000, 1001, 1002, 2000]
+    store.close()
+
+
+def test_aggregates_checkpointed_while_running(tmp_path):
+    path = str(tmp_path / "results.bin")
+    store = ResultStore(path, checkpoint_every=10)
+    fill(store, 25)
+    expected = store.summary(warning=4)
+    store._file.close()  # без close(): агрегаты сохранены только по checkpoint_every
+
+    reopened = ResultStore(path, checkpoint_every=10)
+    assert reopened.summary(warning=4) == expected
+    reopened.close()
+
+
+def test_replaced_file_reaggregated(tmp_path):
+    path = str(tmp_path / "results.bin")
+    store = ResultStore(path)
+    fill(store, 5)
+    store.close()
+    agg = path + ".agg.npz"
+    os.replace(agg, agg + ".old")
+    os.remove(path)
+    store = ResultStore(path)
+    fill(store, 8, ts0=5000)
+    store._file.close()
+    os.replace(agg + ".old", agg)  # старые агрегаты от другого файла
+
+    store = ResultStore(path)
+    assert store.summary(warning=4)["count"] == 8
+    assert store.summary(warning=4) == Aggregates().add(store.view()).summary(4)
+    store.close()
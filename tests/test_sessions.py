@@ -0,0 +1,88 @@
+"""SessionKeeper и внутреннее состояние PTB, на которое он опирается."""
+
+import asyncio, gc, json, os, random, shutil
+
+import pytest
+from telegram import Update
+from telegram.ext import ConversationHandler
+
+import etap_test_bot as bot
+from content import ContentStore
+from sessions import SessionKeeper
+from benchmarks.fake_telegram import FakeBotAPI, callback_update, fake_builder, walk_user
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_bind_accepts_installed_ptb(tmp_path):
+    keeper = SessionKeeper(str(tmp_path / "spill.db"))
+    bot.build_app(fake_builder(FakeBotAPI()), sessions=keeper)  # bind() внутри
+    assert keeper._conv is not None
+
+
+def test_bind_fails_loudly_without_ptb_internals(tmp_path, monkeypatch):
+    keeper = SessionKeeper(str(tmp_path / "spill.db"))
+    app = bot.build_app(fake_builder(FakeBotAPI()))
+    conv = next(h for h in app.handlers[0] if isinstance(h, ConversationHandler))
+    monkeypatch.delattr(app, "_user_ids_to_be_deleted_in_persistence")
+    with pytest.raises(RuntimeError, match="_user_ids_to_be_deleted_in_persistence"):
+        keeper.bind(app, conv)
+
+
+def test_shard_counts_and_expires_only_its_rows(tmp_path):
+    path = str(tmp_path / "spill.db")
+    keeper = SessionKeeper(path)
+    keeper._commit({uid: b"x" for uid in range(10)})
+    keeper._db.execute("UPDATE spilled SET ts = 0")
+    keeper._db.commit()
+    even = SessionKeeper(path, shard=(0, 2))
+    assert even.spilled == 5
+    assert even._commit({}) == 0  # просроченные строки своих пользователей удалены
+    odd = SessionKeeper(path, shard=(1, 2))
+    assert odd.spilled == 5
+
+
+def test_spilled_session_keeps_its_question_version(tmp_path, monkeypatch):
+    shutil.copy(os.path.join(HERE, "interpretations.json"), tmp_path)
+    path = tmp_path / "questions_b.json"
+    with open(os.path.join(HERE, "questions_b.json"), encoding="utf-8") as f:
+        blocks = json.load(f)
+
+    def write(suffix):  # та же раскладка, другой текст — и версия не совпадает с общей bot.CONTENT
+        blocks["B1"][0] = blocks["B1"][0].split(" [")[0] + suffix
+        path.write_text(json.dumps(blocks, ensure_ascii=False), encoding="utf-8")
+
+    write(" [v1]")
+    store = ContentStore(str(tmp_path / "questions_b.json"), str(tmp_path / "interpretations.json"),
+                         bot.BLOCK_A, bot.BLOCK_C, (bot.A, bot.B, bot.C), interval=0)
+    monkeypatch.setattr(bot, "CONTENT", store)
+    keeper = SessionKeeper(str(tmp_path / "spill.db"), ttl=0, grace=0, keep=bot.session_content)
+    uid = 5
+
+    async def scenario():
+        api = FakeBotAPI()
+        app = bot.build_app(fake_builder(api), sessions=keeper)
+        async with app:
+            await app.start()
+            await walk_user(app, api, uid, random.Random(uid), max_taps=5)
+            first = app.user_data[uid]["sess"].content.version
+            await keeper.sweep()
+            assert uid not in app.user_data
+            write(" [v2]")
+            assert await store.reload() and store.current.version != first
+            gc.collect()
+            tap = callback_update(uid, api.keyboards[uid][0], api.last_message_id[uid])
+            await app.process_update(Update.de_json(tap, app.bot))
+            sess = app.user_data[uid]["sess"]
+            await app.stop()
+        return first, sess
+
+    first, sess = asyncio.run(scenario())
+    assert sess.content.version == first
+
+
+def test_other_layout_with_same_total_not_resolved():
+    content = bot.CONTENT.current
+    moved = (content.b_sizes[0] + 1, content.b_sizes[1] - 1) + content.b_sizes[2:]
+    assert bot.CONTENT.resolve("gone", content.n_scale, content.b_sizes) is content
+    assert bot.CONTENT.resolve("gone", content.n_scale, moved) is None
@@ -0,0 +1,113 @@
+"""Соединение диспетчера с воркерами: проверка ключа и кадры служб, которых нет."""
+
+import asyncio, json, logging, threading
+
+import etap_test_bot as bot
+import shard
+from shard import ShardDispatcher, _mac, _read_frame, _write_frame
+
+
+async def connect(dispatcher, server, key=None, index=0):
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    kind, challenge = await _read_frame(reader)
+    assert kind == shard.CHALLENGE
+    mac = _mac(key if key is not None else dispatcher._authkey, challenge, index)
+    _write_frame(writer, shard.AUTH, json.dumps({"index": index, "mac": mac}).encode())
+    return reader, writer
+
+
+def test_connection_with_wrong_key_rejected():
+    async def scenario():
+        dispatcher = ShardDispatcher(None, 1)
+        dispatcher._ready = [asyncio.Event()]
+        server = await asyncio.start_server(dispatcher._serve_worker, "127.0.0.1", 0)
+        reader, writer = await connect(dispatcher, server, key=b"x" * 32)
+        _write_frame(writer, shard.HELLO)
+        closed = await reader.read() == b""
+        writer.close()
+        server.close()
+        return closed, dispatcher._links[0]
+
+    closed, link = asyncio.run(scenario())
+    assert closed and link is None
+
+
+def test_frames_for_absent_services_and_bad_frames_keep_link(caplog):
+    class Results:
+        def __init__(self):
+            self.rows = []
+
+        def append(self, *row):
+            self.rows.append(row)
+
+    async def scenario():
+        results = Results()
+        dispatcher = ShardDispatcher(None, 1, results=results)
+        dispatcher._ready = [asyncio.Event()]
+        server = await asyncio.start_server(dispatcher._serve_worker, "127.0.0.1", 0)
+        reader, writer = await connect(dispatcher, server)
+        _write_frame(writer, shard.HELLO)
+        await asyncio.wait_for(dispatcher._ready[0].wait(), 5)
+        _write_frame(writer, shard.DIGEST, json.dumps({"user_id": 1, "answers": []}).encode())  # сводок нет
+        _write_frame(writer, shard.RESULT, b"not json")
+        _write_frame(writer, shard.RESULT, json.dumps([[0] * 8, [0] * 7, 0, 1, 2]).encode())
+        await writer.drain()
+        for _ in range(100):
+            if results.rows:
+                break
+            await asyncio.sleep(0.01)
+        link = dispatcher._links[0]
+        writer.close()
+        server.close()
+        return results.rows, link
+
+    with caplog.at_level(logging.ERROR, "EtapBot.shard"):
+        rows, link = asyncio.run(scenario())
+    assert rows == [([0] * 8, [0] * 7, 0, 1, 2)]
+    assert link is not None
+    assert "could not handle a frame" in caplog.text
+
+
+def test_each_worker_serves_its_own_metrics(monkeypatch):
+    monkeypatch.setattr(bot, "METRICS_PORT", 9100)
+    monkeypatch.setattr(bot, "PERSISTENCE_DB", "")
+    monkeypatch.setattr(bot, "SESSION_SPILL_DB", "")
+    ports = [bot.make_shard_app(i, 2, None, None).bot_data["metrics_server"].listener.port for i in range(2)]
+    assert ports == [9101, 9102]  # 9100 — у диспетчера
+
+
+def test_stats_since_answered_from_a_thread(tmp_path, monkeypatch):
+    from results import ResultStore
+
+    store = ResultStore(str(tmp_path / "results.bin"))
+    for ts in (100, 200, 300):
+        store.append([0] * 8, [1] * 7, 0, 1, 2, ts=ts)
+    threads = []
+    summary = store.summary
+
+    def spy(*args, **kwargs):
+        threads.append(threading.current_thread() is threading.main_thread())
+        return summary(*args, **kwargs)
+
+    monkeypatch.setattr(store, "summary", spy)
+
+    async def scenario():
+        dispatcher = ShardDispatcher(None, 1, results=store)
+        dispatcher._ready = [asyncio.Event()]
+        server = await asyncio.start_server(dispatcher._serve_worker, "127.0.0.1", 0)
+        reader, writer = await connect(dispatcher, server)
+        _write_frame(writer, shard.HELLO)
+        replies = []
+        for req, since in ((1, 150), (2, None)):
+            _write_frame(writer, shard.STATS, json.dumps([req, [since, 4]]).encode())
+            kind, payload = await asyncio.wait_for(_read_frame(reader), 5)
+            replies.append(json.loads(payload))
+        writer.close()
+        server.close()
+        return replies
+
+    replies = asyncio.run(scenario())
+    store.close()
+    assert [(req, s["count"]) for req, s in replies] == [(1, 2), (2, 3)]
+    assert threads == [False, True]  # «за период» — в потоке, «всё время» — готовые агрегаты на цикле
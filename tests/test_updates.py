@@ -0,0 +1,89 @@
+"""Параллельная обработка апдейтов: по одному на пользователя, без сбоя позиции в тесте."""
+
+import asyncio, random
+
+from telegram import Update
+
+import etap_test_bot as bot
+from benchmarks.fake_telegram import FakeBotAPI, UpdateTracker, WebhookClient, fake_builder, text_update, walk_user
+from webhook import PerUserUpdateProcessor, webhook_listener
+
+
+def update(uid):
+    return Update.de_json(text_update(uid, "x"), None)
+
+
+def test_updates_of_one_user_in_order_others_in_parallel():
+    async def scenario():
+        proc = PerUserUpdateProcessor(4)
+        rng = random.Random(1)
+        seen, running, peak = {}, [0], [0]
+
+        async def work(uid, i):
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+            await asyncio.sleep(rng.uniform(0, 0.005))
+            seen.setdefault(uid, []).append(i)
+            running[0] -= 1
+
+        await asyncio.gather(*(proc.process_update(update(uid), work(uid, i))
+                               for i in range(20) for uid in range(10)))
+        return seen, peak[0]
+
+    seen, peak = asyncio.run(scenario())
+    assert all(order == list(range(20)) for order in seen.values())
+    assert peak == 4
+
+
+def test_burst_of_one_user_does_not_take_all_slots():
+    async def scenario():
+        proc = PerUserUpdateProcessor(2)
+        done = {}
+
+        async def work(key):
+            await asyncio.sleep(0.05)
+            done[key] = asyncio.get_running_loop().time()
+
+        t0 = asyncio.get_running_loop().time()
+        burst = [asyncio.create_task(proc.process_update(update(1), work(("burst", i)))) for i in range(6)]
+        await asyncio.sleep(0)
+        await proc.process_update(update(2), work("other"))
+        await asyncio.gather(*burst)
+        return {key: t - t0 for key, t in done.items()}
+
+    done = asyncio.run(scenario())
+    assert done["other"] < 0.1  # не ждёт, пока пройдёт серия первого пользователя
+    assert done[("burst", 5)] > 0.25
+    assert PerUserUpdateProcessor(2).max_concurrent_updates == 2
+
+
+def test_webhook_concurrent_walk_keeps_positions():
+    async def scenario(users):
+        api = FakeBotAPI(latency=0.001)
+        app = bot.build_app(fake_builder(api), concurrent_updates=8)
+        tracker = UpdateTracker(app)
+        listener = webhook_listener(app, "/hook", "127.0.0.1", 0, secret_token="s3cret")
+        async with app:
+            await app.start()
+            await listener.start()
+            client = WebhookClient("127.0.0.1", listener.port, "/hook", secret_token="s3cret")
+            intruder = WebhookClient("127.0.0.1", listener.port, "/hook", secret_token="wrong")
+            denied = await intruder.post(text_update(1, "/start"))
+
+            async def deliver(data):
+                assert await client.post(data) == 200
+
+            uids = range(1000, 1000 + users)
+            await asyncio.gather(*(walk_user(app, api, uid, random.Random(uid), feed=tracker.feed(deliver))
+                                   for uid in uids))
+            await client.close()
+            await intruder.close()
+            await listener.stop()
+            await app.stop()
+        return denied, [app.user_data[uid]["sess"] for uid in uids]
+
+    denied, sessions = asyncio.run(scenario(5))
+    assert denied == 403
+    for sess in sessions:
+        assert sess.n_scale == bot.CONTENT.current.n_scale and sess.c_idx == len(bot.BLOCK_C)
+        assert len(sess.d_answers) == len(bot.BLOCK_D)
@@ -0,0 +1,156 @@
+"""
+Webhook‑режим и параллельная обработка апдейтов
+================================================
+• ``PerUserUpdateProcessor`` — апдейты разных пользователей обрабатываются
+  параллельно, а апдейты одного пользователя — строго по очереди. Поэтому
+  медленный собеседник (например, отправка ответов администратору) не
+  тормозит остальных, а двойное нажатие не ломает позицию в ``Session``.
+• ``run_webhook`` — приём апдейтов от Telegram встроенным HTTP‑сервером
+  (``httplistener``) вместо long polling.
+"""
+
+from __future__ import annotations
+import asyncio, json, logging, signal
+from typing import Any, Awaitable, Dict, Optional
+from urllib.parse import urlsplit
+
+from telegram import Update
+from telegram.ext import Application, BaseUpdateProcessor
+
+from httplistener import HTTPListener
+
+log = logging.getLogger("EtapBot.webhook")
+
+
+# Семафор BaseUpdateProcessor берётся до do_process_update, то есть до замка пользователя:
+# с настоящим пределом там серия апдейтов одного пользователя заняла бы все места, ожидая
+# своей очереди. Поэтому там предел «без ограничения», а настоящий — в _run, под замком.
+_UNBOUNDED = 2 ** 30
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """До ``max_concurrent_updates`` апдейтов одновременно, но по одному на пользователя."""
+
+    def __init__(self, max_concurrent_updates: int):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates must be a positive integer")
+        self.limit = _UNBOUNDED  # BaseUpdateProcessor.__init__ размечает свой семафор по этому свойству
+        super().__init__(_UNBOUNDED)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiting: Dict[int, int] = {}  # сколько апдейтов ждут/держат замок пользователя
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = _user_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()  # asyncio.Lock будит ожидающих в порядке FIFO
+        self._waiting[key] = self._waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                await self._run(coroutine)
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key], self._locks[key]
+
+    @property
+    def max_concurrent_updates(self) -> int:
+        return self.limit
+
+    async def _run(self, coroutine: Awaitable[Any]) -> None:
+        """Обработка апдейта, когда очередь пользователя дошла до него: ждём свободное место."""
+        try:
+            await self._slots.acquire()
+        except asyncio.CancelledError:
+            coroutine.close()
+            raise
+        try:
+            await coroutine
+        finally:
+            self._slots.release()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+def _user_key(update: object) -> Optional[int]:
+    if not isinstance(update, Update):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+def webhook_listener(app: Application, path: str, host: str, port: int,
+                     secret_token: Optional[str] = None) -> HTTPListener:
+    """HTTP‑сервер, который кладёт пришедшие апдейты в ``app.update_queue``."""
+    return webhook_routes({path: app}, host, port, secret_token)
+
+
+def webhook_routes(routes: Dict[str, Application], host: str, port: int,
+                   secret_token: Optional[str] = None) -> HTTPListener:
+    """Один HTTP‑сервер на несколько ботов: путь запроса → Application."""
+
+    async def handle(method: str, target: str, headers: Dict[str, str], body: bytes):
+        app = routes.get(target.split("?", 1)[0]) if method == "POST" else None
+        if app is None:
+            return 404, "text/plain", b""
+        if secret_token and headers.get("x-telegram-bot-api-secret-token") != secret_token:
+            return 403, "text/plain", b""
+        try:
+            update = Update.de_json(json.loads(body), app.bot)
+        except ValueError:
+            return 400, "text/plain", b""
+        await app.update_queue.put(update)
+        return 200, "text/plain", b"OK"
+
+    return HTTPListener(handle, host, port)
+
+
+async def serve_webhook(app: Application, url: str, listen: str = "0.0.0.0", port: int = 8443,
+                        secret_token: Optional[str] = None,
+                        stop: Optional[asyncio.Event] = None) -> None:
+    """Регистрирует webhook в Telegram и обрабатывает апдейты, пока не выставлен ``stop``."""
+    stop = stop or asyncio.Event()
+    listener = webhook_listener(app, urlsplit(url).path or "/", listen, port, secret_token)
+    async with app:
+        await app.bot.set_webhook(url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES,
+                                  max_connections=min(100, max(app.update_processor.max_concurrent_updates, 40)))
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        await listener.start()
+        log.info("Webhook mode: %s", url)
+        try:
+            await stop.wait()
+        finally:
+            await listener.stop()
+            await app.stop()
+            if app.post_stop:
+                await app.post_stop(app)
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+
+
+def run_webhook(app: Application, url: str, listen: str = "0.0.0.0", port: int = 8443,
+                secret_token: Optional[str] = None) -> None:
+    """Блокирующий запуск webhook‑режима до SIGINT/SIGTERM (аналог ``run_polling``)."""
+
+    async def _main() -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await serve_webhook(app, url, listen, port, secret_token, stop)
+
+    asyncio.run(_main())